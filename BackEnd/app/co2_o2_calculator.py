@@ -1,12 +1,17 @@
 import os
-from datetime import datetime, date
-from typing import List, Dict, Any
+import time
+from datetime import datetime, date, timedelta
+from typing import List, Dict, Any, Optional, AsyncIterator
 from collections import defaultdict
 from dotenv import load_dotenv
-import pandas as pd
+import numpy as np
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, update, cast, Date
-from BackEnd.app.models import Species, WeatherData, PlotSpecies
+from sqlalchemy import select, update, delete, insert, func, cast, Date, text, and_, values, column, Integer, Float, TIMESTAMP, literal
+from BackEnd.app.models import Species, WeatherData, PlotSpecies, PlotSpeciesHourly
+from BackEnd.app.daily_stats import refresh_daily_stats, computed_composition_version, current_composition_version
+from BackEnd.app.leaderboard import refresh_leaderboard
+from BackEnd.app.regions import assign_plot_regions, refresh_region_daily_stats
+from BackEnd.app.credits import record_generated_credits
 import psycopg2
 
 # Carica le variabili dal file .env
@@ -19,6 +24,20 @@ RADIATION_NORMALIZER = 800  # W/m²
 TEMPERATURE_NORMALIZER = 25  # °C
 HUMIDITY_NORMALIZER = 60    # %
 
+# Numero massimo di righe per singolo UPDATE ... FROM (VALUES ...): 4 parametri per riga,
+# sotto il limite di 32767 parametri per statement del driver asyncpg
+WRITE_BATCH_SIZE = 5000
+
+# Giorni di dati meteo caricati e calcolati per volta nel ricalcolo su intervallo
+BACKFILL_CHUNK_DAYS = 7
+
+# Righe (ora × specie) lette dal cursore lato server e calcolate per volta:
+# limita la memoria del calcolo batch indipendentemente da giorni e terreni richiesti
+STREAM_BATCH_ROWS = 50000
+
+# Secondi tra due controlli di versione della tabella species nella cache dei coefficienti
+COEFFICIENTS_VERSION_CHECK_SECONDS = 30
+
 # Usa DATABASE_URL_SYNC dal .env per connessioni psycopg2
 DATABASE_URL = os.getenv("DATABASE_URL_SYNC")
 
@@ -53,8 +72,58 @@ def get_connection():
     return conn
 
 
-async def get_coefficients_from_db(db: AsyncSession) -> Dict[str, Dict[str, float]]:
-    """Recupera i coefficienti di assorbimento CO2 e produzione O2 per tutte le specie."""
+# Impronta della tabella species: cambia a ogni insert/update/delete ma restituisce una sola riga
+SPECIES_VERSION_QUERY = text("""
+    SELECT md5(COALESCE(string_agg(
+        id::text || ':' || name || ':' || COALESCE(co2_absorption_rate::text, '') || ':' || COALESCE(o2_production_rate::text, ''),
+        ',' ORDER BY id
+    ), ''))
+    FROM species
+""")
+
+
+class CoefficientsCache:
+    """
+    Cache di processo dei coefficienti delle specie.
+
+    La tabella `species` cambia raramente: i coefficienti vengono caricati una volta
+    e riutilizzati. Al massimo ogni `COEFFICIENTS_VERSION_CHECK_SECONDS` secondi si
+    confronta l'impronta della tabella con quella in cache, così più worker uvicorn
+    restano coerenti senza rileggere la tabella a ogni richiesta. Le modifiche fatte
+    da questo processo chiamano `invalidate()` e sono visibili subito.
+    """
+
+    def __init__(self, check_interval: float = COEFFICIENTS_VERSION_CHECK_SECONDS):
+        self.check_interval = check_interval
+        self.coefficients: Optional[Dict[str, Dict[str, float]]] = None
+        self.version: Optional[str] = None
+        self.checked_at = 0.0
+
+    def invalidate(self):
+        """Scarta i coefficienti in cache: la prossima lettura li ricarica dal database."""
+        self.coefficients = None
+        self.version = None
+        self.checked_at = 0.0
+
+    async def get(self, db: AsyncSession) -> Dict[str, Dict[str, float]]:
+        """Restituisce i coefficienti, ricaricandoli solo se la versione della tabella è cambiata."""
+        now = time.monotonic()
+        if self.coefficients is not None and now - self.checked_at < self.check_interval:
+            return self.coefficients
+
+        version = (await db.execute(SPECIES_VERSION_QUERY)).scalar()
+        if self.coefficients is None or version != self.version:
+            self.coefficients = await load_coefficients_from_db(db)
+            self.version = version
+        self.checked_at = now
+        return self.coefficients
+
+
+coefficients_cache = CoefficientsCache()
+
+
+async def load_coefficients_from_db(db: AsyncSession) -> Dict[str, Dict[str, float]]:
+    """Legge dal database i coefficienti di assorbimento CO2 e produzione O2 per tutte le specie."""
     stmt = select(Species.name, Species.co2_absorption_rate, Species.o2_production_rate)
     # Aggiunto 'await' qui
     result = await db.execute(stmt)
@@ -68,6 +137,27 @@ async def get_coefficients_from_db(db: AsyncSession) -> Dict[str, Dict[str, floa
     }
 
 
+async def get_coefficients_from_db(db: AsyncSession) -> Dict[str, Dict[str, float]]:
+    """
+    Recupera i coefficienti di assorbimento CO2 e produzione O2 per tutte le specie.
+
+    Passa dalla cache di processo `coefficients_cache`: il dizionario restituito è
+    condiviso e non va modificato.
+    """
+    return await coefficients_cache.get(db)
+
+
+async def get_coefficients_version(db: AsyncSession) -> Optional[str]:
+    """Restituisce l'impronta della tabella species dei coefficienti in cache (per chiavi di cache derivate)."""
+    await coefficients_cache.get(db)
+    return coefficients_cache.version
+
+
+def invalidate_coefficients_cache():
+    """Da chiamare dopo aver creato o modificato specie, per rendere subito visibili i nuovi coefficienti."""
+    coefficients_cache.invalidate()
+
+
 
 async def get_weather_data_from_db(db: AsyncSession, plot_id: int, day: str) -> List[Dict[str, Any]]:
     """Recupera i dati meteo orari per un dato terreno e giorno dal database."""
@@ -96,7 +186,8 @@ async def get_weather_data_from_db(db: AsyncSession, plot_id: int, day: str) ->
         "temperature": row.temperature,
         "humidity": row.humidity,
         "precipitation": row.precipitation,
-        "radiation": row.solar_radiation
+        "radiation": row.solar_radiation,
+        "meteo_factor": row.meteo_factor
     } for row in rows]
 
 
@@ -120,52 +211,422 @@ async def get_species_from_db(db: AsyncSession, plot_id: int) -> List[Dict[str,
     ]
 
 
-def calculate_co2_o2_hourly(plants: List[Dict[str, Any]], hourly_weather: List[Dict[str, Any]], coefficients: Dict[str, Dict[str, float]]) -> List[Dict[str, Any]]:
-    """Calcola l'assorbimento di CO2 e la produzione di O2 oraria per ogni specie.
+async def get_weather_data_range_from_db(db: AsyncSession, start: date, end: date, plot_ids: Optional[List[int]] = None) -> Dict[int, List[Dict[str, Any]]]:
+    """
+    Recupera con una sola query i dati meteo orari di un intervallo di giorni.
 
     Args:
-        plants: Lista di piante con specie e area.
-        hourly_weather: Dati meteo orari.
-        coefficients: Coefficienti di assorbimento/produzione per specie.
+        db (AsyncSession): La sessione asincrona del database.
+        start (date): Primo giorno dell'intervallo (incluso).
+        end (date): Ultimo giorno dell'intervallo (incluso).
+        plot_ids (Optional[List[int]]): Terreni da includere; None per tutti.
 
     Returns:
-        Lista di risultati orari con CO2 e O2 calcolati.
+        Dict[int, List[Dict[str, Any]]]: Dati meteo orari ordinati per data, raggruppati per terreno.
     """
-    # ... (questa funzione rimane invariata) ...
-    results = []
+    stmt = (
+        select(
+            WeatherData.plot_id,
+            WeatherData.date_time,
+            WeatherData.temperature,
+            WeatherData.humidity,
+            WeatherData.precipitation,
+            WeatherData.solar_radiation,
+            WeatherData.meteo_factor,
+        )
+        .where(
+            WeatherData.date_time >= datetime.combine(start, datetime.min.time()),
+            WeatherData.date_time <= datetime.combine(end, datetime.max.time())
+        )
+        .order_by(WeatherData.plot_id, WeatherData.date_time.asc())
+    )
+    if plot_ids is not None:
+        stmt = stmt.where(WeatherData.plot_id.in_(plot_ids))
+
+    result = await db.execute(stmt)
+
+    weather_by_plot = defaultdict(list)
+    for row in result:
+        weather_by_plot[row.plot_id].append({
+            "datetime": row.date_time,
+            "temperature": row.temperature,
+            "humidity": row.humidity,
+            "precipitation": row.precipitation,
+            "radiation": row.solar_radiation,
+            "meteo_factor": row.meteo_factor
+        })
+    return dict(weather_by_plot)
+
+
+def _round_like_python(values: np.ndarray, ndigits: int = 5) -> np.ndarray:
+    """
+    Arrotonda un array con lo stesso risultato di `round(x, ndigits)` di Python.
+
+    `np.round` moltiplica per 10**ndigits prima di arrotondare e può quindi
+    differire da `round` sui valori che cadono esattamente a metà. Le sole celle
+    ambigue (vicine a .5 dopo la scala, non finite o troppo grandi) vengono
+    ricalcolate con `round`, tutte le altre restano vettorizzate.
+
+    Args:
+        values (np.ndarray): Valori da arrotondare.
+        ndigits (int): Numero di cifre decimali.
+
+    Returns:
+        np.ndarray: Array arrotondato, identico bit a bit a `round` elemento per elemento.
+    """
+    scale = 10.0 ** ndigits
+    scaled = values * scale
+    rounded = np.rint(scaled) / scale
+
+    frac = np.abs(scaled - np.trunc(scaled))
+    ambiguous = (
+        (np.abs(frac - 0.5) <= np.maximum(np.abs(scaled), 1.0) * 1e-12)
+        | ~np.isfinite(values)
+        | (np.abs(values) >= 1e9)
+    )
+    for idx in np.flatnonzero(ambiguous):
+        rounded.flat[idx] = round(float(values.flat[idx]), ndigits)
+    return rounded
+
+
+def _normalized_factor(values: List[Any], normalizer: float) -> np.ndarray:
+    """Normalizza una colonna meteo: `min(v / normalizer, 1.0)`, 0 per i valori None."""
+    column = np.array(values, dtype=np.float64)
+    missing = np.isnan(column)
+    factor = np.minimum(np.where(missing, 0.0, column) / normalizer, 1.0)
+    factor[missing] = 0.0
+    return factor
+
+
+def compute_meteo_factor(radiation: Optional[float], temperature: Optional[float], humidity: Optional[float]) -> float:
+    """
+    Calcola il fattore meteo di una singola ora (radiazione × temperatura × umidità).
+
+    È lo stesso valore di `build_meteo_factors` per un'ora salvata: viene calcolato una
+    volta all'acquisizione e salvato in `weather_data.meteo_factor`.
+
+    Args:
+        radiation (Optional[float]): Radiazione solare (W/m²).
+        temperature (Optional[float]): Temperatura (°C).
+        humidity (Optional[float]): Umidità relativa (%).
+
+    Returns:
+        float: Il fattore meteo; un valore None azzera il fattore corrispondente.
+    """
+    return float(
+        _normalized_factor([radiation], RADIATION_NORMALIZER)[0]
+        * _normalized_factor([temperature], TEMPERATURE_NORMALIZER)[0]
+        * _normalized_factor([humidity], HUMIDITY_NORMALIZER)[0]
+    )
+
+
+def meteo_factor_column():
+    """
+    Espressione SQL del fattore meteo di `weather_data`: il valore salvato o, per le
+    righe acquisite prima della colonna `meteo_factor`, lo stesso calcolo in Postgres.
+    """
+    def normalized(value, normalizer: float):
+        return func.least(cast(func.coalesce(value, 0), Float) / literal(normalizer, Float), literal(1.0, Float))
+
+    computed = (
+        normalized(WeatherData.solar_radiation, RADIATION_NORMALIZER)
+        * normalized(WeatherData.temperature, TEMPERATURE_NORMALIZER)
+        * normalized(WeatherData.humidity, HUMIDITY_NORMALIZER)
+    )
+    return func.coalesce(WeatherData.meteo_factor, computed)
+
+
+def build_meteo_factors(hourly_weather: List[Dict[str, Any]]) -> np.ndarray:
+    """
+    Calcola il fattore meteo orario (radiazione × temperatura × umidità) come vettore.
+
+    Mantiene le stesse regole del calcolo scalare: le chiavi mancanti usano i valori
+    di default, i valori None azzerano il fattore corrispondente. Le ore che hanno già
+    il fattore salvato (chiave "meteo_factor") usano quello.
+
+    Args:
+        hourly_weather (List[Dict[str, Any]]): Dati meteo orari.
+
+    Returns:
+        np.ndarray: Vettore (ore,) con il fattore meteo di ogni ora.
+    """
+    rad_factor = _normalized_factor([h.get("radiation", 0) for h in hourly_weather], RADIATION_NORMALIZER)
+    temp_factor = _normalized_factor([h.get("temperature", DEFAULT_TEMPERATURE) for h in hourly_weather], TEMPERATURE_NORMALIZER)
+    hum_factor = _normalized_factor([h.get("humidity", DEFAULT_HUMIDITY) for h in hourly_weather], HUMIDITY_NORMALIZER)
+    factor = rad_factor * temp_factor * hum_factor
+
+    stored = np.array([h.get("meteo_factor") for h in hourly_weather], dtype=np.float64)
+    return np.where(np.isnan(stored), factor, stored)
+
+
+def build_species_vectors(plants: List[Dict[str, Any]], coefficients: Dict[str, Dict[str, float]]):
+    """
+    Costruisce i vettori specie: nomi, area e coefficienti CO2/O2.
+
+    Le piante la cui specie non ha coefficienti vengono scartate, come nel calcolo scalare.
+    Un coefficiente None viene trattato come 0.
+
+    Args:
+        plants (List[Dict[str, Any]]): Lista di piante con specie e area.
+        coefficients (Dict[str, Dict[str, float]]): Coefficienti per specie.
+
+    Returns:
+        tuple: (nomi, area, coefficienti CO2, coefficienti O2), con i tre vettori di forma (specie,).
+    """
+    names, areas, co2, o2 = [], [], [], []
     for plant in plants:
         species = plant.get("species", "").lower()
-        area = plant.get("area_m2", 0)
-
         if species not in coefficients:
             continue
+        names.append(species)
+        areas.append(plant.get("area_m2", 0))
+        co2.append(coefficients[species].get("co2") or 0)
+        o2.append(coefficients[species].get("o2") or 0)
+
+    return (
+        names,
+        np.array(areas, dtype=np.float64),
+        np.array(co2, dtype=np.float64),
+        np.array(o2, dtype=np.float64),
+    )
+
+
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def _group_index(keys: List[Any]):
+    """Restituisce le chiavi uniche ordinate e, per ogni elemento, l'indice del suo gruppo."""
+    unique = sorted(set(keys))
+    position = {key: i for i, key in enumerate(unique)}
+    return unique, np.array([position[key] for key in keys], dtype=np.intp)
+
+
+class CO2O2Result:
+    """
+    Risultato colonnare del calcolo CO2/O2.
+
+    Conserva i nomi delle specie (righe), i timestamp (colonne) e le matrici
+    CO2/O2 di forma (specie × ore), insieme ai dati meteo da cui derivano.
+    Le riduzioni per ora e per specie lavorano direttamente sugli array e gli
+    endpoint serializzano da qui, senza passare da liste di dict o DataFrame.
+
+    Attributes:
+        species (List[str]): Nome della specie per ogni riga.
+        timestamps (List[datetime]): Timestamp di ogni colonna.
+        co2 (np.ndarray): Assorbimento CO2 in kg/ora, forma (specie, ore).
+        o2 (np.ndarray): Produzione O2 in kg/ora, forma (specie, ore).
+        weather (List[Dict[str, Any]]): Dati meteo orari usati per il calcolo.
+    """
+
+    def __init__(self, species: List[str], timestamps: List[Any], co2: np.ndarray, o2: np.ndarray, weather: List[Dict[str, Any]]):
+        self.species = species
+        self.timestamps = timestamps
+        self.co2 = co2
+        self.o2 = o2
+        self.weather = weather
+
+    def is_empty(self) -> bool:
+        """True se il calcolo non ha prodotto alcun valore (nessuna specie o nessuna ora)."""
+        return self.co2.size == 0
+
+    def per_hour(self):
+        """
+        Somma CO2/O2 di tutte le specie per ogni ora (timestamp duplicati accorpati).
+
+        Returns:
+            tuple: (timestamp ordinati, CO2 per ora, O2 per ora).
+        """
+        hours, inverse = _group_index(self.timestamps)
+        co2 = np.zeros(len(hours))
+        o2 = np.zeros(len(hours))
+        np.add.at(co2, inverse, self.co2.sum(axis=0))
+        np.add.at(o2, inverse, self.o2.sum(axis=0))
+        return hours, co2, o2
+
+    def per_species(self):
+        """
+        Somma CO2/O2 di tutte le ore per ogni specie (specie ripetute accorpate).
+
+        Returns:
+            tuple: (specie ordinate, CO2 totale, O2 totale).
+        """
+        names, inverse = _group_index(self.species)
+        co2 = np.zeros(len(names))
+        o2 = np.zeros(len(names))
+        np.add.at(co2, inverse, self.co2.sum(axis=1))
+        np.add.at(o2, inverse, self.o2.sum(axis=1))
+        return names, co2, o2
 
-        co2_factor = coefficients[species].get("co2", 0)
-        o2_factor = coefficients[species].get("o2", 0)
+    def per_hour_species(self):
+        """
+        Somma CO2/O2 per coppia (specie, ora).
 
-        for hour in hourly_weather:
-            radiation = hour.get("radiation", 0)
-            temperature = hour.get("temperature", DEFAULT_TEMPERATURE)
-            humidity = hour.get("humidity", DEFAULT_HUMIDITY)
-            datetime_hour = hour.get("datetime")
+        Returns:
+            tuple: (specie ordinate, timestamp ordinati, matrice CO2, matrice O2).
+        """
+        names, species_inverse = _group_index(self.species)
+        hours, hour_inverse = _group_index(self.timestamps)
+        index = (species_inverse[:, None], hour_inverse[None, :])
+        co2 = np.zeros((len(names), len(hours)))
+        o2 = np.zeros((len(names), len(hours)))
+        np.add.at(co2, index, self.co2)
+        np.add.at(o2, index, self.o2)
+        return names, hours, co2, o2
 
-            rad_factor = min(radiation / RADIATION_NORMALIZER, 1.0) if radiation is not None else 0
-            temp_factor = min(temperature / TEMPERATURE_NORMALIZER, 1.0) if temperature is not None else 0
-            hum_factor = min(humidity / HUMIDITY_NORMALIZER, 1.0) if humidity is not None else 0
+    def _meteo_by_timestamp(self) -> Dict[Any, Dict[str, Any]]:
+        return {w.get("datetime"): w for w in self.weather}
 
-            meteo_factor = rad_factor * temp_factor * hum_factor
-            base = area
-            co2_hour = base * co2_factor * meteo_factor
-            o2_hour = base * o2_factor * meteo_factor
+    @staticmethod
+    def _meteo_fields(meteo: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "precipitazioni_mm": meteo.get("precipitation"),
+            "temperatura_c": meteo.get("temperature"),
+            "radiazione": meteo.get("radiation"),
+            "umidita": meteo.get("humidity"),
+        }
 
+    def hourly_records(self) -> List[Dict[str, Any]]:
+        """Totali orari con i dati meteo dell'ora, nel formato di `/calcola_co2`."""
+        hours, co2, o2 = self.per_hour()
+        meteo = self._meteo_by_timestamp()
+        return [
+            {
+                "datetime": hour.strftime(DATETIME_FORMAT),
+                "co2_kg_hour": co2_value,
+                "o2_kg_hour": o2_value,
+                **self._meteo_fields(meteo.get(hour, {})),
+            }
+            for hour, co2_value, o2_value in zip(hours, co2.tolist(), o2.tolist())
+        ]
+
+    def species_records(self) -> List[Dict[str, Any]]:
+        """Totali per specie sull'intero periodo, nel formato di `/co2_by_species`."""
+        names, co2, o2 = self.per_species()
+        return [
+            {"species": name, "total_co2_kg": co2_value, "total_o2_kg": o2_value}
+            for name, co2_value, o2_value in zip(names, co2.tolist(), o2.tolist())
+        ]
+
+    def hourly_species_records(self) -> List[Dict[str, Any]]:
+        """Valori orari per specie con i dati meteo dell'ora, ordinati per ora e specie."""
+        names, hours, co2, o2 = self.per_hour_species()
+        meteo = self._meteo_by_timestamp()
+        co2_rows = co2.tolist()
+        o2_rows = o2.tolist()
+
+        records = []
+        for j, hour in enumerate(hours):
+            label = hour.strftime(DATETIME_FORMAT)
+            meteo_fields = self._meteo_fields(meteo.get(hour, {}))
+            for i, name in enumerate(names):
+                records.append({
+                    "datetime": label,
+                    "species": name,
+                    "co2_kg_hour": co2_rows[i][j],
+                    "o2_kg_hour": o2_rows[i][j],
+                    **meteo_fields,
+                })
+        return records
+
+
+def calculate_co2_o2(plants: List[Dict[str, Any]], hourly_weather: List[Dict[str, Any]], coefficients: Dict[str, Dict[str, float]]) -> CO2O2Result:
+    """
+    Motore vettoriale del calcolo CO2/O2: una matrice (specie × ore) per gas.
+
+    Il calcolo è `area × coefficiente × fattore_meteo` in broadcasting, con lo stesso
+    ordine delle moltiplicazioni del calcolo scalare e lo stesso arrotondamento a 5 decimali.
+
+    Args:
+        plants (List[Dict[str, Any]]): Lista di piante con specie e area.
+        hourly_weather (List[Dict[str, Any]]): Dati meteo orari.
+        coefficients (Dict[str, Dict[str, float]]): Coefficienti per specie.
+
+    Returns:
+        CO2O2Result: Risultato colonnare con le matrici CO2/O2.
+    """
+    names, area, co2_coef, o2_coef = build_species_vectors(plants, coefficients)
+    timestamps = [h.get("datetime") for h in hourly_weather]
+    meteo_factor = build_meteo_factors(hourly_weather)
+
+    co2 = _round_like_python((area * co2_coef)[:, None] * meteo_factor[None, :])
+    o2 = _round_like_python((area * o2_coef)[:, None] * meteo_factor[None, :])
+    return CO2O2Result(names, timestamps, co2, o2, hourly_weather)
+
+
+def calculate_co2_o2_hourly(plants: List[Dict[str, Any]], hourly_weather: List[Dict[str, Any]], coefficients: Dict[str, Dict[str, float]]) -> List[Dict[str, Any]]:
+    """Calcola l'assorbimento di CO2 e la produzione di O2 oraria per ogni specie.
+
+    Args:
+        plants: Lista di piante con specie e area.
+        hourly_weather: Dati meteo orari.
+        coefficients: Coefficienti di assorbimento/produzione per specie.
+
+    Returns:
+        Lista di risultati orari con CO2 e O2 calcolati.
+    """
+    result = calculate_co2_o2(plants, hourly_weather, coefficients)
+    co2_rows = result.co2.tolist()
+    o2_rows = result.o2.tolist()
+
+    results = []
+    for i, species in enumerate(result.species):
+        for j, datetime_hour in enumerate(result.timestamps):
             results.append({
                 "species": species,
                 "datetime": datetime_hour,
-                "co2_kg_hour": round(co2_hour, 5),
-                "o2_kg_hour": round(o2_hour, 5)
+                "co2_kg_hour": co2_rows[i][j],
+                "o2_kg_hour": o2_rows[i][j]
             })
     return results
 
+def evaluate_species_mixes(mixes: List[List[Dict[str, Any]]], hourly_weather: List[Dict[str, Any]], coefficients: Dict[str, Dict[str, float]]) -> Dict[str, Any]:
+    """
+    Valuta in blocco N composizioni di specie alternative sugli stessi dati meteo.
+
+    Le composizioni diventano una matrice di aree (composizioni × specie): i totali
+    sono un prodotto matrice-vettore con i coefficienti, moltiplicato per la somma
+    del fattore meteo. È la stessa formula di `calculate_co2_o2`, ma senza
+    l'arrotondamento orario per cella, che non serve per confrontare i totali.
+
+    Args:
+        mixes (List[List[Dict[str, Any]]]): Composizioni, ognuna una lista di piante con specie e area.
+        hourly_weather (List[Dict[str, Any]]): Dati meteo orari.
+        coefficients (Dict[str, Dict[str, float]]): Coefficienti per specie.
+
+    Returns:
+        Dict[str, Any]: "co2" e "o2" (vettori dei totali per composizione) e
+        "unknown_species" (per ogni composizione, le specie senza coefficienti).
+    """
+    universe = sorted({
+        plant.get("species", "").lower()
+        for mix in mixes for plant in mix
+        if plant.get("species", "").lower() in coefficients
+    })
+    position = {name: i for i, name in enumerate(universe)}
+
+    areas = np.zeros((len(mixes), len(universe)))
+    unknown_species = []
+    for i, mix in enumerate(mixes):
+        unknown = []
+        for plant in mix:
+            species = plant.get("species", "").lower()
+            if species in position:
+                areas[i, position[species]] += plant.get("area_m2", 0) or 0
+            else:
+                unknown.append(species)
+        unknown_species.append(unknown)
+
+    co2_coef = np.array([coefficients[name].get("co2") or 0 for name in universe], dtype=np.float64)
+    o2_coef = np.array([coefficients[name].get("o2") or 0 for name in universe], dtype=np.float64)
+    meteo_total = build_meteo_factors(hourly_weather).sum()
+
+    return {
+        "co2": (areas @ co2_coef) * meteo_total,
+        "o2": (areas @ o2_coef) * meteo_total,
+        "unknown_species": unknown_species,
+    }
+
+
 async def aggiorna_weatherdata_con_assorbimenti(db: AsyncSession, plot_id: int, giorno: str):
     """
     Calcola l'assorbimento orario di CO2 e la produzione di O2 per un dato terreno
@@ -173,27 +634,494 @@ async def aggiorna_weatherdata_con_assorbimenti(db: AsyncSession, plot_id: int,
 
     Il calcolo si basa sui dati delle specie presenti nel terreno, sulle condizioni
     meteo orarie e sui coefficienti di assorbimento/produzione specifici per ogni specie.
+    Ogni ora riceve la somma dei contributi di tutte le specie del terreno; il dettaglio
+    per specie viene salvato in `plot_species_hourly`.
 
     Args:
         db (AsyncSession): La sessione asincrona del database per eseguire le query.
         plot_id (int): L'ID del terreno per cui effettuare il calcolo.
         giorno (str): La data di riferimento nel formato "YYYY-MM-DD".
     """
-    # Chiama le funzioni 'await'ing per ottenere i risultati
-    weather = await get_weather_data_from_db(db, plot_id, giorno)
-    species = await get_species_from_db(db, plot_id)
-    coefficients = await get_coefficients_from_db(db)
+    # Stesso percorso del calcolo batch, ristretto a un terreno e un giorno:
+    # i contributi delle specie vengono sommati per ora e scritti con un UPDATE set-based
+    target_date = datetime.strptime(giorno, "%Y-%m-%d").date()
+    await aggiorna_weatherdata_batch(db, target_date, plot_ids=[plot_id])
+
 
-    results = calculate_co2_o2_hourly(species, weather, coefficients)
+async def write_hourly_totals(db: AsyncSession, rows: List[tuple]) -> int:
+    """
+    Scrive i totali orari di CO2/O2 in `weather_data` con UPDATE set-based.
+
+    Ogni blocco di al massimo `WRITE_BATCH_SIZE` righe diventa un solo
+    `UPDATE weather_data ... FROM (VALUES ...)`, invece di uno statement per ora.
+
+    Args:
+        db (AsyncSession): La sessione asincrona del database.
+        rows (List[tuple]): Tuple (plot_id, date_time, co2, o2) con i totali già aggregati per ora.
+
+    Returns:
+        int: Numero di righe passate all'aggiornamento.
+    """
+    for start in range(0, len(rows), WRITE_BATCH_SIZE):
+        totals = values(
+            column("plot_id", Integer),
+            column("date_time", TIMESTAMP),
+            column("co2", Float),
+            column("o2", Float),
+            name="totali",
+        ).data(rows[start:start + WRITE_BATCH_SIZE])
 
-    for r in results:
         stmt = (
             update(WeatherData)
-            .where(WeatherData.plot_id == plot_id, WeatherData.date_time == r["datetime"])
-            .values(total_co2_absorption=r["co2_kg_hour"], total_o2_production=r["o2_kg_hour"])
+            .where(WeatherData.plot_id == totals.c.plot_id, WeatherData.date_time == totals.c.date_time)
+            .values(total_co2_absorption=totals.c.co2, total_o2_production=totals.c.o2)
+            .execution_options(synchronize_session=False)
         )
-        # Aggiunto 'await' qui
         await db.execute(stmt)
+    return len(rows)
+
+
+def _weather_species_query(start: date, end: date, plot_ids: Optional[List[int]] = None):
+    """Query del meteo orario unito a specie e coefficienti, ordinata per terreno e ora."""
+    stmt = (
+        select(
+            WeatherData.plot_id,
+            WeatherData.date_time,
+            meteo_factor_column().label("meteo_factor"),
+            PlotSpecies.species_id,
+            PlotSpecies.surface_area,
+            Species.co2_absorption_rate,
+            Species.o2_production_rate,
+        )
+        .select_from(WeatherData)
+        .outerjoin(PlotSpecies, and_(PlotSpecies.plot_id == WeatherData.plot_id, PlotSpecies.surface_area > 0))
+        .outerjoin(Species, Species.id == PlotSpecies.species_id)
+        .where(
+            WeatherData.date_time >= datetime.combine(start, datetime.min.time()),
+            WeatherData.date_time <= datetime.combine(end, datetime.max.time())
+        )
+        .order_by(WeatherData.plot_id, WeatherData.date_time)
+    )
+    if plot_ids is not None:
+        stmt = stmt.where(WeatherData.plot_id.in_(plot_ids))
+    return stmt
+
+
+async def get_weather_species_rows_from_db(db: AsyncSession, start: date, end: date, plot_ids: Optional[List[int]] = None):
+    """
+    Recupera con una sola query il meteo orario di più terreni unito a specie e coefficienti.
+
+    Ogni riga è una coppia (ora, specie del terreno). I terreni senza specie compaiono
+    comunque, con colonne specie a NULL, così le loro ore vengono azzerate.
+
+    Args:
+        db (AsyncSession): La sessione asincrona del database.
+        start (date): Primo giorno (incluso).
+        end (date): Ultimo giorno (incluso).
+        plot_ids (Optional[List[int]]): Terreni da includere; None per tutti.
+
+    Returns:
+        list: Righe ordinate per terreno e ora.
+    """
+    result = await db.execute(_weather_species_query(start, end, plot_ids))
+    return result.fetchall()
+
+
+async def stream_weather_species_batches(
+    db: AsyncSession,
+    start: date,
+    end: date,
+    plot_ids: Optional[List[int]] = None,
+    batch_rows: int = STREAM_BATCH_ROWS
+) -> AsyncIterator[list]:
+    """
+    Legge le stesse righe di `get_weather_species_rows_from_db` a blocchi, con un cursore lato server.
+
+    Un blocco non divide mai le specie di una stessa (terreno, ora): le righe dell'ultima
+    ora letta vengono trattenute e passate al blocco successivo, così i totali orari di
+    ogni blocco sono completi. La memoria dipende da `batch_rows`, non dall'intervallo.
+
+    Il cursore resta aperto per tutta l'iterazione: non eseguire commit sulla stessa
+    sessione finché il generatore non è esaurito.
+
+    Args:
+        db (AsyncSession): La sessione asincrona del database.
+        start (date): Primo giorno (incluso).
+        end (date): Ultimo giorno (incluso).
+        plot_ids (Optional[List[int]]): Terreni da includere; None per tutti.
+        batch_rows (int): Righe lette dal cursore per blocco.
+
+    Yields:
+        list: Blocchi di righe ordinate per terreno e ora.
+    """
+    result = await db.stream(_weather_species_query(start, end, plot_ids).execution_options(yield_per=batch_rows))
+    pending = []
+    async for partition in result.partitions():
+        rows = pending + list(partition)
+        last_plot, last_hour = rows[-1].plot_id, rows[-1].date_time
+        cut = len(rows)
+        while cut > 0 and rows[cut - 1].plot_id == last_plot and rows[cut - 1].date_time == last_hour:
+            cut -= 1
+        pending = rows[cut:]
+        if cut:
+            yield rows[:cut]
+    if pending:
+        yield pending
+
+
+def align_plot_series(totals: List[tuple], plot_ids: List[int]) -> Dict[str, Any]:
+    """
+    Allinea i totali di più terreni su un asse temporale comune.
+
+    Args:
+        totals (List[tuple]): Tuple (plot_id, date_time, co2, o2), come `per_plot_hour`.
+        plot_ids (List[int]): Terreni da restituire, nell'ordine desiderato.
+
+    Returns:
+        Dict[str, Any]: "timestamps" (istanti ordinati presenti in almeno un terreno) e
+        "series" ({plot_id: (co2, o2)} con liste allineate, None dove il terreno non ha dati).
+    """
+    hours = sorted({date_time for _, date_time, _, _ in totals})
+    position = {date_time: i for i, date_time in enumerate(hours)}
+
+    series = {plot_id: ([None] * len(hours), [None] * len(hours)) for plot_id in plot_ids}
+    for plot_id, date_time, co2, o2 in totals:
+        if plot_id in series:
+            series[plot_id][0][position[date_time]] = co2
+            series[plot_id][1][position[date_time]] = o2
+    return {"timestamps": hours, "series": series}
+
+
+class BatchCO2O2Result:
+    """
+    Risultato del calcolo batch su più terreni: una riga per (terreno, ora, specie).
+
+    Le righe seguono l'ordine della query (terreno, ora); i terreni senza specie
+    hanno `species_ids` pari a -1 e contributo nullo.
+
+    Attributes:
+        plot_ids (np.ndarray): ID del terreno per riga.
+        timestamps (List[datetime]): Ora di riferimento per riga.
+        species_ids (np.ndarray): ID della specie per riga (-1 se il terreno non ha specie).
+        co2 (np.ndarray): Assorbimento CO2 in kg/ora per riga.
+        o2 (np.ndarray): Produzione O2 in kg/ora per riga.
+    """
+
+    def __init__(self, plot_ids: np.ndarray, timestamps: List[Any], species_ids: np.ndarray, co2: np.ndarray, o2: np.ndarray):
+        self.plot_ids = plot_ids
+        self.timestamps = timestamps
+        self.species_ids = species_ids
+        self.co2 = co2
+        self.o2 = o2
+
+    def per_plot_hour(self) -> List[tuple]:
+        """
+        Somma i contributi delle specie per ogni (terreno, ora).
+
+        Returns:
+            List[tuple]: Tuple (plot_id, date_time, co2, o2) pronte per `write_hourly_totals`.
+        """
+        if len(self.timestamps) == 0:
+            return []
+
+        hours = np.array(self.timestamps, dtype="datetime64[us]")
+        boundary = np.ones(len(hours), dtype=bool)
+        boundary[1:] = (self.plot_ids[1:] != self.plot_ids[:-1]) | (hours[1:] != hours[:-1])
+        starts = np.flatnonzero(boundary)
+
+        co2 = np.add.reduceat(self.co2, starts).tolist()
+        o2 = np.add.reduceat(self.o2, starts).tolist()
+        plot_ids = self.plot_ids[starts].tolist()
+        return [
+            (plot_id, self.timestamps[start], co2_value, o2_value)
+            for plot_id, start, co2_value, o2_value in zip(plot_ids, starts.tolist(), co2, o2)
+        ]
+
+    def aligned_series(self, plot_ids: List[int]) -> Dict[str, Any]:
+        """
+        Allinea i totali orari di più terreni su un asse temporale comune.
+
+        Args:
+            plot_ids (List[int]): Terreni da restituire, nell'ordine desiderato.
+
+        Returns:
+            Dict[str, Any]: Vedi `align_plot_series`.
+        """
+        return align_plot_series(self.per_plot_hour(), plot_ids)
+
+    def per_plot_species_hour(self) -> List[Dict[str, Any]]:
+        """
+        Somma i contributi per ogni (terreno, ora, specie), escludendo le righe senza specie.
+
+        Returns:
+            List[Dict[str, Any]]: Righe pronte per la tabella `plot_species_hourly`.
+        """
+        mask = self.species_ids >= 0
+        if not mask.any():
+            return []
+
+        rows_index = np.flatnonzero(mask)
+        plot_ids = self.plot_ids[mask]
+        species_ids = self.species_ids[mask]
+        hours = np.array([self.timestamps[i] for i in rows_index.tolist()], dtype="datetime64[us]")
+
+        order = np.lexsort((species_ids, hours, plot_ids))
+        plot_ids, species_ids, hours = plot_ids[order], species_ids[order], hours[order]
+        rows_index = rows_index[order]
+
+        boundary = np.ones(len(order), dtype=bool)
+        boundary[1:] = (
+            (plot_ids[1:] != plot_ids[:-1])
+            | (hours[1:] != hours[:-1])
+            | (species_ids[1:] != species_ids[:-1])
+        )
+        starts = np.flatnonzero(boundary)
+
+        co2 = np.add.reduceat(self.co2[rows_index], starts).tolist()
+        o2 = np.add.reduceat(self.o2[rows_index], starts).tolist()
+        return [
+            {
+                "plot_id": plot_id,
+                "species_id": species_id,
+                "date_time": self.timestamps[row],
+                "co2_kg": co2_value,
+                "o2_kg": o2_value,
+            }
+            for plot_id, species_id, row, co2_value, o2_value in zip(
+                plot_ids[starts].tolist(), species_ids[starts].tolist(), rows_index[starts].tolist(), co2, o2
+            )
+        ]
+
+
+def calculate_co2_o2_batch(rows) -> BatchCO2O2Result:
+    """
+    Calcola CO2/O2 in un solo passaggio vettoriale sulle righe di `get_weather_species_rows_from_db`.
+
+    Ogni riga usa la stessa formula e lo stesso arrotondamento di `calculate_co2_o2`:
+    `area × coefficiente × fattore_meteo`, con None trattato come 0. Il fattore meteo
+    arriva già calcolato dalla query (`meteo_factor_column`).
+
+    Args:
+        rows: Righe (terreno, ora, fattore meteo, specie, area, coefficienti).
+
+    Returns:
+        BatchCO2O2Result: Contributi per (terreno, ora, specie).
+    """
+    if not rows:
+        empty = np.zeros(0)
+        return BatchCO2O2Result(np.zeros(0, dtype=np.int64), [], np.zeros(0, dtype=np.int64), empty, empty)
+
+    columns = list(zip(*rows))
+    (plot_ids, timestamps, meteo_factor,
+     species_ids, area, co2_rate, o2_rate) = columns
+
+    meteo_factor = np.nan_to_num(np.array(meteo_factor, dtype=np.float64))
+    area = np.nan_to_num(np.array(area, dtype=np.float64))
+    co2_rate = np.nan_to_num(np.array(co2_rate, dtype=np.float64))
+    o2_rate = np.nan_to_num(np.array(o2_rate, dtype=np.float64))
+
+    co2 = _round_like_python(area * co2_rate * meteo_factor)
+    o2 = _round_like_python(area * o2_rate * meteo_factor)
+    species_ids = np.array([-1 if species_id is None else species_id for species_id in species_ids], dtype=np.int64)
+    return BatchCO2O2Result(np.array(plot_ids, dtype=np.int64), list(timestamps), species_ids, co2, o2)
+
+
+async def aggiorna_weatherdata_batch(db: AsyncSession, start: date, end: Optional[date] = None, plot_ids: Optional[List[int]] = None, update_aggregates: bool = True) -> int:
+    """
+    Calcola e scrive CO2/O2 di più terreni con una query di lettura e UPDATE set-based.
+
+    Meteo, specie e coefficienti arrivano insieme da `stream_weather_species_batches`
+    a blocchi di `STREAM_BATCH_ROWS` righe; ogni blocco è un passaggio vettoriale seguito
+    dalla scrittura dei totali orari con `write_hourly_totals`. Il costo cresce con le
+    righe, non con il numero di terreni, e la memoria resta limitata alla dimensione del blocco.
+    Il dettaglio per specie viene salvato in `plot_species_hourly`, i giorni
+    ricalcolati vengono riassunti in `plot_daily_stats` e la classifica, gli
+    aggregati regionali e i crediti generati dei terreni coinvolti vengono aggiornati.
+
+    Args:
+        db (AsyncSession): La sessione asincrona del database.
+        start (date): Primo giorno da calcolare.
+        end (Optional[date]): Ultimo giorno (incluso); None per il solo `start`.
+        plot_ids (Optional[List[int]]): Terreni da calcolare; None per tutti.
+        update_aggregates (bool): Se False classifica, aggregati regionali e crediti non vengono
+            aggiornati (ad esempio nei worker paralleli, dove li aggiorna il processo
+            principale alla fine).
+
+    Returns:
+        int: Numero di ore aggiornate.
+    """
+    end = end or start
+    await clear_species_hourly(db, start, end, plot_ids)
+    updated = 0
+    async for rows in stream_weather_species_batches(db, start, end, plot_ids):
+        result = calculate_co2_o2_batch(rows)
+        await insert_species_hourly(db, result.per_plot_species_hour())
+        updated += await write_hourly_totals(db, result.per_plot_hour())
+    await refresh_daily_stats(db, start, end, plot_ids, computed=True)
+    if update_aggregates:
+        await refresh_leaderboard(db, plot_ids)
+        await assign_plot_regions(db, plot_ids)
+        await refresh_region_daily_stats(db, start, end, plot_ids)
+        await record_generated_credits(db, plot_ids)
+    return updated
+
+
+async def write_species_hourly(db: AsyncSession, rows: List[Dict[str, Any]], start: date, end: date, plot_ids: Optional[List[int]] = None) -> int:
+    """
+    Sostituisce i risultati per specie di `plot_species_hourly` nell'intervallo indicato.
+
+    Args:
+        db (AsyncSession): La sessione asincrona del database.
+        rows (List[Dict[str, Any]]): Righe di `BatchCO2O2Result.per_plot_species_hour`.
+        start (date): Primo giorno ricalcolato.
+        end (date): Ultimo giorno ricalcolato (incluso).
+        plot_ids (Optional[List[int]]): Terreni ricalcolati; None per tutti.
+
+    Returns:
+        int: Numero di righe inserite.
+    """
+    await clear_species_hourly(db, start, end, plot_ids)
+    return await insert_species_hourly(db, rows)
+
+
+async def clear_species_hourly(db: AsyncSession, start: date, end: date, plot_ids: Optional[List[int]] = None):
+    """
+    Cancella con un solo DELETE i risultati per specie dell'intervallo, così le specie
+    rimosse dal terreno non lasciano valori vecchi.
+
+    Args:
+        db (AsyncSession): La sessione asincrona del database.
+        start (date): Primo giorno ricalcolato.
+        end (date): Ultimo giorno ricalcolato (incluso).
+        plot_ids (Optional[List[int]]): Terreni ricalcolati; None per tutti.
+    """
+    stmt = delete(PlotSpeciesHourly).where(
+        PlotSpeciesHourly.date_time >= datetime.combine(start, datetime.min.time()),
+        PlotSpeciesHourly.date_time <= datetime.combine(end, datetime.max.time())
+    )
+    if plot_ids is not None:
+        stmt = stmt.where(PlotSpeciesHourly.plot_id.in_(plot_ids))
+    await db.execute(stmt.execution_options(synchronize_session=False))
+
+
+async def insert_species_hourly(db: AsyncSession, rows: List[Dict[str, Any]]) -> int:
+    """
+    Inserisce righe in `plot_species_hourly` in blocchi da `WRITE_BATCH_SIZE`.
+
+    Args:
+        db (AsyncSession): La sessione asincrona del database.
+        rows (List[Dict[str, Any]]): Righe di `BatchCO2O2Result.per_plot_species_hour`.
+
+    Returns:
+        int: Numero di righe inserite.
+    """
+    for chunk_start in range(0, len(rows), WRITE_BATCH_SIZE):
+        await db.execute(insert(PlotSpeciesHourly), rows[chunk_start:chunk_start + WRITE_BATCH_SIZE])
+    return len(rows)
+
+
+async def get_species_hourly_from_db(db: AsyncSession, plot_id: int, day: str, weather: List[Dict[str, Any]]) -> Optional[CO2O2Result]:
+    """
+    Legge i risultati per specie già calcolati di un terreno e giorno da `plot_species_hourly`.
+
+    Args:
+        db (AsyncSession): La sessione asincrona del database.
+        plot_id (int): L'ID del terreno.
+        day (str): Il giorno nel formato "YYYY-MM-DD".
+        weather (List[Dict[str, Any]]): Dati meteo del giorno, per i campi meteo della risposta.
+
+    Returns:
+        Optional[CO2O2Result]: Il risultato ricostruito, oppure None se il giorno non è ancora
+        stato calcolato o è stato calcolato con una composizione specie superata.
+    """
+    target_date = datetime.strptime(day, "%Y-%m-%d").date()
+
+    # Righe scritte prima dell'ultima modifica alle specie: il chiamante ricalcola al volo
+    computed_version, current_version = (await db.execute(
+        select(computed_composition_version(plot_id, target_date), current_composition_version(plot_id))
+    )).one()
+    if computed_version is None or computed_version < current_version:
+        return None
+
+    stmt = (
+        select(
+            func.lower(Species.name).label("species"),
+            PlotSpeciesHourly.date_time,
+            PlotSpeciesHourly.co2_kg,
+            PlotSpeciesHourly.o2_kg,
+        )
+        .join(Species, Species.id == PlotSpeciesHourly.species_id)
+        .where(
+            PlotSpeciesHourly.plot_id == plot_id,
+            PlotSpeciesHourly.date_time >= datetime.combine(target_date, datetime.min.time()),
+            PlotSpeciesHourly.date_time <= datetime.combine(target_date, datetime.max.time())
+        )
+    )
+    rows = (await db.execute(stmt)).fetchall()
+    if not rows:
+        return None
+
+    names, species_inverse = _group_index([row.species for row in rows])
+    hours, hour_inverse = _group_index([row.date_time for row in rows])
+    co2 = np.zeros((len(names), len(hours)))
+    o2 = np.zeros((len(names), len(hours)))
+    np.add.at(co2, (species_inverse, hour_inverse), np.array([row.co2_kg or 0 for row in rows], dtype=np.float64))
+    np.add.at(o2, (species_inverse, hour_inverse), np.array([row.o2_kg or 0 for row in rows], dtype=np.float64))
+    return CO2O2Result(names, hours, co2, o2, weather)
+
+
+def _date_chunks(start: date, end: date, chunk_days: int):
+    """Divide l'intervallo [start, end] in finestre consecutive di al massimo `chunk_days` giorni."""
+    if chunk_days < 1:
+        raise ValueError("chunk_days deve essere almeno 1")
+    chunk_start = start
+    while chunk_start <= end:
+        chunk_end = min(chunk_start + timedelta(days=chunk_days - 1), end)
+        yield chunk_start, chunk_end
+        chunk_start = chunk_end + timedelta(days=1)
+
+
+async def aggiorna_weatherdata_range(
+    db: AsyncSession,
+    start: date,
+    end: date,
+    plot_ids: Optional[List[int]] = None,
+    chunk_days: int = BACKFILL_CHUNK_DAYS,
+    commit: bool = False,
+    update_aggregates: bool = True
+) -> int:
+    """
+    Ricalcola CO2/O2 per un intervallo di giorni e più terreni (backfill).
+
+    L'intervallo viene diviso in blocchi di `chunk_days` giorni per limitare la memoria:
+    ogni blocco è un `aggiorna_weatherdata_batch`, cioè una query per meteo, specie e
+    coefficienti di tutti i terreni, un passaggio di calcolo e una scrittura set-based.
+
+    Args:
+        db (AsyncSession): La sessione asincrona del database.
+        start (date): Primo giorno da ricalcolare (incluso).
+        end (date): Ultimo giorno da ricalcolare (incluso).
+        plot_ids (Optional[List[int]]): Terreni da ricalcolare; None per tutti.
+        chunk_days (int): Numero di giorni per blocco.
+        commit (bool): Se True esegue il commit dopo ogni blocco.
+        update_aggregates (bool): Se False classifica, aggregati regionali e crediti non vengono aggiornati.
+
+    Returns:
+        int: Numero di ore aggiornate.
+
+    Raises:
+        ValueError: Se l'intervallo non è valido o `chunk_days` è minore di 1.
+    """
+    if start > end:
+        raise ValueError(f"Intervallo non valido: {start} è successivo a {end}")
+
+    updated = 0
+    for chunk_start, chunk_end in _date_chunks(start, end, chunk_days):
+        updated += await aggiorna_weatherdata_batch(db, chunk_start, chunk_end, plot_ids, update_aggregates)
+        if commit:
+            await db.commit()
+
+    return updated
 
 
 def calcola_totale_orario(user_plants: List[Dict[str, Any]], weather: List[Dict[str, Any]], coefficients: Dict[str, Dict[str, float]]) -> Dict[str, List[Dict[str, Any]]]:
@@ -201,7 +1129,7 @@ def calcola_totale_orario(user_plants: List[Dict[str, Any]], weather: List[Dict[
     Aggrega i dati orari di assorbimento CO2 e produzione O2 per tutte le specie di un utente,
     restituendo un totale complessivo per ogni ora.
 
-    Utilizza i risultati di `calculate_co2_o2_hourly` e li raggruppa per timestamp,
+    Utilizza la riduzione per ora di `calculate_co2_o2` e raggruppa per timestamp,
     sommando i contributi di tutte le piante.
 
     Args:
@@ -213,10 +1141,11 @@ def calcola_totale_orario(user_plants: List[Dict[str, Any]], weather: List[Dict[
         Dict[str, List[Dict[str, Any]]]: Un dizionario contenente la chiave "totale_orario",
         a cui è associata una lista di dizionari, ciascuno con "datetime", "co2_kg_hour" e "o2_kg_hour".
     """
-    results = calculate_co2_o2_hourly(user_plants, weather, coefficients)
-    df = pd.DataFrame(results)
-    df_group = df.groupby("datetime")[["co2_kg_hour", "o2_kg_hour"]].sum().reset_index()
-    orario = df_group.to_dict(orient="records")
+    hours, co2, o2 = calculate_co2_o2(user_plants, weather, coefficients).per_hour()
+    orario = [
+        {"datetime": hour, "co2_kg_hour": co2_value, "o2_kg_hour": o2_value}
+        for hour, co2_value, o2_value in zip(hours, co2.tolist(), o2.tolist())
+    ]
     return {"totale_orario": orario}
 
 def convert_datetime_to_str(results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
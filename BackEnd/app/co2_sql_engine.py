@@ -0,0 +1,196 @@
+"""
+Motore SQL del calcolo CO2/O2: la stessa formula del motore Python eseguita in Postgres.
+
+Il motore Python legge una riga per (ora, specie) e moltiplica in NumPy; qui una sola
+query unisce `weather_data`, `plot_species` e `species`, calcola per ogni riga
+`area × coefficiente × fattore_meteo` arrotondato a 5 decimali, come
+`calculate_co2_o2_hourly`, e restituisce solo i totali per terreno e intervallo. Su
+storici lunghi dal database escono poche righe aggregate invece di tutte le ore.
+
+Il motore si sceglie con `motore=python|sql` su `/calcola_co2`, `/confronta_co2` e
+`/api/plots/{id}/timeseries`.
+
+L'arrotondamento di Postgres (`round(numeric, 5)`, metà lontano da zero) può differire
+da quello di Python (metà al pari) nei soli casi di parità: `check_sql_engine_parity`
+confronta i due motori su un intervallo con una tolleranza che copre questa differenza.
+"""
+
+from datetime import date, datetime
+from typing import List, Optional, Dict, Any
+import numpy as np
+from sqlalchemy import select, func, cast, and_, Float, Numeric
+from sqlalchemy.ext.asyncio import AsyncSession
+from BackEnd.app.models import WeatherData, PlotSpecies, Species
+from BackEnd.app.co2_o2_calculator import meteo_factor_column, get_weather_species_rows_from_db, calculate_co2_o2_batch, CO2O2Result
+from BackEnd.app.timeseries import BUCKETS
+from BackEnd.app.logger_config import setup_logger
+
+# Logger per questo modulo
+logger = setup_logger(__name__)
+
+# Motori di calcolo selezionabili dagli endpoint
+ENGINES = ("python", "sql")
+
+# Differenza massima (kg) tra i due motori per uno stesso totale orario
+PARITY_TOLERANCE_KG = 1e-4
+
+
+def _rounded_contribution(rate_column, factor):
+    """Contributo di una riga (ora, specie), arrotondato a 5 decimali come nel motore Python."""
+    value = func.coalesce(PlotSpecies.surface_area, 0) * func.coalesce(rate_column, 0) * factor
+    return func.round(cast(value, Numeric), 5)
+
+
+def co2_o2_series_query(start: date, end: date, plot_ids: Optional[List[int]] = None, bucket: str = "hour"):
+    """Query dei totali CO2/O2 per terreno e intervallo `date_trunc`, ordinata per terreno e tempo."""
+    factor = meteo_factor_column()
+    period = func.date_trunc(bucket, WeatherData.date_time).label("bucket")
+    stmt = (
+        select(
+            WeatherData.plot_id,
+            period,
+            cast(func.sum(_rounded_contribution(Species.co2_absorption_rate, factor)), Float),
+            cast(func.sum(_rounded_contribution(Species.o2_production_rate, factor)), Float),
+        )
+        .select_from(WeatherData)
+        .outerjoin(PlotSpecies, and_(PlotSpecies.plot_id == WeatherData.plot_id, PlotSpecies.surface_area > 0))
+        .outerjoin(Species, Species.id == PlotSpecies.species_id)
+        .where(
+            WeatherData.date_time >= datetime.combine(start, datetime.min.time()),
+            WeatherData.date_time <= datetime.combine(end, datetime.max.time())
+        )
+        .group_by(WeatherData.plot_id, period)
+        .order_by(WeatherData.plot_id, period)
+    )
+    if plot_ids is not None:
+        stmt = stmt.where(WeatherData.plot_id.in_(plot_ids))
+    return stmt
+
+
+async def calculate_co2_o2_sql(
+    db: AsyncSession,
+    start: date,
+    end: date,
+    plot_ids: Optional[List[int]] = None,
+    bucket: str = "hour"
+) -> List[tuple]:
+    """
+    Calcola in Postgres i totali CO2/O2 di più terreni per ora, giorno, settimana o mese.
+
+    Args:
+        db (AsyncSession): La sessione asincrona del database.
+        start (date): Primo giorno (incluso).
+        end (date): Ultimo giorno (incluso).
+        plot_ids (Optional[List[int]]): Terreni da calcolare; None per tutti.
+        bucket (str): Risoluzione: "hour", "day", "week" o "month".
+
+    Returns:
+        List[tuple]: Tuple (plot_id, inizio intervallo, co2, o2), nello stesso formato di
+        `BatchCO2O2Result.per_plot_hour`.
+
+    Raises:
+        ValueError: Se la risoluzione non è supportata.
+    """
+    if bucket not in BUCKETS:
+        raise ValueError(f"Risoluzione non supportata: {bucket}")
+    result = await db.execute(co2_o2_series_query(start, end, plot_ids, bucket))
+    return [tuple(row) for row in result.all()]
+
+
+def sql_rows_to_result(rows: List[tuple], weather: List[Dict[str, Any]]) -> CO2O2Result:
+    """
+    Converte i totali orari di un terreno del motore SQL in un `CO2O2Result` con una sola
+    riga, così gli endpoint serializzano allo stesso modo i due motori.
+
+    Args:
+        rows (List[tuple]): Tuple (plot_id, ora, co2, o2) di `calculate_co2_o2_sql`.
+        weather (List[Dict[str, Any]]): Dati meteo delle stesse ore, per i campi meteo della risposta.
+
+    Returns:
+        CO2O2Result: Risultato con la riga "totale" (vuoto se non ci sono ore).
+    """
+    if not rows:
+        return CO2O2Result([], [], np.zeros((0, 0)), np.zeros((0, 0)), weather)
+    return CO2O2Result(
+        ["totale"],
+        [hour for _, hour, _, _ in rows],
+        np.array([[co2 for _, _, co2, _ in rows]], dtype=np.float64),
+        np.array([[o2 for _, _, _, o2 in rows]], dtype=np.float64),
+        weather
+    )
+
+
+async def apply_sql_totals(db: AsyncSession, points: List[Dict[str, Any]], plot_id: int, start: date, end: date, bucket: str) -> List[Dict[str, Any]]:
+    """
+    Sostituisce "co2_kg" e "o2_kg" dei punti di `get_plot_timeseries` con i totali del
+    motore SQL, calcolati dalle specie attuali invece che letti dai valori salvati.
+
+    Args:
+        db (AsyncSession): La sessione asincrona del database.
+        points (List[Dict[str, Any]]): Punti della serie, con "bucket" in formato ISO.
+        plot_id (int): L'ID del terreno.
+        start (date): Primo giorno (incluso).
+        end (date): Ultimo giorno (incluso).
+        bucket (str): Risoluzione della serie.
+
+    Returns:
+        List[Dict[str, Any]]: Gli stessi punti con CO2/O2 del motore SQL.
+    """
+    totals = {
+        period.isoformat(): (co2, o2)
+        for _, period, co2, o2 in await calculate_co2_o2_sql(db, start, end, [plot_id], bucket)
+    }
+    for point in points:
+        point["co2_kg"], point["o2_kg"] = totals.get(point["bucket"], (0.0, 0.0))
+    return points
+
+
+async def check_sql_engine_parity(
+    db: AsyncSession,
+    start: date,
+    end: date,
+    plot_ids: Optional[List[int]] = None,
+    tolerance: float = PARITY_TOLERANCE_KG
+) -> Dict[str, Any]:
+    """
+    Confronta i totali orari del motore SQL con quelli del motore Python sugli stessi dati.
+
+    Args:
+        db (AsyncSession): La sessione asincrona del database.
+        start (date): Primo giorno (incluso).
+        end (date): Ultimo giorno (incluso).
+        plot_ids (Optional[List[int]]): Terreni da confrontare; None per tutti.
+        tolerance (float): Differenza massima ammessa (kg) per totale orario.
+
+    Returns:
+        Dict[str, Any]: "ore" confrontate, "differenza_max" (kg), "fuori_tolleranza"
+        (al massimo 10 esempi (plot_id, ora, co2 Python, co2 SQL)), "ore_mancanti"
+        (presenti in un solo motore) e "ok".
+    """
+    python_rows = calculate_co2_o2_batch(await get_weather_species_rows_from_db(db, start, end, plot_ids)).per_plot_hour()
+    sql_rows = await calculate_co2_o2_sql(db, start, end, plot_ids, "hour")
+
+    python_totals = {(plot_id, hour): (co2, o2) for plot_id, hour, co2, o2 in python_rows}
+    sql_totals = {(plot_id, hour): (co2, o2) for plot_id, hour, co2, o2 in sql_rows}
+
+    max_diff, mismatches = 0.0, []
+    for key in python_totals.keys() & sql_totals.keys():
+        (py_co2, py_o2), (sql_co2, sql_o2) = python_totals[key], sql_totals[key]
+        diff = max(abs(py_co2 - sql_co2), abs(py_o2 - sql_o2))
+        max_diff = max(max_diff, diff)
+        if diff > tolerance:
+            mismatches.append((key[0], key[1], py_co2, sql_co2))
+
+    missing = len(python_totals.keys() ^ sql_totals.keys())
+    report = {
+        "ore": len(python_totals),
+        "differenza_max": max_diff,
+        "fuori_tolleranza": sorted(mismatches)[:10],
+        "ore_mancanti": missing,
+        "ok": not mismatches and not missing,
+    }
+    if report["ok"]:
+        logger.info(f"Motore SQL allineato al motore Python su {report['ore']} ore (differenza max {max_diff:.2e} kg)")
+    else:
+        logger.warning(f"Motore SQL non allineato: {len(mismatches)} ore fuori tolleranza, {missing} ore mancanti")
+    return report
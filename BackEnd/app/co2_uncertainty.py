@@ -0,0 +1,114 @@
+"""
+Bande di incertezza Monte Carlo per i totali di CO2/O2.
+
+I coefficienti delle specie sono stime puntuali: qui vengono perturbati insieme al
+fattore meteo orario per ottenere percentili dei totali giornalieri e di periodo,
+utili per la certificazione. Il calcolo è vettoriale e procede a blocchi di campioni
+per restare entro un budget di memoria fisso, con un seed per la riproducibilità.
+"""
+
+from typing import List, Dict, Any, Sequence
+import numpy as np
+from BackEnd.app.co2_o2_calculator import build_species_vectors, build_meteo_factors, _group_index
+
+# Parametri di default della simulazione
+DEFAULT_SAMPLES = 1000
+DEFAULT_SEED = 42
+DEFAULT_COEFFICIENT_SD = 0.10  # deviazione standard relativa dei coefficienti di specie
+DEFAULT_WEATHER_SD = 0.05      # deviazione standard relativa del fattore meteo orario
+DEFAULT_PERCENTILES = (5, 50, 95)
+
+# Memoria massima per blocco di campioni (array campioni × ore più quelli per specie)
+CHUNK_MAX_BYTES = 64 * 1024 * 1024
+
+
+def _chunk_size(n_species: int, n_hours: int, max_bytes: int) -> int:
+    """Numero di campioni per blocco che mantiene gli array temporanei sotto `max_bytes`."""
+    bytes_per_sample = 8 * (2 * n_hours + 2 * n_species + 1)
+    return max(1, max_bytes // bytes_per_sample)
+
+
+def simulate_co2_o2_uncertainty(
+    plants: List[Dict[str, Any]],
+    hourly_weather: List[Dict[str, Any]],
+    coefficients: Dict[str, Dict[str, float]],
+    samples: int = DEFAULT_SAMPLES,
+    coefficient_sd: float = DEFAULT_COEFFICIENT_SD,
+    weather_sd: float = DEFAULT_WEATHER_SD,
+    percentiles: Sequence[float] = DEFAULT_PERCENTILES,
+    seed: int = DEFAULT_SEED,
+    max_bytes: int = CHUNK_MAX_BYTES
+) -> Dict[str, Any]:
+    """
+    Stima i percentili dei totali CO2/O2 giornalieri e di periodo con una simulazione Monte Carlo.
+
+    Ogni campione moltiplica i coefficienti di ogni specie per (1 + coefficient_sd · N(0, 1))
+    e il fattore meteo di ogni ora per (1 + weather_sd · N(0, 1)), troncando a zero.
+    Il contributo (campioni × specie × ore) è separabile, `area · coeff[k, s] · meteo[k, h]`,
+    quindi viene contratto con `einsum` senza materializzare l'array tridimensionale.
+    I campioni sono generati a blocchi dimensionati su `max_bytes`: a parità di seed il
+    risultato non dipende dalla dimensione dei blocchi (a meno di arrotondamenti).
+
+    Args:
+        plants (List[Dict[str, Any]]): Lista di piante con specie e area.
+        hourly_weather (List[Dict[str, Any]]): Dati meteo orari del periodo.
+        coefficients (Dict[str, Dict[str, float]]): Coefficienti per specie.
+        samples (int): Numero di campioni.
+        coefficient_sd (float): Deviazione standard relativa dei coefficienti.
+        weather_sd (float): Deviazione standard relativa del fattore meteo.
+        percentiles (Sequence[float]): Percentili da restituire (0-100).
+        seed (int): Seed del generatore casuale.
+        max_bytes (int): Memoria massima per blocco di campioni.
+
+    Returns:
+        Dict[str, Any]: "days" (giorni del periodo), "co2"/"o2" con "total" (percentili del
+        totale di periodo) e "daily" (percentili per giorno, forma percentili × giorni).
+
+    Raises:
+        ValueError: Se `samples` non è positivo.
+    """
+    if samples < 1:
+        raise ValueError("samples deve essere almeno 1")
+
+    _, area, co2_coef, o2_coef = build_species_vectors(plants, coefficients)
+    meteo = build_meteo_factors(hourly_weather)
+    days, day_index = _group_index([h.get("datetime").date() for h in hourly_weather])
+
+    # Matrice ore × giorni per sommare le ore di ciascun giorno con un prodotto matriciale
+    day_matrix = np.zeros((len(meteo), len(days)))
+    day_matrix[np.arange(len(meteo)), day_index] = 1.0
+
+    rng = np.random.default_rng(seed)
+    chunk = _chunk_size(len(area), len(meteo), max_bytes)
+    co2_daily = np.empty((samples, len(days)))
+    o2_daily = np.empty((samples, len(days)))
+
+    for start in range(0, samples, chunk):
+        k = min(chunk, samples - start)
+        # Un'unica estrazione per campione (specie CO2, specie O2, ore) rende i blocchi riproducibili
+        noise = rng.standard_normal((k, 2 * len(area) + len(meteo)))
+        co2_noise = noise[:, :len(area)]
+        o2_noise = noise[:, len(area):2 * len(area)]
+        meteo_noise = noise[:, 2 * len(area):]
+
+        co2_rate = np.clip(co2_coef * (1 + coefficient_sd * co2_noise), 0, None)
+        o2_rate = np.clip(o2_coef * (1 + coefficient_sd * o2_noise), 0, None)
+        meteo_sample = np.clip(meteo * (1 + weather_sd * meteo_noise), 0, None)
+
+        meteo_by_day = meteo_sample @ day_matrix
+        co2_daily[start:start + k] = np.einsum("s,ks,kd->kd", area, co2_rate, meteo_by_day)
+        o2_daily[start:start + k] = np.einsum("s,ks,kd->kd", area, o2_rate, meteo_by_day)
+
+    def summary(daily: np.ndarray) -> Dict[str, Any]:
+        return {
+            "total": np.percentile(daily.sum(axis=1), percentiles).tolist(),
+            "daily": np.percentile(daily, percentiles, axis=0).tolist(),
+        }
+
+    return {
+        "days": days,
+        "percentiles": list(percentiles),
+        "samples": samples,
+        "co2": summary(co2_daily),
+        "o2": summary(o2_daily),
+    }
@@ -0,0 +1,87 @@
+"""
+Tracciamento delle modifiche alla composizione specie dei terreni.
+
+Ogni modifica a `plot_species` incrementa la versione del terreno in
+`plot_composition_versions`. I giorni di `plot_daily_stats` calcolati con una
+versione precedente, o riassunti ma mai calcolati, sono "sporchi": `recompute_dirty_plots`
+ricalcola in blocco solo quei terreni e solo l'intervallo di storico interessato.
+"""
+
+from datetime import date
+from typing import Dict, Tuple
+from sqlalchemy import select, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from BackEnd.app.models import PlotDailyStats, PlotCompositionVersion
+from BackEnd.app.co2_o2_calculator import aggiorna_weatherdata_range, BACKFILL_CHUNK_DAYS
+from BackEnd.app.logger_config import setup_logger
+
+# Logger per questo modulo
+logger = setup_logger(__name__)
+
+
+async def bump_composition_version(db: AsyncSession, plot_id: int):
+    """
+    Incrementa la versione della composizione specie di un terreno.
+
+    Va eseguita nella stessa transazione che modifica `plot_species`, prima del commit.
+
+    Args:
+        db (AsyncSession): La sessione asincrona del database.
+        plot_id (int): L'ID del terreno modificato.
+    """
+    stmt = pg_insert(PlotCompositionVersion).values(plot_id=plot_id, version=1)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[PlotCompositionVersion.plot_id],
+        set_={"version": PlotCompositionVersion.version + 1, "updated_at": func.now()}
+    )
+    await db.execute(stmt)
+
+
+async def get_dirty_plots(db: AsyncSession) -> Dict[int, Tuple[date, date]]:
+    """
+    Trova i terreni con giorni calcolati su una composizione specie superata o non ancora calcolati.
+
+    Args:
+        db (AsyncSession): La sessione asincrona del database.
+
+    Returns:
+        Dict[int, Tuple[date, date]]: Per ogni terreno sporco, primo e ultimo giorno da ricalcolare.
+    """
+    stmt = (
+        select(PlotDailyStats.plot_id, func.min(PlotDailyStats.day), func.max(PlotDailyStats.day))
+        .outerjoin(PlotCompositionVersion, PlotCompositionVersion.plot_id == PlotDailyStats.plot_id)
+        .where(PlotDailyStats.composition_version < func.coalesce(PlotCompositionVersion.version, 0))
+        .group_by(PlotDailyStats.plot_id)
+    )
+    result = await db.execute(stmt)
+    return {plot_id: (first_day, last_day) for plot_id, first_day, last_day in result.all()}
+
+
+async def recompute_dirty_plots(db: AsyncSession, chunk_days: int = BACKFILL_CHUNK_DAYS, commit: bool = False) -> Dict[str, int]:
+    """
+    Ricalcola CO2/O2 solo per i terreni la cui composizione specie è cambiata.
+
+    Tutti i terreni sporchi vengono ricalcolati insieme con `aggiorna_weatherdata_range`,
+    sull'intervallo che copre i loro giorni non aggiornati.
+
+    Args:
+        db (AsyncSession): La sessione asincrona del database.
+        chunk_days (int): Giorni per blocco del ricalcolo.
+        commit (bool): Se True esegue il commit dopo ogni blocco.
+
+    Returns:
+        Dict[str, int]: Numero di terreni ricalcolati e di ore aggiornate.
+    """
+    dirty = await get_dirty_plots(db)
+    if not dirty:
+        return {"plots": 0, "hours": 0}
+
+    start = min(first_day for first_day, _ in dirty.values())
+    end = max(last_day for _, last_day in dirty.values())
+    logger.info(f"Ricalcolo CO2/O2 per {len(dirty)} terreni con specie modificate ({start} - {end})")
+
+    hours = await aggiorna_weatherdata_range(
+        db, start, end, plot_ids=list(dirty), chunk_days=chunk_days, commit=commit
+    )
+    return {"plots": len(dirty), "hours": hours}
@@ -53,6 +53,7 @@ class Settings(BaseSettings):
 
     # External APIs
     WEATHER_API_KEY: str = "your-weather-api-key"
+    OPEN_METEO_URL: str = "https://api.open-meteo.com/v1/forecast"
 
     # Production Settings
     PRODUCTION_URL: str = "http://165.22.75.145:8001"
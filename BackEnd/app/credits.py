@@ -0,0 +1,303 @@
+"""
+Registro dei crediti di carbonio (kg di CO2) dei terreni e saldi correnti.
+
+- `credit_ledger` è solo in aggiunta: ogni variazione è un nuovo movimento
+  (generated, reserved, sold, retired), anche negativo per correzioni e annullamenti.
+- `plot_credit_balances` tiene il saldo corrente di ogni terreno ed è aggiornato nella
+  stessa transazione di ogni movimento, così il credito disponibile è una lettura di una riga.
+- I crediti generati seguono `plot_daily_stats`: la pipeline registra solo la differenza
+  tra il totale del rollup e quanto già registrato.
+- Prenotazioni e vendite sono un `UPDATE ... WHERE available >= x` sulla riga del saldo:
+  il lock di riga di Postgres serializza i checkout concorrenti sullo stesso terreno
+  senza mai scendere sotto zero.
+
+Effetto di ogni movimento sul saldo (`available` = generated - reserved - sold - retired,
+mai sotto zero: se un ricalcolo abbassa i crediti generati sotto quelli già impegnati il
+terreno resta con `available` = 0 e viene segnalato nel log come sovraimpegnato):
+
+- generated: generated += kg, available += kg
+- reserved: reserved += kg, available -= kg (kg negativo = prenotazione annullata)
+- sold: sold += kg, reserved -= kg
+- retired: retired += kg, sold -= kg
+"""
+
+from typing import List, Optional, Dict, Any
+from sqlalchemy import select, update, delete, insert, exists, func, case, literal
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from BackEnd.app.models import PlotDailyStats, CreditLedgerEntry, PlotCreditBalance
+from BackEnd.app.logger_config import setup_logger
+
+# Logger per questo modulo
+logger = setup_logger(__name__)
+
+ENTRY_TYPES = ("generated", "reserved", "sold", "retired")
+
+# Movimento -> (colonna del saldo da cui escono i crediti, colonna in cui entrano)
+TRANSFERS = {
+    "reserved": ("available", "reserved"),
+    "sold": ("reserved", "sold"),
+    "retired": ("sold", "retired"),
+}
+
+# Differenze più piccole (in kg) sono trattate come arrotondamenti e non registrate
+CREDIT_TOLERANCE_KG = 1e-6
+
+
+async def record_generated_credits(db: AsyncSession, plot_ids: Optional[List[int]] = None) -> int:
+    """
+    Registra i crediti generati dai terreni indicati e aggiorna i loro saldi.
+
+    Il totale di ogni terreno è la somma di `plot_daily_stats`; viene registrato un
+    movimento "generated" solo per la differenza rispetto al saldo, quindi ricalcoli e
+    backfill producono correzioni (anche negative) invece di doppi conteggi.
+
+    Args:
+        db (AsyncSession): La sessione asincrona del database.
+        plot_ids (Optional[List[int]]): Terreni appena ricalcolati; None per tutti.
+
+    Returns:
+        int: Numero di movimenti registrati.
+    """
+    totals = select(
+        PlotDailyStats.plot_id,
+        func.sum(PlotDailyStats.co2_sum).label("total"),
+    ).group_by(PlotDailyStats.plot_id)
+    if plot_ids is not None:
+        totals = totals.where(PlotDailyStats.plot_id.in_(plot_ids))
+    totals = totals.subquery()
+
+    await _warn_over_committed(db, totals)
+
+    delta = totals.c.total - func.coalesce(PlotCreditBalance.generated, 0)
+    deltas = (
+        select(totals.c.plot_id, literal("generated"), delta)
+        .outerjoin(PlotCreditBalance, PlotCreditBalance.plot_id == totals.c.plot_id)
+        .where(func.abs(delta) > CREDIT_TOLERANCE_KG)
+    )
+    result = await db.execute(
+        insert(CreditLedgerEntry).from_select(["plot_id", "entry_type", "amount_kg"], deltas)
+    )
+
+    stmt = pg_insert(PlotCreditBalance).from_select(
+        ["plot_id", "generated", "available"],
+        select(totals.c.plot_id, totals.c.total, totals.c.total)
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[PlotCreditBalance.plot_id],
+        set_={
+            "generated": stmt.excluded.generated,
+            "available": func.greatest(
+                stmt.excluded.generated - PlotCreditBalance.reserved - PlotCreditBalance.sold - PlotCreditBalance.retired, 0
+            ),
+            "updated_at": func.now(),
+        },
+        where=func.abs(PlotCreditBalance.generated - stmt.excluded.generated) > CREDIT_TOLERANCE_KG
+    )
+    await db.execute(stmt)
+    return result.rowcount
+
+
+async def _warn_over_committed(db: AsyncSession, totals):
+    """
+    Segnala i terreni il cui nuovo totale generato è inferiore ai crediti già prenotati,
+    venduti o ritirati: il loro credito disponibile resta a zero finché il totale non risale.
+    """
+    committed = PlotCreditBalance.reserved + PlotCreditBalance.sold + PlotCreditBalance.retired
+    result = await db.execute(
+        select(PlotCreditBalance.plot_id, totals.c.total, committed)
+        .join(totals, totals.c.plot_id == PlotCreditBalance.plot_id)
+        .where(totals.c.total < committed - CREDIT_TOLERANCE_KG)
+    )
+    for plot_id, total, committed_kg in result.all():
+        logger.warning(
+            f"Crediti sovraimpegnati per il plot {plot_id}: generati {total:.3f} kg, "
+            f"già impegnati {committed_kg:.3f} kg; disponibili portati a 0"
+        )
+
+
+async def plot_has_credits(db: AsyncSession, plot_id: int) -> bool:
+    """Indica se il terreno ha movimenti nel registro (e quindi non può essere eliminato)."""
+    result = await db.execute(select(exists().where(CreditLedgerEntry.plot_id == plot_id)))
+    return result.scalar()
+
+
+async def _transfer_credits(db: AsyncSession, plot_id: int, entry_type: str, amount_kg: float, order_id: Optional[int] = None) -> bool:
+    """
+    Sposta crediti tra due colonne del saldo e registra il movimento.
+
+    Con un solo UPDATE condizionato: se la colonna da cui escono i crediti non basta
+    non viene aggiornato nulla e il movimento non viene registrato.
+
+    Returns:
+        bool: False se i crediti non sono sufficienti.
+    """
+    source, target = TRANSFERS[entry_type]
+    source_column = getattr(PlotCreditBalance, source)
+    target_column = getattr(PlotCreditBalance, target)
+    if amount_kg >= 0:
+        guard = source_column >= amount_kg - CREDIT_TOLERANCE_KG
+    else:
+        guard = target_column >= -amount_kg - CREDIT_TOLERANCE_KG
+
+    # Nuovi valori delle colonne impegnate; `available` è ricalcolato da queste, così
+    # resta corretto anche per un terreno sovraimpegnato (disponibile portato a zero)
+    committed = {name: getattr(PlotCreditBalance, name) for name in ("reserved", "sold", "retired")}
+    if source in committed:
+        committed[source] = committed[source] - amount_kg
+    committed[target] = committed[target] + amount_kg
+    available = func.greatest(PlotCreditBalance.generated - committed["reserved"] - committed["sold"] - committed["retired"], 0)
+
+    result = await db.execute(
+        update(PlotCreditBalance)
+        .where(PlotCreditBalance.plot_id == plot_id, guard)
+        .values({**committed, "available": available, "updated_at": func.now()})
+        .returning(PlotCreditBalance.plot_id)
+    )
+    if result.scalar_one_or_none() is None:
+        return False
+
+    await db.execute(insert(CreditLedgerEntry).values(
+        plot_id=plot_id, entry_type=entry_type, amount_kg=amount_kg, order_id=order_id
+    ))
+    return True
+
+
+async def reserve_credits(db: AsyncSession, plot_id: int, amount_kg: float, order_id: Optional[int] = None) -> bool:
+    """
+    Prenota crediti disponibili di un terreno (ad esempio alla creazione di un ordine).
+
+    Args:
+        db (AsyncSession): La sessione asincrona del database.
+        plot_id (int): Il terreno da cui prenotare i crediti.
+        amount_kg (float): kg di CO2 da prenotare.
+        order_id (Optional[int]): Ordine del marketplace a cui legare la prenotazione.
+
+    Returns:
+        bool: False se il terreno non ha abbastanza crediti disponibili.
+
+    Raises:
+        ValueError: Se la quantità non è positiva.
+    """
+    if amount_kg <= 0:
+        raise ValueError("La quantità di crediti da prenotare deve essere positiva")
+    return await _transfer_credits(db, plot_id, "reserved", amount_kg, order_id)
+
+
+async def _order_outstanding(db: AsyncSession, order_id: int, entry_type: str) -> Dict[int, float]:
+    """
+    Crediti di un ordine ancora nello stato che precede `entry_type`, per terreno
+    (prenotati ma non venduti per "sold", venduti ma non ritirati per "retired").
+    """
+    previous = {"sold": "reserved", "retired": "sold"}[entry_type]
+    outstanding = func.sum(case(
+        (CreditLedgerEntry.entry_type == previous, CreditLedgerEntry.amount_kg),
+        (CreditLedgerEntry.entry_type == entry_type, -CreditLedgerEntry.amount_kg),
+        else_=0
+    ))
+    result = await db.execute(
+        select(CreditLedgerEntry.plot_id, outstanding)
+        .where(CreditLedgerEntry.order_id == order_id)
+        .group_by(CreditLedgerEntry.plot_id)
+        .having(outstanding > CREDIT_TOLERANCE_KG)
+    )
+    return dict(result.all())
+
+
+async def complete_order_credits(db: AsyncSession, order_id: int) -> float:
+    """
+    Segna come venduti i crediti ancora prenotati da un ordine.
+
+    Args:
+        db (AsyncSession): La sessione asincrona del database.
+        order_id (int): L'ordine completato.
+
+    Returns:
+        float: kg di CO2 passati a venduti.
+    """
+    total = 0.0
+    for plot_id, amount in (await _order_outstanding(db, order_id, "sold")).items():
+        if await _transfer_credits(db, plot_id, "sold", amount, order_id):
+            total += amount
+    return total
+
+
+async def cancel_order_credits(db: AsyncSession, order_id: int) -> float:
+    """
+    Rende di nuovo disponibili i crediti ancora prenotati da un ordine annullato.
+
+    Args:
+        db (AsyncSession): La sessione asincrona del database.
+        order_id (int): L'ordine annullato.
+
+    Returns:
+        float: kg di CO2 tornati disponibili.
+    """
+    total = 0.0
+    for plot_id, amount in (await _order_outstanding(db, order_id, "sold")).items():
+        if await _transfer_credits(db, plot_id, "reserved", -amount, order_id):
+            total += amount
+    return total
+
+
+async def retire_order_credits(db: AsyncSession, order_id: int) -> float:
+    """
+    Ritira (usa per la compensazione) i crediti venduti con un ordine.
+
+    Args:
+        db (AsyncSession): La sessione asincrona del database.
+        order_id (int): L'ordine completato.
+
+    Returns:
+        float: kg di CO2 ritirati.
+    """
+    total = 0.0
+    for plot_id, amount in (await _order_outstanding(db, order_id, "retired")).items():
+        if await _transfer_credits(db, plot_id, "retired", amount, order_id):
+            total += amount
+    return total
+
+
+async def get_plot_credits(db: AsyncSession, plot_id: int) -> Dict[str, Any]:
+    """
+    Restituisce il saldo crediti di un terreno con la lettura di una sola riga.
+
+    Args:
+        db (AsyncSession): La sessione asincrona del database.
+        plot_id (int): L'ID del terreno.
+
+    Returns:
+        Dict[str, Any]: kg di CO2 "generati", "prenotati", "venduti", "ritirati" e
+        "disponibili" (tutti 0 se il terreno non ha ancora crediti).
+    """
+    balance = await db.get(PlotCreditBalance, plot_id, populate_existing=True)
+    return {
+        "plot_id": plot_id,
+        "generati": balance.generated if balance else 0.0,
+        "prenotati": balance.reserved if balance else 0.0,
+        "venduti": balance.sold if balance else 0.0,
+        "ritirati": balance.retired if balance else 0.0,
+        "disponibili": balance.available if balance else 0.0,
+    }
+
+
+async def rebuild_credit_balances(db: AsyncSession):
+    """Ricostruisce tutti i saldi rileggendo l'intero registro dei movimenti."""
+    def total(entry_type: str):
+        return func.coalesce(func.sum(CreditLedgerEntry.amount_kg).filter(CreditLedgerEntry.entry_type == entry_type), 0)
+
+    generated, reserved, sold, retired = (total(entry_type) for entry_type in ENTRY_TYPES)
+    source = select(
+        CreditLedgerEntry.plot_id,
+        generated,
+        reserved - sold,
+        sold - retired,
+        retired,
+        func.greatest(generated - reserved, 0),
+    ).group_by(CreditLedgerEntry.plot_id)
+
+    await db.execute(delete(PlotCreditBalance).execution_options(synchronize_session=False))
+    await db.execute(insert(PlotCreditBalance).from_select(
+        ["plot_id", "generated", "reserved", "sold", "retired", "available"], source
+    ))
+    logger.info("Saldi dei crediti ricostruiti dal registro")
@@ -0,0 +1,200 @@
+"""
+Rollup giornaliero dei dati meteo e CO2/O2 per terreno (`plot_daily_stats`).
+
+Ogni riga riassume un giorno di `weather_data` di un terreno. La tabella viene
+aggiornata in modo incrementale solo per i giorni appena scritti dalla pipeline o dal
+backfill, così le metriche di sintesi aggregano poche righe giornaliere invece di
+tutto lo storico orario. Anche le ore acquisite da `fetch_and_save_weather_day` vengono
+riassunte subito; lo storico precedente al rollup si importa una volta con
+`backfill_daily_stats` (`python task_runner.py backfill-daily-stats`).
+
+Solo il calcolo CO2/O2 registra in `composition_version` la versione delle specie
+usata: acquisizione meteo e backfill del rollup inseriscono i giorni nuovi come
+`NOT_COMPUTED_VERSION` e non toccano la versione dei giorni già calcolati, così
+`recompute_dirty_plots` e i valori salvati per specie non scambiano totali vecchi per attuali.
+"""
+
+from datetime import date, datetime, timedelta
+from typing import List, Optional, Dict, Any
+from sqlalchemy import select, func, cast, Date, exists, and_, case, literal
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from BackEnd.app.models import WeatherData, PlotDailyStats, PlotCompositionVersion
+from BackEnd.app.logger_config import setup_logger
+
+# Logger per questo modulo
+logger = setup_logger(__name__)
+
+# Giorni di storico riassunti per volta da `backfill_daily_stats`
+DAILY_STATS_BACKFILL_CHUNK_DAYS = 31
+
+# `composition_version` di un giorno riassunto ma non ancora calcolato (inferiore a ogni versione)
+NOT_COMPUTED_VERSION = -1
+
+
+async def refresh_daily_stats(db: AsyncSession, start: date, end: date, plot_ids: Optional[List[int]] = None, computed: bool = False):
+    """
+    Ricalcola le righe di `plot_daily_stats` per i giorni e i terreni indicati.
+
+    Un solo `INSERT ... SELECT ... GROUP BY ... ON CONFLICT DO UPDATE` aggrega le ore
+    di `weather_data` dell'intervallo e sostituisce le righe giornaliere esistenti.
+    Con `computed` viene registrata la versione della composizione specie con cui i
+    totali sono appena stati calcolati; altrimenti i giorni nuovi restano
+    `NOT_COMPUTED_VERSION` e quelli esistenti mantengono la loro versione, salvo che
+    siano arrivate ore nuove, ancora da calcolare.
+
+    Args:
+        db (AsyncSession): La sessione asincrona del database.
+        start (date): Primo giorno da aggiornare.
+        end (date): Ultimo giorno da aggiornare (incluso).
+        plot_ids (Optional[List[int]]): Terreni da aggiornare; None per tutti.
+        computed (bool): True solo dal calcolo CO2/O2, subito dopo aver scritto i totali.
+    """
+    day = cast(WeatherData.date_time, Date)
+    if computed:
+        version = func.coalesce(PlotCompositionVersion.version, 0)
+    else:
+        version = literal(NOT_COMPUTED_VERSION)
+    source = (
+        select(
+            WeatherData.plot_id,
+            day.label("day"),
+            func.coalesce(func.sum(WeatherData.total_co2_absorption), 0),
+            func.coalesce(func.sum(WeatherData.total_o2_production), 0),
+            func.coalesce(func.sum(WeatherData.precipitation), 0),
+            func.count(WeatherData.precipitation),
+            func.max(WeatherData.temperature),
+            func.min(WeatherData.temperature),
+            func.count(WeatherData.id),
+            version,
+        )
+        .where(
+            WeatherData.date_time >= datetime.combine(start, datetime.min.time()),
+            WeatherData.date_time <= datetime.combine(end, datetime.max.time())
+        )
+        .group_by(WeatherData.plot_id, day)
+    )
+    if computed:
+        source = (
+            source.outerjoin(PlotCompositionVersion, PlotCompositionVersion.plot_id == WeatherData.plot_id)
+            .group_by(PlotCompositionVersion.version)
+        )
+    if plot_ids is not None:
+        source = source.where(WeatherData.plot_id.in_(plot_ids))
+
+    columns = [
+        "plot_id", "day", "co2_sum", "o2_sum", "precipitation_sum", "precipitation_count",
+        "temperature_max", "temperature_min", "hours_count", "composition_version",
+    ]
+    stmt = pg_insert(PlotDailyStats).from_select(columns, source)
+    set_ = {name: stmt.excluded[name] for name in columns[2:]}
+    if not computed:
+        set_["composition_version"] = case(
+            (PlotDailyStats.hours_count == stmt.excluded.hours_count, PlotDailyStats.composition_version),
+            else_=NOT_COMPUTED_VERSION
+        )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[PlotDailyStats.plot_id, PlotDailyStats.day],
+        set_=set_
+    )
+    await db.execute(stmt)
+
+
+async def backfill_daily_stats(db: AsyncSession, chunk_days: int = DAILY_STATS_BACKFILL_CHUNK_DAYS, commit: bool = False) -> int:
+    """
+    Crea le righe di `plot_daily_stats` mancanti per i giorni di `weather_data` mai riassunti.
+
+    Serve una volta per lo storico acquisito prima del rollup: i giorni mancanti vengono
+    cercati con una sola query e riassunti a blocchi con `refresh_daily_stats`, solo per
+    i terreni che ne hanno. I giorni aggiunti risultano non calcolati: i loro totali
+    possono venire da composizioni specie superate e vengono ricalcolati da
+    `recompute_dirty_plots`.
+
+    Args:
+        db (AsyncSession): La sessione asincrona del database.
+        chunk_days (int): Giorni riassunti per blocco.
+        commit (bool): Se True esegue il commit dopo ogni blocco.
+
+    Returns:
+        int: Numero di giorni (terreno, giorno) aggiunti al rollup.
+    """
+    day = cast(WeatherData.date_time, Date)
+    missing = (
+        select(WeatherData.plot_id, day.label("day"))
+        .where(~exists().where(and_(PlotDailyStats.plot_id == WeatherData.plot_id, PlotDailyStats.day == day)))
+        .distinct()
+        .subquery()
+    )
+    rows = (await db.execute(
+        select(missing.c.plot_id, func.min(missing.c.day), func.max(missing.c.day), func.count())
+        .group_by(missing.c.plot_id)
+    )).all()
+    if not rows:
+        return 0
+
+    plot_ids = [plot_id for plot_id, _, _, _ in rows]
+    start = min(first_day for _, first_day, _, _ in rows)
+    end = max(last_day for _, _, last_day, _ in rows)
+    days = sum(count for _, _, _, count in rows)
+    logger.info(f"Rollup giornaliero di {days} giorni mancanti per {len(plot_ids)} terreni ({start} - {end})")
+
+    chunk_start = start
+    while chunk_start <= end:
+        chunk_end = min(chunk_start + timedelta(days=chunk_days - 1), end)
+        await refresh_daily_stats(db, chunk_start, chunk_end, plot_ids)
+        if commit:
+            await db.commit()
+        chunk_start = chunk_end + timedelta(days=1)
+    return days
+
+
+def computed_composition_version(plot_id: int, day: date):
+    """Sottoquery della versione di composizione con cui è stato calcolato un giorno (NULL se non riassunto, `NOT_COMPUTED_VERSION` se non calcolato)."""
+    return (
+        select(PlotDailyStats.composition_version)
+        .where(PlotDailyStats.plot_id == plot_id, PlotDailyStats.day == day)
+        .scalar_subquery()
+    )
+
+
+def current_composition_version(plot_id: int):
+    """Sottoquery della versione corrente della composizione specie di un terreno (0 se mai modificata)."""
+    return func.coalesce(
+        select(PlotCompositionVersion.version)
+        .where(PlotCompositionVersion.plot_id == plot_id)
+        .scalar_subquery(),
+        0
+    )
+
+
+async def get_plot_summary_stats(db: AsyncSession, plot_id: int) -> Dict[str, Any]:
+    """
+    Calcola le metriche di sintesi di un terreno aggregando le sue righe giornaliere.
+
+    Args:
+        db (AsyncSession): La sessione asincrona del database.
+        plot_id (int): L'ID del terreno.
+
+    Returns:
+        Dict[str, Any]: Chiavi "co2_totale", "o2_totale", "pioggia_media", "temp_max", "temp_min".
+    """
+    result = await db.execute(
+        select(
+            func.coalesce(func.sum(PlotDailyStats.co2_sum), 0),
+            func.coalesce(func.sum(PlotDailyStats.o2_sum), 0),
+            func.coalesce(func.sum(PlotDailyStats.precipitation_sum), 0),
+            func.coalesce(func.sum(PlotDailyStats.precipitation_count), 0),
+            func.coalesce(func.max(PlotDailyStats.temperature_max), 0),
+            func.coalesce(func.min(PlotDailyStats.temperature_min), 0),
+        ).where(PlotDailyStats.plot_id == plot_id)
+    )
+    co2_tot, o2_tot, pioggia_tot, pioggia_count, t_max, t_min = result.first()
+
+    return {
+        "co2_totale": co2_tot,
+        "o2_totale": o2_tot,
+        # Media oraria come AVG(precipitation) sulle ore con un valore
+        "pioggia_media": pioggia_tot / pioggia_count if pioggia_count else 0,
+        "temp_max": t_max,
+        "temp_min": t_min,
+    }
@@ -0,0 +1,74 @@
+"""
+Riduzione delle serie orarie per i grafici con Largest-Triangle-Three-Buckets (LTTB).
+
+Per le viste su più mesi il numero di punti restituito resta al massimo `max_points`,
+conservando picchi e andamento della curva invece di un semplice campionamento a passo fisso.
+"""
+
+from typing import List, Dict, Any, Optional
+import numpy as np
+
+
+def lttb_indices(y, max_points: int, x=None) -> np.ndarray:
+    """
+    Sceglie gli indici dei punti da conservare con l'algoritmo LTTB.
+
+    Le medie dei bucket e le aree dei triangoli sono calcolate in NumPy; resta un
+    ciclo sui bucket perché ogni scelta dipende dal punto scelto nel bucket precedente.
+
+    Args:
+        y: Valori della serie (None/NaN sono trattati come 0 nel calcolo delle aree).
+        max_points (int): Numero massimo di punti da restituire (almeno 3).
+        x: Ascisse dei punti; se assenti si usa la posizione, adatta a serie orarie regolari.
+
+    Returns:
+        np.ndarray: Indici crescenti dei punti scelti, primo e ultimo sempre inclusi.
+    """
+    y = np.nan_to_num(np.asarray(y, dtype=float))
+    n = y.size
+    if max_points < 3 or n <= max_points:
+        return np.arange(n)
+    x = np.arange(n, dtype=float) if x is None else np.asarray(x, dtype=float)
+
+    # Confini dei bucket interni: il primo e l'ultimo punto restano fuori
+    edges = (np.floor(np.arange(max_points - 1) * ((n - 2) / (max_points - 2))) + 1).astype(np.intp)
+    edges[-1] = n - 1
+    starts, ends = edges[:-1], edges[1:]
+
+    # Media di ogni bucket (punto "C" del triangolo per il bucket precedente)
+    counts = ends - starts
+    avg_x = np.add.reduceat(x[:-1], starts) / counts
+    avg_y = np.add.reduceat(y[:-1], starts) / counts
+    next_x = np.append(avg_x[1:], x[-1])
+    next_y = np.append(avg_y[1:], y[-1])
+
+    selected = np.empty(max_points, dtype=np.intp)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i, (lo, hi) in enumerate(zip(starts, ends)):
+        area = np.abs(
+            (x[a] - next_x[i]) * (y[lo:hi] - y[a])
+            - (x[a] - x[lo:hi]) * (next_y[i] - y[a])
+        )
+        a = lo + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def downsample_records(records: List[Dict[str, Any]], max_points: Optional[int], key: str) -> List[Dict[str, Any]]:
+    """
+    Riduce una lista di record ordinati nel tempo a `max_points` elementi con LTTB.
+
+    Args:
+        records (List[Dict[str, Any]]): Record della serie, già ordinati.
+        max_points (Optional[int]): Numero massimo di punti; None lascia la serie intatta.
+        key (str): Campo usato come valore della curva per scegliere i punti.
+
+    Returns:
+        List[Dict[str, Any]]: I record conservati, nello stesso ordine e formato.
+    """
+    if not max_points or len(records) <= max_points:
+        return records
+    values = [r.get(key) for r in records]
+    values = np.array([np.nan if v is None else v for v in values], dtype=float)
+    return [records[i] for i in lttb_indices(values, max_points)]
@@ -0,0 +1,198 @@
+"""
+Esportazione in streaming dello storico orario dei terreni (meteo + CO2/O2 calcolati).
+
+Le righe di `weather_data` vengono lette con un cursore lato server (`yield_per`) e
+scritte a blocchi direttamente nella `StreamingResponse`: la memoria usata dipende
+dalla dimensione del blocco, non dal numero di righe esportate.
+
+Formati: CSV, NDJSON e Parquet.
+"""
+
+import csv
+import io
+import json
+from datetime import datetime
+from typing import AsyncIterator, List
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from BackEnd.app.database import SessionLocal
+from BackEnd.app.models import Plot, WeatherData
+from BackEnd.app.schemas import EsportaRequest
+from BackEnd.app.logger_config import setup_logger
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Logger per questo modulo
+logger = setup_logger(__name__)
+
+# Righe lette dal cursore e scritte nella risposta per ogni blocco
+EXPORT_BATCH_SIZE = 5000
+
+# Colonne esportate, nell'ordine del file
+EXPORT_COLUMNS = [
+    "plot_id", "plot_name", "date_time", "temperature", "precipitation",
+    "solar_radiation", "humidity", "total_co2_absorption", "total_o2_production",
+]
+
+# Formato -> content type della risposta
+MEDIA_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+class _ChunkSink(io.RawIOBase):
+    """
+    File di sola scrittura che accumula i byte prodotti da `ParquetWriter`
+    finché non vengono prelevati con `drain`, tenendo traccia della posizione.
+    """
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class Esporta:
+    """
+    Esportazione in streaming dei dati orari dei terreni di un utente.
+
+    Args:
+        payload (EsportaRequest): Formato, intervallo di date e terreni da esportare.
+        user_id (int): L'utente proprietario dei terreni.
+        batch_size (int): Righe per blocco letto dal cursore e scritto nella risposta.
+
+    Raises:
+        HTTPException: Se il formato non è supportato.
+    """
+
+    def __init__(self, payload: EsportaRequest, user_id: int, batch_size: int = EXPORT_BATCH_SIZE):
+        if payload.formato not in MEDIA_TYPES:
+            raise HTTPException(status_code=400, detail=f"Formato non supportato: {payload.formato}")
+        self.payload = payload
+        self.user_id = user_id
+        self.batch_size = batch_size
+
+    @property
+    def filename(self) -> str:
+        return f"export_{self.payload.start.isoformat()}_{self.payload.end.isoformat()}.{self.payload.formato}"
+
+    def query(self):
+        """Query delle righe da esportare, ordinate per terreno e ora."""
+        stmt = (
+            select(
+                WeatherData.plot_id,
+                Plot.name,
+                WeatherData.date_time,
+                WeatherData.temperature,
+                WeatherData.precipitation,
+                WeatherData.solar_radiation,
+                WeatherData.humidity,
+                WeatherData.total_co2_absorption,
+                WeatherData.total_o2_production,
+            )
+            .join(Plot, Plot.id == WeatherData.plot_id)
+            .where(
+                Plot.user_id == self.user_id,
+                WeatherData.date_time >= datetime.combine(self.payload.start, datetime.min.time()),
+                WeatherData.date_time <= datetime.combine(self.payload.end, datetime.max.time()),
+            )
+            .order_by(WeatherData.plot_id, WeatherData.date_time)
+        )
+        if self.payload.plot_ids:
+            stmt = stmt.where(WeatherData.plot_id.in_(self.payload.plot_ids))
+        return stmt
+
+    async def _partitions(self) -> AsyncIterator[list]:
+        """
+        Legge le righe a blocchi con un cursore lato server.
+
+        La sessione è aperta qui e non presa dalla richiesta, perché il corpo della
+        risposta viene prodotto dopo che l'endpoint ha già restituito.
+        """
+        async with SessionLocal() as db:
+            result = await db.stream(self.query().execution_options(yield_per=self.batch_size))
+            async for partition in result.partitions():
+                yield partition
+
+    async def _csv(self) -> AsyncIterator[bytes]:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_COLUMNS)
+        async for partition in self._partitions():
+            writer.writerows(partition)
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate(0)
+        if buffer.tell():
+            yield buffer.getvalue().encode("utf-8")
+
+    async def _ndjson(self) -> AsyncIterator[bytes]:
+        async for partition in self._partitions():
+            lines = [
+                json.dumps(dict(zip(EXPORT_COLUMNS, row)), default=lambda value: value.isoformat())
+                for row in partition
+            ]
+            yield ("\n".join(lines) + "\n").encode("utf-8")
+
+    async def _parquet(self) -> AsyncIterator[bytes]:
+        schema = pa.schema([
+            ("plot_id", pa.int32()),
+            ("plot_name", pa.string()),
+            ("date_time", pa.timestamp("s")),
+            ("temperature", pa.float64()),
+            ("precipitation", pa.float64()),
+            ("solar_radiation", pa.float64()),
+            ("humidity", pa.int32()),
+            ("total_co2_absorption", pa.float64()),
+            ("total_o2_production", pa.float64()),
+        ])
+        sink = _ChunkSink()
+        # Un row group per blocco: il file si scrive in modo incrementale e il footer alla fine
+        writer = pq.ParquetWriter(sink, schema)
+        try:
+            async for partition in self._partitions():
+                columns = list(zip(*partition))
+                writer.write_table(pa.Table.from_arrays(
+                    [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+                    schema=schema
+                ))
+                yield sink.drain()
+        finally:
+            writer.close()
+        yield sink.drain()
+
+    async def stream(self) -> AsyncIterator[bytes]:
+        """Produce il file esportato a blocchi di byte."""
+        generators = {"csv": self._csv, "ndjson": self._ndjson, "parquet": self._parquet}
+        formato = self.payload.formato
+        logger.info(f"Esportazione {formato} per user_id={self.user_id} ({self.payload.start} - {self.payload.end})")
+        async for chunk in generators[formato]():
+            if chunk:
+                yield chunk
+
+    def response(self) -> StreamingResponse:
+        """Restituisce la `StreamingResponse` con il file esportato come allegato."""
+        return StreamingResponse(
+            self.stream(),
+            media_type=MEDIA_TYPES[self.payload.formato],
+            headers={"Content-Disposition": f'attachment; filename="{self.filename}"'}
+        )
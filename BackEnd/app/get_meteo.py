@@ -1,36 +1,23 @@
 import requests
+import httpx
 from sqlalchemy import create_engine, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import sessionmaker
 from datetime import datetime
 import os
 from dotenv import load_dotenv
 from BackEnd.app.models import WeatherData
 from BackEnd.app.parte_finale_connect_db import recupero_coords_geocentroide
-from BackEnd.app.co2_o2_calculator import aggiorna_weatherdata_con_assorbimenti
+from BackEnd.app.co2_o2_calculator import aggiorna_weatherdata_con_assorbimenti, compute_meteo_factor
+from BackEnd.app.daily_stats import refresh_daily_stats
 from sqlalchemy.ext.asyncio import AsyncSession
-import asyncio
+from typing import Optional
 from BackEnd.app.logger_config import setup_logger
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+from BackEnd.app.http_client import get_json, OPEN_METEO_DEFAULT_URL
 
 # Logger per questo modulo
 logger = setup_logger(__name__) 
 
-# === RETRY STRATEGY PER API ===
-def get_session_with_retries():
-    """Crea una sessione requests con retry logic"""
-    session = requests.Session()
-    retry_strategy = Retry(
-        total=3,  # numero totale di retry
-        backoff_factor=1,  # aspetta 1s, poi 2s, poi 4s
-        status_forcelist=[429, 500, 502, 503, 504],
-        allowed_methods=["GET"]
-    )
-    adapter = HTTPAdapter(max_retries=retry_strategy)
-    session.mount("http://", adapter)
-    session.mount("https://", adapter)
-    return session
-
 # === COORDINATE DEL PLOT PRINCIPALE ===
 # NOTA: Queste variabili globali non sono più utilizzate.
 # Le coordinate vengono passate dinamicamente da task_runner.py o dalle route API
@@ -42,22 +29,28 @@ def get_session_with_retries():
 # logger.debug(f"Coordinate plot: plot_id={plot_id}, lat={latitude}, lon={longitude}")
 
 # === FETCH METEO E SALVATAGGIO ===
-async def fetch_and_save_weather_day(db: AsyncSession, plot_id: int, lat: float, lon: float) -> bool:
+async def fetch_and_save_weather_day(db: AsyncSession, plot_id: int, lat: float, lon: float, client: Optional[httpx.AsyncClient] = None) -> bool:
     """
     Versione asincrona che riceve la sessione DB da FastAPI.
     Recupera dati meteo da Open-Meteo API e li salva nel database.
+    La richiesta usa il client HTTP condiviso (keep-alive e retry con backoff).
+    Le ore del giorno vengono salvate con un solo INSERT ... ON CONFLICT sul vincolo
+    unico (plot_id, date_time): fetch concorrenti non possono duplicare un'ora e le ore
+    già salvate restano invariate, con i loro totali CO2/O2.
+    Il giorno viene poi riassunto in `plot_daily_stats`.
 
     Args:
         db: Sessione database asincrona
         plot_id: ID del terreno
         lat: Latitudine
         lon: Longitudine
+        client: Client HTTP da usare; None per il client condiviso
 
     Returns:
         bool: True se successo, False altrimenti
     """
     logger.info(f"Chiamata a Open-Meteo per plot {plot_id}")
-    url = "https://api.open-meteo.com/v1/forecast"
+    url = os.getenv("OPEN_METEO_URL", OPEN_METEO_DEFAULT_URL)
     params = {
         "latitude": lat,
         "longitude": lon,
@@ -67,60 +60,54 @@ async def fetch_and_save_weather_day(db: AsyncSession, plot_id: int, lat: float,
     }
 
     try:
-        loop = asyncio.get_running_loop()
-        # Usa sessione con retry strategy
-        session_with_retry = get_session_with_retries()
-        response = await loop.run_in_executor(
-            None,
-            lambda: session_with_retry.get(url, params=params, timeout=15)  # ⏰ Timeout 15 secondi
-        )
-        response.raise_for_status()  # Solleva un errore per status codes >= 400
-
-        hourly = response.json().get("hourly", {})
+        data = await get_json(url, params=params, client=client)
+
+        hourly = data.get("hourly", {})
         if not hourly.get("time"):
             logger.warning("Nessun dato orario ricevuto da Open-Meteo")
             return False
 
-        count = 0
-        for i in range(len(hourly["time"])):
-            timestamp = datetime.fromisoformat(hourly["time"][i])
-
-            # Controlla se il dato esiste già usando la sessione async
-            stmt = select(WeatherData.id).where(
-                WeatherData.plot_id == plot_id,
-                WeatherData.date_time == timestamp
-            )
-            existing = await db.execute(stmt)
-            if existing.first():  # ✅ non lancia errore se ci sono più righe
-                logger.debug(f"Dato già presente per ora {timestamp}, skip")
-                continue
-
-
-            weather = WeatherData(
-                plot_id=plot_id,
-                date_time=timestamp,
-                temperature=hourly["temperature_2m"][i],
-                humidity=hourly["relative_humidity_2m"][i],
-                precipitation=hourly["precipitation"][i],
-                solar_radiation=hourly["shortwave_radiation"][i],
+        rows = [
+            {
+                "plot_id": plot_id,
+                "date_time": datetime.fromisoformat(hourly["time"][i]),
+                "temperature": hourly["temperature_2m"][i],
+                "humidity": hourly["relative_humidity_2m"][i],
+                "precipitation": hourly["precipitation"][i],
+                "solar_radiation": hourly["shortwave_radiation"][i],
+                # Fattore meteo normalizzato, calcolato una volta qui e riusato da ogni calcolo CO2/O2
+                "meteo_factor": compute_meteo_factor(
+                    hourly["shortwave_radiation"][i],
+                    hourly["temperature_2m"][i],
+                    hourly["relative_humidity_2m"][i]
+                ),
                 # I valori CO2/O2 vengono inizializzati a 0
-                total_co2_absorption=0,
-                total_o2_production=0
-            )
-            db.add(weather)
-            count += 1
+                "total_co2_absorption": 0,
+                "total_o2_production": 0,
+            }
+            for i in range(len(hourly["time"]))
+        ]
+
+        # Un solo statement per tutte le ore: le ore già presenti vengono saltate,
+        # senza una SELECT per ora
+        stmt = pg_insert(WeatherData).values(rows).on_conflict_do_nothing(constraint="uq_weather_data_plot_time")
+        result = await db.execute(stmt)
+
+        # Rollup giornaliero dei giorni appena acquisiti, così la sintesi del terreno li include subito
+        days = [row["date_time"].date() for row in rows]
+        await refresh_daily_stats(db, min(days), max(days), [plot_id])
 
         # Il commit verrà gestito dall'endpoint di FastAPI,
         # ma possiamo farlo anche qui per essere espliciti se necessario.
         # await db.commit()
 
-        logger.info(f"Aggiunte {count} righe meteo nuove per il plot {plot_id}")
+        logger.info(f"Aggiunte {result.rowcount} righe meteo nuove per il plot {plot_id}")
         return True
 
-    except requests.Timeout as e:
+    except httpx.TimeoutException as e:
         logger.error(f"Timeout nella richiesta meteo per plot {plot_id}: {e}")
         return False
-    except requests.RequestException as e:
+    except httpx.HTTPError as e:
         logger.error(f"Errore nella richiesta meteo per plot {plot_id}: {e}")
         return False
     except Exception as e:
@@ -140,7 +127,7 @@ def fetch_weather_week(lat, lon):
     Returns:
         list: Lista di dict con dati meteo giornalieri, False se errore
     """
-    url = "https://api.open-meteo.com/v1/forecast"
+    url = os.getenv("OPEN_METEO_URL", OPEN_METEO_DEFAULT_URL)
     params = {
         "latitude": lat,
         "longitude": lon,
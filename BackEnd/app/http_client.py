@@ -0,0 +1,145 @@
+"""
+Client HTTP asincrono condiviso per le API esterne (Open-Meteo).
+
+Un solo `httpx.AsyncClient` per processo, aperto all'avvio dell'app FastAPI o di
+`task_runner.py` e chiuso alla fine: le connessioni restano aperte (keep-alive) e
+vengono riusate tra le richieste, invece di rifare handshake TCP e TLS per ogni terreno.
+Il pool è limitato, così molti terreni in parallelo non aprono connessioni senza limite
+verso l'API, e gli errori temporanei vengono ritentati con backoff esponenziale.
+
+Per i test contro un server locale basta impostare `OPEN_METEO_URL` o passare un
+client creato con `create_http_client(transport=...)`.
+"""
+
+import asyncio
+from typing import Any, Dict, Optional
+import httpx
+from BackEnd.app.logger_config import setup_logger
+
+# Logger per questo modulo
+logger = setup_logger(__name__)
+
+# Endpoint di Open-Meteo usato se `OPEN_METEO_URL` non è impostato
+OPEN_METEO_DEFAULT_URL = "https://api.open-meteo.com/v1/forecast"
+
+# Secondi massimi per ogni richiesta
+HTTP_TIMEOUT_SECONDS = 15
+
+# Connessioni massime aperte e connessioni tenute in keep-alive. Il client parla solo
+# con Open-Meteo, quindi il limite del pool è di fatto il limite per host.
+HTTP_MAX_CONNECTIONS = 10
+HTTP_MAX_KEEPALIVE_CONNECTIONS = 10
+
+# Tentativi totali per richiesta e attesa del primo ritentativo (poi 2s, 4s, ...)
+HTTP_RETRY_ATTEMPTS = 3
+HTTP_RETRY_BACKOFF_SECONDS = 1.0
+
+# Attesa massima tra due tentativi, anche se `Retry-After` chiede di più
+HTTP_RETRY_MAX_DELAY_SECONDS = 30.0
+
+# Status per cui la richiesta viene ritentata
+HTTP_RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Client condiviso del processo, gestito da `start_http_client` / `close_http_client`
+_client: Optional[httpx.AsyncClient] = None
+
+
+def create_http_client(**kwargs) -> httpx.AsyncClient:
+    """
+    Crea un client asincrono con pool di connessioni limitato e keep-alive.
+
+    Args:
+        **kwargs: Argomenti aggiuntivi per `httpx.AsyncClient` (ad esempio `transport`).
+
+    Returns:
+        httpx.AsyncClient: Il nuovo client, da chiudere con `aclose()`.
+    """
+    kwargs.setdefault("timeout", HTTP_TIMEOUT_SECONDS)
+    kwargs.setdefault("limits", httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS
+    ))
+    return httpx.AsyncClient(**kwargs)
+
+
+async def start_http_client():
+    """Apre il client condiviso (all'avvio dell'app o di `task_runner.py`)."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = create_http_client()
+        logger.info("Client HTTP condiviso avviato")
+
+
+async def close_http_client():
+    """Chiude il client condiviso e le sue connessioni."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+        logger.info("Client HTTP condiviso chiuso")
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Restituisce il client condiviso, creandolo se non è ancora stato avviato
+    (ad esempio negli script che non passano da `start_http_client`).
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = create_http_client()
+    return _client
+
+
+def _retry_delay(response: Optional[httpx.Response], attempt: int, backoff: float) -> float:
+    """
+    Attesa prima del prossimo tentativo: `Retry-After` se indicato, altrimenti backoff
+    esponenziale, in entrambi i casi al massimo `HTTP_RETRY_MAX_DELAY_SECONDS`.
+    """
+    if response is not None:
+        retry_after = response.headers.get("retry-after")
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), HTTP_RETRY_MAX_DELAY_SECONDS)
+    return min(backoff * (2 ** attempt), HTTP_RETRY_MAX_DELAY_SECONDS)
+
+
+async def get_json(
+    url: str,
+    params: Optional[Dict[str, Any]] = None,
+    client: Optional[httpx.AsyncClient] = None,
+    attempts: int = HTTP_RETRY_ATTEMPTS,
+    backoff: float = HTTP_RETRY_BACKOFF_SECONDS
+) -> Dict[str, Any]:
+    """
+    Esegue una GET e restituisce il JSON, ritentando errori di rete e status temporanei.
+
+    Args:
+        url (str): URL da chiamare.
+        params (Optional[Dict[str, Any]]): Parametri della query string.
+        client (Optional[httpx.AsyncClient]): Client da usare; None per il client condiviso.
+        attempts (int): Tentativi totali.
+        backoff (float): Secondi di attesa prima del primo ritentativo.
+
+    Returns:
+        Dict[str, Any]: Il corpo della risposta decodificato.
+
+    Raises:
+        httpx.HTTPStatusError: Se la risposta finale ha status >= 400.
+        httpx.TransportError: Se la rete fallisce anche all'ultimo tentativo.
+    """
+    client = client or get_http_client()
+    for attempt in range(attempts):
+        last_attempt = attempt == attempts - 1
+        try:
+            response = await client.get(url, params=params)
+        except httpx.TransportError as e:
+            if last_attempt:
+                raise
+            delay = _retry_delay(None, attempt, backoff)
+            logger.warning(f"Errore di rete verso {url} ({e!r}), nuovo tentativo tra {delay:.0f}s")
+        else:
+            if response.status_code not in HTTP_RETRY_STATUSES or last_attempt:
+                response.raise_for_status()
+                return response.json()
+            delay = _retry_delay(response, attempt, backoff)
+            logger.warning(f"Status {response.status_code} da {url}, nuovo tentativo tra {delay:.0f}s")
+        await asyncio.sleep(delay)
@@ -0,0 +1,329 @@
+"""
+Classifica di terreni e utenti per CO2 assorbita (`leaderboard`).
+
+La tabella è materializzata: la pipeline ricalcola solo i terreni appena scritti (e
+i rispettivi utenti) a partire dal rollup `plot_daily_stats`, poi aggiorna le posizioni
+con una funzione finestra sulla sola tabella di classifica. Le richieste di top-K e
+"la mia posizione" sono quindi letture su indice, senza GROUP BY su `weather_data`.
+I terreni eliminati vengono tolti con `remove_plot_from_leaderboard`.
+"""
+
+from datetime import date, timedelta
+from typing import List, Optional, Dict, Any
+from sqlalchemy import select, update, delete, exists, func, cast, case, literal, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from geoalchemy2 import Geography
+from BackEnd.app.models import Plot, PlotDailyStats, LeaderboardEntry
+
+# Criterio di classifica -> (colonna del valore, colonna della posizione)
+CRITERI = {
+    "totale": ("co2_total", "rank_total"),
+    "30giorni": ("co2_30d", "rank_30d"),
+    "per_ettaro": ("co2_per_ha", "rank_per_ha"),
+}
+
+# Ambito della classifica -> valore di `scope`
+AMBITI = {
+    "terreni": "plot",
+    "utenti": "user",
+}
+
+# Giorni considerati dal criterio "30giorni"
+RECENT_DAYS = 30
+
+
+async def refresh_leaderboard(db: AsyncSession, plot_ids: Optional[List[int]] = None):
+    """
+    Aggiorna la classifica per i terreni indicati, i loro utenti e le posizioni.
+
+    Oltre ai terreni indicati vengono sempre aggiornati il valore "30giorni" di tutti i
+    terreni (la finestra si sposta anche per chi non ha dati nuovi) e le righe dei
+    terreni eliminati. Le posizioni vengono ricalcolate solo per gli ambiti cambiati.
+
+    Args:
+        db (AsyncSession): La sessione asincrona del database.
+        plot_ids (Optional[List[int]]): Terreni appena ricalcolati; None per ricostruire tutto.
+    """
+    # --- Terreni: totali dal rollup giornaliero ---
+    recent_start = date.today() - timedelta(days=RECENT_DAYS)
+    area_ha = func.coalesce(func.ST_Area(cast(Plot.geom, Geography(srid=4326))) / 10000.0, 0)
+    co2_total = func.coalesce(func.sum(PlotDailyStats.co2_sum), 0)
+    plots = (
+        select(
+            literal("plot"),
+            Plot.id,
+            Plot.user_id,
+            co2_total,
+            func.coalesce(func.sum(PlotDailyStats.co2_sum).filter(PlotDailyStats.day >= recent_start), 0),
+            area_ha,
+            case((area_ha > 0, co2_total / area_ha), else_=0),
+        )
+        .outerjoin(PlotDailyStats, PlotDailyStats.plot_id == Plot.id)
+        .where(Plot.user_id.is_not(None))
+        .group_by(Plot.id, Plot.user_id, Plot.geom)
+    )
+    if plot_ids is not None:
+        plots = plots.where(Plot.id.in_(plot_ids))
+    upserted = await _upsert_entries(db, plots)
+
+    # Terreni eliminati e finestra dei 30 giorni degli altri terreni
+    removed_users = await _delete_removed_plots(db)
+    recent_users = await _refresh_recent_totals(db, recent_start)
+    plots_changed = upserted or removed_users or recent_users
+    user_ids = set(removed_users) | set(recent_users)
+
+    # --- Utenti: solo quelli dei terreni cambiati ---
+    if plot_ids is not None:
+        user_ids.update((await db.execute(select(Plot.user_id).where(Plot.id.in_(plot_ids)))).scalars().all())
+    users_changed = await _refresh_user_entries(db, None if plot_ids is None else list(user_ids))
+
+    await _refresh_ranks(db, [scope for scope, changed in (("plot", plots_changed), ("user", users_changed)) if changed])
+
+
+async def remove_plot_from_leaderboard(db: AsyncSession, plot_id: int):
+    """
+    Toglie dalla classifica un terreno eliminato e aggiorna il suo utente e le posizioni.
+
+    Va eseguita nella stessa transazione che elimina il terreno.
+
+    Args:
+        db (AsyncSession): La sessione asincrona del database.
+        plot_id (int): L'ID del terreno eliminato.
+    """
+    result = await db.execute(
+        delete(LeaderboardEntry)
+        .where(LeaderboardEntry.scope == "plot", LeaderboardEntry.entity_id == plot_id)
+        .returning(LeaderboardEntry.user_id)
+        .execution_options(synchronize_session=False)
+    )
+    user_id = result.scalar_one_or_none()
+    if user_id is None:
+        return
+    await _refresh_user_entries(db, [user_id])
+    await _refresh_ranks(db, list(AMBITI.values()))
+
+
+async def _delete_removed_plots(db: AsyncSession) -> List[int]:
+    """Elimina le righe dei terreni che non esistono più e restituisce i loro utenti."""
+    result = await db.execute(
+        delete(LeaderboardEntry)
+        .where(LeaderboardEntry.scope == "plot", ~exists().where(Plot.id == LeaderboardEntry.entity_id))
+        .returning(LeaderboardEntry.user_id)
+        .execution_options(synchronize_session=False)
+    )
+    return list(result.scalars().all())
+
+
+async def _refresh_recent_totals(db: AsyncSession, recent_start: date) -> List[int]:
+    """
+    Aggiorna il valore "30giorni" di tutti i terreni in classifica con una lettura
+    indicizzata del rollup, e restituisce gli utenti dei terreni il cui valore è cambiato.
+    """
+    recent = func.coalesce(
+        select(func.sum(PlotDailyStats.co2_sum))
+        .where(PlotDailyStats.plot_id == LeaderboardEntry.entity_id, PlotDailyStats.day >= recent_start)
+        .scalar_subquery(),
+        0
+    )
+    result = await db.execute(
+        update(LeaderboardEntry)
+        .where(LeaderboardEntry.scope == "plot", LeaderboardEntry.co2_30d.is_distinct_from(recent))
+        .values(co2_30d=recent, updated_at=func.now())
+        .returning(LeaderboardEntry.user_id)
+        .execution_options(synchronize_session=False)
+    )
+    return list(result.scalars().all())
+
+
+async def _refresh_user_entries(db: AsyncSession, user_ids: Optional[List[int]] = None) -> int:
+    """
+    Ricalcola le righe degli utenti indicati sommando i loro terreni in classifica ed
+    elimina quelle degli utenti senza più terreni.
+
+    Returns:
+        int: Numero di righe utente inserite, modificate o eliminate.
+    """
+    if user_ids is not None and not user_ids:
+        return 0
+
+    plot_rows = LeaderboardEntry.__table__.alias("plot_rows")
+    user_area = func.sum(plot_rows.c.area_ha)
+    user_co2 = func.sum(plot_rows.c.co2_total)
+    users = (
+        select(
+            literal("user"),
+            plot_rows.c.user_id,
+            plot_rows.c.user_id,
+            user_co2,
+            func.sum(plot_rows.c.co2_30d),
+            user_area,
+            case((user_area > 0, user_co2 / user_area), else_=0),
+        )
+        .where(plot_rows.c.scope == "plot")
+        .group_by(plot_rows.c.user_id)
+    )
+    if user_ids is not None:
+        users = users.where(plot_rows.c.user_id.in_(user_ids))
+    changed = await _upsert_entries(db, users)
+
+    # Utenti senza più terreni in classifica
+    orphans = delete(LeaderboardEntry).where(
+        LeaderboardEntry.scope == "user",
+        LeaderboardEntry.entity_id.not_in(
+            select(LeaderboardEntry.user_id).where(LeaderboardEntry.scope == "plot")
+        )
+    )
+    if user_ids is not None:
+        orphans = orphans.where(LeaderboardEntry.entity_id.in_(user_ids))
+    result = await db.execute(orphans.execution_options(synchronize_session=False))
+    return changed + result.rowcount
+
+
+async def _upsert_entries(db: AsyncSession, source) -> int:
+    """
+    Inserisce o aggiorna le righe di classifica prodotte da `source`; le righe con gli
+    stessi valori non vengono riscritte.
+
+    Returns:
+        int: Numero di righe inserite o modificate.
+    """
+    columns = ["scope", "entity_id", "user_id", "co2_total", "co2_30d", "area_ha", "co2_per_ha"]
+    stmt = pg_insert(LeaderboardEntry).from_select(columns, source)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[LeaderboardEntry.scope, LeaderboardEntry.entity_id],
+        set_={**{name: stmt.excluded[name] for name in columns[2:]}, "updated_at": func.now()},
+        where=tuple_(*[getattr(LeaderboardEntry, name) for name in columns[2:]])
+        .is_distinct_from(tuple_(*[stmt.excluded[name] for name in columns[2:]]))
+    )
+    result = await db.execute(stmt)
+    return result.rowcount
+
+
+async def _refresh_ranks(db: AsyncSession, scopes: List[str]):
+    """
+    Ricalcola le posizioni di tutti i criteri con `rank()` per gli ambiti indicati.
+
+    La finestra lavora sulle sole righe di classifica di quegli ambiti (una riga per
+    terreno o utente) e vengono riscritte solo le righe la cui posizione è cambiata.
+    """
+    if not scopes:
+        return
+
+    ranked = select(
+        LeaderboardEntry.scope,
+        LeaderboardEntry.entity_id,
+        *[
+            func.rank().over(
+                partition_by=LeaderboardEntry.scope,
+                order_by=getattr(LeaderboardEntry, value_column).desc()
+            ).label(rank_column)
+            for value_column, rank_column in CRITERI.values()
+        ]
+    ).where(LeaderboardEntry.scope.in_(scopes)).subquery()
+
+    rank_columns = [rank_column for _, rank_column in CRITERI.values()]
+    stmt = (
+        update(LeaderboardEntry)
+        .where(
+            LeaderboardEntry.scope == ranked.c.scope,
+            LeaderboardEntry.entity_id == ranked.c.entity_id,
+            tuple_(*[getattr(LeaderboardEntry, name) for name in rank_columns])
+            .is_distinct_from(tuple_(*[ranked.c[name] for name in rank_columns]))
+        )
+        .values({name: ranked.c[name] for name in rank_columns})
+        .execution_options(synchronize_session=False)
+    )
+    await db.execute(stmt)
+
+
+def _entry_to_dict(entry: LeaderboardEntry, criterio: str, name: Optional[str] = None) -> Dict[str, Any]:
+    """Converte una riga di classifica nel formato restituito dalle API."""
+    value_column, rank_column = CRITERI[criterio]
+    return {
+        "posizione": getattr(entry, rank_column),
+        "id": entry.entity_id,
+        "user_id": entry.user_id,
+        "nome": name,
+        "valore": getattr(entry, value_column),
+        "co2_totale": entry.co2_total,
+        "co2_30_giorni": entry.co2_30d,
+        "co2_per_ettaro": entry.co2_per_ha,
+        "ettari": entry.area_ha,
+    }
+
+
+async def get_leaderboard_top(db: AsyncSession, criterio: str = "totale", ambito: str = "terreni", limite: int = 10) -> List[Dict[str, Any]]:
+    """
+    Restituisce le prime `limite` posizioni della classifica.
+
+    Args:
+        db (AsyncSession): La sessione asincrona del database.
+        criterio (str): "totale", "30giorni" o "per_ettaro".
+        ambito (str): "terreni" o "utenti".
+        limite (int): Numero di posizioni da restituire.
+
+    Returns:
+        List[Dict[str, Any]]: Le righe di classifica ordinate per posizione.
+
+    Raises:
+        ValueError: Se criterio o ambito non sono supportati.
+    """
+    if criterio not in CRITERI or ambito not in AMBITI:
+        raise ValueError(f"Classifica non supportata: {criterio}/{ambito}")
+    rank_column = getattr(LeaderboardEntry, CRITERI[criterio][1])
+
+    stmt = (
+        select(LeaderboardEntry, Plot.name)
+        .outerjoin(Plot, (LeaderboardEntry.scope == "plot") & (Plot.id == LeaderboardEntry.entity_id))
+        .where(LeaderboardEntry.scope == AMBITI[ambito], rank_column.is_not(None))
+        .order_by(rank_column, LeaderboardEntry.entity_id)
+        .limit(limite)
+    )
+    result = await db.execute(stmt)
+    return [_entry_to_dict(entry, criterio, name) for entry, name in result.all()]
+
+
+async def get_user_ranking(db: AsyncSession, user_id: int, criterio: str = "totale") -> Dict[str, Any]:
+    """
+    Restituisce la posizione di un utente e dei suoi terreni nella classifica.
+
+    Args:
+        db (AsyncSession): La sessione asincrona del database.
+        user_id (int): L'ID dell'utente.
+        criterio (str): "totale", "30giorni" o "per_ettaro".
+
+    Returns:
+        Dict[str, Any]: Chiavi "utente" (riga dell'utente o None), "terreni" (righe dei
+        suoi terreni) e "partecipanti" (numero di utenti e di terreni in classifica).
+
+    Raises:
+        ValueError: Se il criterio non è supportato.
+    """
+    if criterio not in CRITERI:
+        raise ValueError(f"Criterio non supportato: {criterio}")
+    rank_column = getattr(LeaderboardEntry, CRITERI[criterio][1])
+
+    result = await db.execute(
+        select(LeaderboardEntry, Plot.name)
+        .outerjoin(Plot, (LeaderboardEntry.scope == "plot") & (Plot.id == LeaderboardEntry.entity_id))
+        .where(LeaderboardEntry.user_id == user_id)
+        .order_by(rank_column)
+    )
+    utente, terreni = None, []
+    for entry, name in result.all():
+        if entry.scope == "user":
+            utente = _entry_to_dict(entry, criterio)
+        else:
+            terreni.append(_entry_to_dict(entry, criterio, name))
+
+    counts = await db.execute(
+        select(LeaderboardEntry.scope, func.count()).group_by(LeaderboardEntry.scope)
+    )
+    partecipanti = {scope: count for scope, count in counts.all()}
+
+    return {
+        "utente": utente,
+        "terreni": terreni,
+        "partecipanti": {ambito: partecipanti.get(scope, 0) for ambito, scope in AMBITI.items()},
+    }
@@ -1,11 +1,11 @@
 from fastapi import FastAPI, Request, Query, Depends, HTTPException, Cookie
-from fastapi.responses import HTMLResponse, RedirectResponse, FileResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, FileResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
 from jose import JWTError, jwt
-from datetime import date, datetime
-import pandas as pd
+from datetime import date, datetime, timedelta
+from typing import Optional, List
 import os
 from dotenv import load_dotenv
 from sqlalchemy import select
@@ -16,10 +16,18 @@ from BackEnd.app.routes import router
 from BackEnd.app.auth import router as auth_router
 from BackEnd.app.marketplace.api_market import router as marketplace_router
 
-from BackEnd.app.schemas import (SaveCoordinatesRequest, SaveCoordinatesResponse, ClassificaRequest, ClassificaResponse, EsportaRequest, EsportaResponse)
-from BackEnd.app.utils import (inserisci_terreno, mostra_classifica, Esporta, get_species_distribution_by_plot)
-from BackEnd.app.co2_o2_calculator import (calculate_co2_o2_hourly, get_coefficients_from_db, get_weather_data_from_db, get_species_from_db, aggiorna_weatherdata_con_assorbimenti)
+from BackEnd.app.schemas import (SaveCoordinatesRequest, SaveCoordinatesResponse, ClassificaRequest, ClassificaResponse, EsportaRequest, ScenarioRequest)
+from BackEnd.app.utils import (inserisci_terreno, mostra_classifica, get_species_distribution_by_plot)
+from BackEnd.app.export import Esporta
+from BackEnd.app.co2_o2_calculator import (calculate_co2_o2, evaluate_species_mixes, get_coefficients_from_db, get_coefficients_version, get_weather_data_from_db, get_species_from_db, get_species_hourly_from_db, get_weather_data_range_from_db, get_weather_species_rows_from_db, calculate_co2_o2_batch, align_plot_series, aggiorna_weatherdata_con_assorbimenti, DATETIME_FORMAT)
+from BackEnd.app.downsampling import downsample_records
+from BackEnd.app.co2_sql_engine import calculate_co2_o2_sql, sql_rows_to_result, ENGINES
+from BackEnd.app.response_cache import co2_response_cache, make_etag, etag_matches, set_cache_headers, not_modified_response, get_plot_day_fingerprint
+from BackEnd.app.leaderboard import get_user_ranking
+from BackEnd.app.regions import get_region_map
+from BackEnd.app.co2_uncertainty import (simulate_co2_o2_uncertainty, DEFAULT_SAMPLES, DEFAULT_SEED, DEFAULT_COEFFICIENT_SD, DEFAULT_WEATHER_SD)
 from BackEnd.app.get_meteo import fetch_and_save_weather_day
+from BackEnd.app.http_client import start_http_client, close_http_client
 from BackEnd.app.auth import get_current_user
 from BackEnd.app.database import get_db
 from BackEnd.app.get_all_plots import get_all_plots_coords
@@ -66,6 +74,11 @@ async def startup():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
     logger.info("Database pronto e tabelle create")
+    await start_http_client()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await close_http_client()
 
 @app.get("/", response_class=HTMLResponse)
 async def root(request: Request):
@@ -121,19 +134,70 @@ async def inserisci_coordinate(payload: SaveCoordinatesRequest):
     return await inserisci_terreno(payload)
 
 @app.get("/classifica", response_model=ClassificaResponse)
-async def get_classifica(payload: ClassificaRequest):
-    return await mostra_classifica(payload)
+async def get_classifica(payload: ClassificaRequest = Depends(), db: AsyncSession = Depends(get_db)):
+    return await mostra_classifica(payload, db)
+
+@app.get("/classifica/me")
+async def get_classifica_utente(criterio: str = "totale", user: dict = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    """
+    Restituisce la posizione in classifica dell'utente autenticato e dei suoi terreni.
+    """
+    try:
+        return await get_user_ranking(db, user["id"], criterio)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/esporta")
+async def esporta_dati(
+    start: date,
+    end: date,
+    formato: str = "csv",
+    plot_ids: Optional[List[int]] = Query(None),
+    user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Esporta in streaming lo storico orario (meteo + CO2/O2) dei terreni dell'utente
+    in CSV, NDJSON o Parquet.
+    """
+    if start > end:
+        raise HTTPException(status_code=400, detail="La data di inizio è successiva alla data di fine")
+    if plot_ids:
+        result = await db.execute(select(Plot.id).where(Plot.id.in_(plot_ids), Plot.user_id == user["id"]))
+        if len(set(result.scalars().all())) != len(set(plot_ids)):
+            raise HTTPException(status_code=404, detail="Uno o più terreni non trovati o non autorizzati")
+
+    try:
+        payload = EsportaRequest(formato=formato, start=start, end=end, plot_ids=plot_ids)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Richiesta di esportazione non valida: {e}")
+    return Esporta(payload, user["id"]).response()
 
-@app.get("/esporta", response_model=EsportaResponse)
-async def esporta_pdf(payload: EsportaRequest):
-    return await Esporta(payload)
+@app.get("/mappa_co2")
+async def mappa_co2(livello: str = "provincia", start: Optional[date] = None, end: Optional[date] = None, db: AsyncSession = Depends(get_db)):
+    """
+    CO2/O2 aggregati per provincia o comune nel periodo (default: ultimi 30 giorni),
+    per colorare la mappa nazionale con una sola richiesta.
+    """
+    end = end or date.today()
+    start = start or end - timedelta(days=30)
+    if start > end:
+        raise HTTPException(status_code=400, detail="La data di inizio è successiva alla data di fine")
+    try:
+        zone = await get_region_map(db, livello, start, end)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"livello": livello, "start": start.isoformat(), "end": end.isoformat(), "zone": zone}
 
 @app.get("/demo", response_class=HTMLResponse)
 async def demo(request: Request):
     return templates.TemplateResponse("demo.html", {"request": request})
 
 @app.get("/calcola_co2/{plot_id}")
-async def calcola_co2(plot_id: int, giorno: str = None, user: dict = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+async def calcola_co2(request: Request, response: Response, plot_id: int, giorno: str = None, max_points: Optional[int] = Query(None, ge=3), motore: str = "python", user: dict = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    # Con `motore=sql` il calcolo avviene in Postgres dalle specie e dai coefficienti attuali
+    if motore not in ENGINES:
+        raise HTTPException(status_code=400, detail=f"motore non valido, valori ammessi: {', '.join(ENGINES)}")
     logger.info(f"Iniziando calcolo CO2 per plot_id={plot_id}, user_id={user.get('id')}")
 
     # --- 3. VERIFICA DI PROPRIETÀ ---
@@ -173,9 +237,17 @@ async def calcola_co2(plot_id: int, giorno: str = None, user: dict = Depends(get
     logger.debug(f"Giorno finale usato per calcolo: {giorno}")
     
     try:
-        logger.debug("Recupero specie dal database...")
-        species = await get_species_from_db(db, plot_id)
-        logger.debug(f"Specie trovate: {len(species)}")
+        # Cache: la risposta dipende solo da plot, giorno, specie, ore meteo e coefficienti
+        weather_count, composition_version, _ = await get_plot_day_fingerprint(db, plot_id, giorno)
+        cache_key = ("calcola_co2", plot_id, giorno, composition_version, weather_count, await get_coefficients_version(db), max_points, motore)
+        etag = make_etag(cache_key)
+        if etag_matches(request, etag):
+            return not_modified_response(etag)
+        cached = co2_response_cache.get(cache_key)
+        if cached is not None:
+            logger.debug(f"Calcolo CO2 servito dalla cache per plot_id={plot_id}, giorno={giorno}")
+            set_cache_headers(response, etag)
+            return cached
 
         logger.debug("Recupero dati meteo dal database...")
         weather = await get_weather_data_from_db(db, plot_id, giorno)
@@ -195,36 +267,32 @@ async def calcola_co2(plot_id: int, giorno: str = None, user: dict = Depends(get
             except Exception as e:
                 logger.error(f"Errore query date: {e}")
 
-        logger.debug("Recupero coefficienti dal database...")
-        coefs = await get_coefficients_from_db(db)
-        logger.debug(f"Coefficienti trovati: {len(coefs)}")
+        if motore == "sql":
+            logger.debug("Calcolo CO2/O2 orario con il motore SQL...")
+            day = date.fromisoformat(giorno)
+            result = sql_rows_to_result(await calculate_co2_o2_sql(db, day, day, [plot_id]), weather)
+        else:
+            logger.debug("Recupero specie dal database...")
+            species = await get_species_from_db(db, plot_id)
+            logger.debug(f"Specie trovate: {len(species)}")
 
-        logger.debug("Calcolo CO2/O2 orario...")
-        results = calculate_co2_o2_hourly(species, weather, coefs)
-        logger.debug(f"Risultati calcolati: {len(results)}")
+            logger.debug("Recupero coefficienti dal database...")
+            coefs = await get_coefficients_from_db(db)
+            logger.debug(f"Coefficienti trovati: {len(coefs)}")
 
-        if not results:
+            logger.debug("Calcolo CO2/O2 orario...")
+            result = calculate_co2_o2(species, weather, coefs)
+        logger.debug(f"Risultati calcolati: {result.co2.size}")
+
+        if result.is_empty():
             logger.warning("Nessun risultato dal calcolo CO2/O2")
             raise HTTPException(status_code=404, detail="Nessun dato CO₂/O₂ calcolato")
 
-        df = pd.DataFrame(results)
-        df_group = df.groupby("datetime")[["co2_kg_hour", "o2_kg_hour"]].sum().reset_index()
-        df_group["datetime"] = df_group["datetime"].apply(lambda x: x.strftime("%Y-%m-%d %H:%M:%S"))
-
-        weather_map = {
-            w["datetime"].strftime("%Y-%m-%d %H:%M:%S"): w for w in weather
-        }
-
-        out = []
-        for row in df_group.to_dict(orient="records"):
-            meteo = weather_map.get(row["datetime"], {})
-            row["precipitazioni_mm"] = meteo.get("precipitation")
-            row["temperatura_c"]     = meteo.get("temperature")
-            row["radiazione"]        = meteo.get("radiation")
-            row["umidita"]           = meteo.get("humidity")
-            out.append(row)
+        out = downsample_records(result.hourly_records(), max_points, "co2_kg_hour")
 
         logger.info(f"Calcolo CO2 completato: {len(out)} record restituiti")
+        co2_response_cache.set(cache_key, out)
+        set_cache_headers(response, etag)
         return out
 
     except Exception as e:
@@ -296,9 +364,9 @@ async def get_user_plots(user: dict = Depends(get_current_user), db: AsyncSessio
 
 
 @app.get("/weather/{plot_id}")
-async def get_weather(plot_id: int, giorno: str = Query(...), db: AsyncSession = Depends(get_db)):
+async def get_weather(plot_id: int, giorno: str = Query(...), max_points: Optional[int] = Query(None, ge=3), db: AsyncSession = Depends(get_db)):
     # Ora usiamo await e passiamo la sessione db
-    weather_data = await get_weather_data_from_db(db, plot_id, giorno)
+    weather_data = downsample_records(await get_weather_data_from_db(db, plot_id, giorno), max_points, "temperature")
     return {"meteo": weather_data}
 
 @app.get("/species/{plot_id}")
@@ -327,7 +395,7 @@ async def check_weather_data_exists(plot_id: int, giorno: str = Query(...), db:
 
 # 📊 NUOVO ENDPOINT: CO2/O2 breakdown per specie
 @app.post("/co2_by_species/{plot_id}")
-async def get_co2_by_species(plot_id: int, db: AsyncSession = Depends(get_db)):
+async def get_co2_by_species(request: Request, response: Response, plot_id: int, db: AsyncSession = Depends(get_db)):
     """
     Restituisce il breakdown di CO₂ e O₂ per ogni specie di pianta nel terreno.
     Utile per grafici interattivi che mostrano il contributo di ogni specie.
@@ -357,51 +425,38 @@ async def get_co2_by_species(plot_id: int, db: AsyncSession = Depends(get_db)):
         else:
             giorno = datetime.today().strftime("%Y-%m-%d")
             logger.debug(f"CO2_by_species: nessun dato meteo, uso oggi: {giorno}")
+
+        # La risposta viene dalle righe salvate o, se superate, dal calcolo al volo: la
+        # chiave include anche la versione con cui il giorno è stato calcolato
+        weather_count, composition_version, computed_version = await get_plot_day_fingerprint(db, plot_id, giorno)
+        cache_key = ("co2_by_species", plot_id, giorno, composition_version, computed_version, weather_count, await get_coefficients_version(db))
+        etag = make_etag(cache_key)
+        if etag_matches(request, etag):
+            return not_modified_response(etag)
+        cached = co2_response_cache.get(cache_key)
+        if cached is not None:
+            set_cache_headers(response, etag)
+            return cached
         
         weather = await get_weather_data_from_db(db, plot_id, giorno)
         if not weather:
             raise HTTPException(status_code=404, detail="Dati meteo non disponibili")
         
-        coefs = await get_coefficients_from_db(db)
-        
-        # Calcola CO2/O2 orari per specie
-        results = calculate_co2_o2_hourly(species, weather, coefs)
-        df = pd.DataFrame(results)
-        
-        # Aggrega per specie (somma totale giornaliera)
-        species_totals = df.groupby("species")[["co2_kg_hour", "o2_kg_hour"]].sum().reset_index()
-        species_totals = species_totals.rename(columns={
-            "co2_kg_hour": "total_co2_kg",
-            "o2_kg_hour": "total_o2_kg"
-        })
-        
-        # Aggiungi dati meteo all'hourly breakdown
-        # Crea un dizionario di lookup per i dati meteo per datetime
-        weather_lookup = {w.get("datetime"): w for w in weather}
-        
-        # Calcola anche il breakdown orario per specie (per filtraggio)
-        hourly_by_species = df.groupby(["datetime", "species"])[["co2_kg_hour", "o2_kg_hour"]].sum().reset_index()
-        
-        # Aggiungi dati meteo a hourly_by_species
-        hourly_by_species["precipitazioni_mm"] = hourly_by_species["datetime"].apply(
-            lambda x: weather_lookup.get(x, {}).get("precipitation", 0)
-        )
-        hourly_by_species["temperatura_c"] = hourly_by_species["datetime"].apply(
-            lambda x: weather_lookup.get(x, {}).get("temperature", 0)
-        )
-        hourly_by_species["radiazione"] = hourly_by_species["datetime"].apply(
-            lambda x: weather_lookup.get(x, {}).get("radiation", 0)
-        )
-        hourly_by_species["umidita"] = hourly_by_species["datetime"].apply(
-            lambda x: weather_lookup.get(x, {}).get("humidity", 0)
-        )
-        
-        hourly_by_species["datetime"] = hourly_by_species["datetime"].apply(lambda x: x.strftime("%Y-%m-%d %H:%M:%S"))
-        
-        return {
-            "totals": species_totals.to_dict(orient="records"),
-            "hourly": hourly_by_species.to_dict(orient="records")
+        # Risultati per specie già calcolati da pipeline/backfill: lettura indicizzata.
+        # Se il giorno non è ancora stato calcolato, o le specie sono cambiate dopo il
+        # calcolo, si ricade sul calcolo al volo.
+        result = await get_species_hourly_from_db(db, plot_id, giorno, weather)
+        if result is None:
+            coefs = await get_coefficients_from_db(db)
+            result = calculate_co2_o2(species, weather, coefs)
+
+        out = {
+            "totals": result.species_records(),
+            "hourly": result.hourly_species_records()
         }
+        co2_response_cache.set(cache_key, out)
+        set_cache_headers(response, etag)
+        return out
         
     except HTTPException:
         raise
@@ -410,6 +465,206 @@ async def get_co2_by_species(plot_id: int, db: AsyncSession = Depends(get_db)):
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Errore server: {str(e)}")
 
+async def get_last_weather_day(db: AsyncSession, plot_id: int) -> str:
+    """Restituisce l'ultimo giorno con dati meteo per il plot (oggi se non ce ne sono)."""
+    from sqlalchemy import text
+    result = await db.execute(
+        text("SELECT MAX(date_time)::date FROM weather_data WHERE plot_id = :plot_id"),
+        {"plot_id": plot_id}
+    )
+    last_date = result.scalar()
+    return last_date.isoformat() if last_date else date.today().isoformat()
+
+# Numero massimo di composizioni valutabili in una singola richiesta di scenari
+MAX_SCENARI = 1000
+
+@app.post("/scenari_co2/{plot_id}")
+async def valuta_scenari_co2(plot_id: int, payload: ScenarioRequest, user: dict = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    """
+    Confronta composizioni di specie alternative ("e se piantassi 200 m² di X invece di Y?")
+    sul meteo salvato del plot, senza modificare il terreno.
+
+    Tutte le composizioni vengono valutate in un unico calcolo vettoriale e restituite
+    ordinate per CO₂ assorbita.
+    """
+    if not payload.mixes:
+        raise HTTPException(status_code=400, detail="Nessuno scenario da valutare")
+    if len(payload.mixes) > MAX_SCENARI:
+        raise HTTPException(status_code=400, detail=f"Troppi scenari: massimo {MAX_SCENARI} per richiesta")
+
+    result = await db.execute(select(Plot).where(Plot.id == plot_id, Plot.user_id == user["id"]))
+    if not result.scalar_one_or_none():
+        raise HTTPException(
+            status_code=404,
+            detail=f"Terreno con ID {plot_id} non trovato o non appartenente all'utente."
+        )
+
+    try:
+        giorno = payload.giorno or await get_last_weather_day(db, plot_id)
+        weather = await get_weather_data_from_db(db, plot_id, giorno)
+        if not weather:
+            raise HTTPException(status_code=404, detail="Dati meteo non disponibili")
+
+        coefs = await get_coefficients_from_db(db)
+        mixes = [
+            [{"species": s.name, "area_m2": s.quantity} for s in mix.species]
+            for mix in payload.mixes
+        ]
+        totals = evaluate_species_mixes(mixes, weather, coefs)
+
+        co2 = totals["co2"].tolist()
+        o2 = totals["o2"].tolist()
+        ranking = sorted(range(len(mixes)), key=lambda i: co2[i], reverse=True)
+
+        return {
+            "giorno": giorno,
+            "ore": len(weather),
+            "scenari": [
+                {
+                    "rank": rank + 1,
+                    "index": i,
+                    "label": payload.mixes[i].label,
+                    "co2_kg": round(co2[i], 5),
+                    "o2_kg": round(o2[i], 5),
+                    "specie_ignorate": totals["unknown_species"][i]
+                }
+                for rank, i in enumerate(ranking)
+            ]
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Errore nella valutazione scenari per plot {plot_id}: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Errore nella valutazione degli scenari. Riprova più tardi.")
+
+# Numero massimo di campioni Monte Carlo per richiesta
+MAX_CAMPIONI_INCERTEZZA = 10000
+
+@app.get("/incertezza_co2/{plot_id}")
+async def incertezza_co2(
+    plot_id: int,
+    start: str = None,
+    end: str = None,
+    samples: int = Query(DEFAULT_SAMPLES, ge=1, le=MAX_CAMPIONI_INCERTEZZA),
+    seed: int = DEFAULT_SEED,
+    coefficient_sd: float = Query(DEFAULT_COEFFICIENT_SD, ge=0),
+    weather_sd: float = Query(DEFAULT_WEATHER_SD, ge=0),
+    user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Intervalli di confidenza (5°, 50°, 95° percentile) dei totali CO₂/O₂ giornalieri e
+    di periodo, con una simulazione Monte Carlo riproducibile (seed fisso).
+    Senza date usa l'ultimo giorno con dati meteo.
+    """
+    result = await db.execute(select(Plot).where(Plot.id == plot_id, Plot.user_id == user["id"]))
+    if not result.scalar_one_or_none():
+        raise HTTPException(
+            status_code=404,
+            detail=f"Terreno con ID {plot_id} non trovato o non appartenente all'utente."
+        )
+
+    try:
+        end_day = date.fromisoformat(end or await get_last_weather_day(db, plot_id))
+        start_day = date.fromisoformat(start) if start else end_day
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Date non valide, usare il formato YYYY-MM-DD")
+    if start_day > end_day:
+        raise HTTPException(status_code=400, detail="La data di inizio è successiva alla data di fine")
+
+    try:
+        weather_by_plot = await get_weather_data_range_from_db(db, start_day, end_day, [plot_id])
+        weather = weather_by_plot.get(plot_id, [])
+        if not weather:
+            raise HTTPException(status_code=404, detail="Dati meteo non disponibili")
+
+        species = await get_species_from_db(db, plot_id)
+        coefs = await get_coefficients_from_db(db)
+
+        simulation = simulate_co2_o2_uncertainty(
+            species, weather, coefs,
+            samples=samples,
+            coefficient_sd=coefficient_sd,
+            weather_sd=weather_sd,
+            seed=seed
+        )
+        simulation["days"] = [d.isoformat() for d in simulation["days"]]
+        return simulation
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Errore nella simulazione di incertezza per plot {plot_id}: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Errore nel calcolo dell'incertezza. Riprova più tardi.")
+
+# Limiti del confronto tra terreni in una singola richiesta
+MAX_TERRENI_CONFRONTO = 20
+MAX_GIORNI_CONFRONTO = 366
+
+@app.get("/confronta_co2")
+async def confronta_co2(
+    plot_ids: List[int] = Query(...),
+    start: date = Query(...),
+    end: date = Query(...),
+    motore: str = "python",
+    user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Confronta CO₂/O₂ orari di più terreni dell'utente sullo stesso intervallo.
+
+    Verifica di proprietà, lettura di meteo/specie/coefficienti e calcolo avvengono in
+    blocco per tutti i terreni (un numero fisso di query); le serie sono allineate
+    sullo stesso asse temporale, con null dove un terreno non ha dati.
+    Con `motore=sql` il calcolo avviene in Postgres e arrivano solo i totali orari.
+    """
+    if motore not in ENGINES:
+        raise HTTPException(status_code=400, detail=f"motore non valido, valori ammessi: {', '.join(ENGINES)}")
+    plot_ids = list(dict.fromkeys(plot_ids))
+    if len(plot_ids) > MAX_TERRENI_CONFRONTO:
+        raise HTTPException(status_code=400, detail=f"Si possono confrontare al massimo {MAX_TERRENI_CONFRONTO} terreni")
+    if start > end:
+        raise HTTPException(status_code=400, detail="La data di inizio è successiva alla data di fine")
+    if (end - start).days + 1 > MAX_GIORNI_CONFRONTO:
+        raise HTTPException(status_code=400, detail=f"Intervallo massimo: {MAX_GIORNI_CONFRONTO} giorni")
+
+    result = await db.execute(select(Plot.id, Plot.name).where(Plot.id.in_(plot_ids), Plot.user_id == user["id"]))
+    names = dict(result.all())
+    missing = [plot_id for plot_id in plot_ids if plot_id not in names]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Terreni non trovati o non appartenenti all'utente: {missing}")
+
+    try:
+        if motore == "sql":
+            aligned = align_plot_series(await calculate_co2_o2_sql(db, start, end, plot_ids), plot_ids)
+        else:
+            rows = await get_weather_species_rows_from_db(db, start, end, plot_ids)
+            aligned = calculate_co2_o2_batch(rows).aligned_series(plot_ids)
+
+        terreni = []
+        for plot_id in plot_ids:
+            co2, o2 = aligned["series"][plot_id]
+            terreni.append({
+                "plot_id": plot_id,
+                "nome": names[plot_id],
+                "co2_kg_hour": co2,
+                "o2_kg_hour": o2,
+                "totale_co2_kg": sum(value for value in co2 if value is not None),
+                "totale_o2_kg": sum(value for value in o2 if value is not None),
+            })
+
+        return {
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            "datetime": [hour.strftime(DATETIME_FORMAT) for hour in aligned["timestamps"]],
+            "terreni": terreni,
+        }
+
+    except Exception as e:
+        logger.error(f"Errore nel confronto CO2 dei terreni {plot_ids}: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Errore nel confronto dei terreni. Riprova più tardi.")
+
 # Route fallback per marketplace (con e senza trailing slash)
 @app.get("/marketplace", include_in_schema=False)
 @app.get("/marketplace/", include_in_schema=False)
@@ -34,12 +34,30 @@ from .schema import (
 # Import dalla app principale
 from BackEnd.app.database import get_db
 from BackEnd.app.auth import get_current_user
-from BackEnd.app.models import User, Farmer, Society
+from BackEnd.app.models import User, Farmer, Society, Plot
+from BackEnd.app.credits import (
+    reserve_credits, complete_order_credits, cancel_order_credits,
+    retire_order_credits, get_plot_credits
+)
 
 # Router per le API del marketplace
 router = APIRouter(prefix="/marketplace", tags=["marketplace"])
 
 
+async def verifica_terreno_crediti(db: AsyncSession, plot_id: Optional[int], co2_kg_per_unit: Optional[float], user_id: int):
+    """
+    Verifica che il terreno collegato a un prodotto appartenga al venditore
+    e che sia indicata la quantit di crediti per unit.
+    """
+    if plot_id is None:
+        return
+    if co2_kg_per_unit is None:
+        raise HTTPException(status_code=400, detail="Indicare co2_kg_per_unit per i prodotti collegati a un terreno")
+    result = await db.execute(select(Plot.id).where(Plot.id == plot_id, Plot.user_id == user_id))
+    if result.scalar_one_or_none() is None:
+        raise HTTPException(status_code=404, detail="Terreno non trovato o non autorizzato")
+
+
 # ====================================
 # CATEGORY ENDPOINTS
 # ====================================
@@ -172,6 +190,38 @@ async def get_product_detail(
         raise HTTPException(status_code=500, detail=f"Errore nel recupero prodotto: {str(e)}")
 
 
+@router.get("/products/{product_id}/credits")
+async def get_product_credits(
+    product_id: int,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Crediti di carbonio disponibili del terreno collegato a un prodotto,
+    letti dal saldo precalcolato del terreno.
+    """
+    try:
+        result = await db.execute(
+            select(MarketplaceProduct.plot_id, MarketplaceProduct.co2_kg_per_unit)
+            .where(MarketplaceProduct.id == product_id)
+        )
+        product = result.one_or_none()
+
+        if not product:
+            raise HTTPException(status_code=404, detail="Prodotto non trovato")
+
+        plot_id, co2_kg_per_unit = product
+        if plot_id is None:
+            raise HTTPException(status_code=404, detail="Il prodotto non  collegato a un terreno")
+
+        credits = await get_plot_credits(db, plot_id)
+        credits["unita_disponibili"] = int(credits["disponibili"] // co2_kg_per_unit) if co2_kg_per_unit else 0
+        return credits
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Errore nel recupero crediti: {str(e)}")
+
+
 @router.post("/products", response_model=ProductOut)
 async def create_product(
     product: ProductCreate,
@@ -183,6 +233,8 @@ async def create_product(
     Richiede autenticazione.
     """
     try:
+        await verifica_terreno_crediti(db, product.plot_id, product.co2_kg_per_unit, user["id"])
+
         new_product = MarketplaceProduct(
             seller_id=user["id"],
             category_id=product.category_id,
@@ -191,7 +243,9 @@ async def create_product(
             price=product.price,
             quantity=product.quantity,
             unit=product.unit,
-            images=product.images or []
+            images=product.images or [],
+            plot_id=product.plot_id,
+            co2_kg_per_unit=product.co2_kg_per_unit
         )
 
         db.add(new_product)
@@ -199,6 +253,8 @@ async def create_product(
         await db.refresh(new_product)
 
         return new_product
+    except HTTPException:
+        raise
     except Exception as e:
         await db.rollback()
         raise HTTPException(status_code=500, detail=f"Errore nella creazione prodotto: {str(e)}")
@@ -230,6 +286,13 @@ async def update_product(
 
         # Aggiorna campi
         update_data = product_update.dict(exclude_unset=True)
+        if "plot_id" in update_data or "co2_kg_per_unit" in update_data:
+            await verifica_terreno_crediti(
+                db,
+                update_data.get("plot_id", product.plot_id),
+                update_data.get("co2_kg_per_unit", product.co2_kg_per_unit),
+                user["id"]
+            )
         for field, value in update_data.items():
             setattr(product, field, value)
 
@@ -565,6 +628,19 @@ async def create_order(
             # Riduce quantit prodotto
             item_data["product"].quantity -= item_data["quantity"]
 
+            # Prenota i crediti di carbonio del terreno collegato (UPDATE condizionato sul saldo)
+            product = item_data["product"]
+            if product.plot_id is not None and product.co2_kg_per_unit:
+                reserved = await reserve_credits(
+                    db, product.plot_id, product.co2_kg_per_unit * item_data["quantity"], new_order.id
+                )
+                if not reserved:
+                    await db.rollback()
+                    raise HTTPException(
+                        status_code=409,
+                        detail=f"Crediti di carbonio insufficienti per {product.name}"
+                    )
+
         # Svuota il carrello dell'utente
         await db.execute(
             delete(MarketplaceCartItem)
@@ -743,6 +819,12 @@ async def update_order_status(
         if order.buyer_id != user["id"]:
             raise HTTPException(status_code=403, detail="Non autorizzato")
 
+        # Crediti prenotati dall'ordine: venduti al completamento, liberati all'annullamento
+        if status_update.status == "completed" and order.status != "completed":
+            await complete_order_credits(db, order.id)
+        elif status_update.status == "cancelled" and order.status != "cancelled":
+            await cancel_order_credits(db, order.id)
+
         order.status = status_update.status
         await db.commit()
 
@@ -754,6 +836,42 @@ async def update_order_status(
         raise HTTPException(status_code=500, detail=f"Errore nell'aggiornamento status: {str(e)}")
 
 
+@router.post("/orders/{order_id}/retire", response_model=MessageResponse)
+async def retire_order(
+    order_id: int,
+    user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Ritira i crediti di carbonio acquistati con un ordine completato,
+    usandoli per compensare le proprie emissioni.
+    """
+    try:
+        result = await db.execute(
+            select(MarketplaceOrder).where(MarketplaceOrder.id == order_id)
+        )
+        order = result.scalar_one_or_none()
+
+        if not order:
+            raise HTTPException(status_code=404, detail="Ordine non trovato")
+
+        if order.buyer_id != user["id"]:
+            raise HTTPException(status_code=403, detail="Non autorizzato")
+
+        if order.status != "completed":
+            raise HTTPException(status_code=400, detail="Solo i crediti di un ordine completato possono essere ritirati")
+
+        retired = await retire_order_credits(db, order_id)
+        await db.commit()
+
+        return {"message": f"Ritirati {retired:.2f} kg di CO2"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=f"Errore nel ritiro crediti: {str(e)}")
+
+
 # ====================================
 # REVIEW ENDPOINTS
 # ====================================
@@ -31,6 +31,8 @@ CREATE TABLE marketplace_products (
     unit VARCHAR(50) DEFAULT 'pz', -- Unit di misura (pz, kg, litri, ecc.)
     images TEXT[], -- Array di URL immagini
     is_active BOOLEAN DEFAULT TRUE, -- Prodotto attivo/disattivato
+    plot_id INTEGER REFERENCES plots(id) ON DELETE SET NULL, -- Terreno di cui si vendono i crediti di carbonio
+    co2_kg_per_unit FLOAT CHECK (co2_kg_per_unit > 0), -- kg di CO2 di crediti per unit venduta
     created_at TIMESTAMP DEFAULT NOW(),
     updated_at TIMESTAMP DEFAULT NOW()
 );
@@ -39,6 +41,7 @@ CREATE TABLE marketplace_products (
 CREATE INDEX idx_products_seller ON marketplace_products(seller_id);
 CREATE INDEX idx_products_category ON marketplace_products(category_id);
 CREATE INDEX idx_products_active ON marketplace_products(is_active);
+CREATE INDEX idx_products_plot ON marketplace_products(plot_id);
 
 -- ====================================
 -- 3. CARRELLO
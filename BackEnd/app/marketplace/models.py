@@ -47,6 +47,8 @@ class MarketplaceProduct(Base):
     """
     Prodotto in vendita nel marketplace.
     Collegato a un venditore (user) e a una categoria.
+    Se ha un terreno (plot_id), ogni unit venduta consuma co2_kg_per_unit
+    kg di crediti di carbonio del terreno.
     """
     __tablename__ = "marketplace_products"
 
@@ -60,6 +62,8 @@ class MarketplaceProduct(Base):
     unit = Column(String(50), default="pz")  # unit di misura
     images = Column(ARRAY(Text))  # Array di URL immagini
     is_active = Column(Boolean, default=True)
+    plot_id = Column(Integer, ForeignKey("plots.id", ondelete="SET NULL"))  # terreno dei crediti venduti
+    co2_kg_per_unit = Column(Float)  # kg di CO2 di crediti per unit
     created_at = Column(TIMESTAMP, server_default=func.now())
     updated_at = Column(TIMESTAMP, server_default=func.now(), onupdate=func.now())
 
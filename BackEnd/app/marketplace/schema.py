@@ -54,6 +54,8 @@ class ProductBase(BaseModel):
     unit: str = Field(default="pz", max_length=50, description="Unità di misura")
     category_id: Optional[int] = None
     images: Optional[List[str]] = Field(default=[], description="URL delle immagini")
+    plot_id: Optional[int] = Field(None, description="Terreno di cui si vendono i crediti di carbonio")
+    co2_kg_per_unit: Optional[float] = Field(None, gt=0, description="kg di CO2 di crediti per unità")
 
 
 class ProductCreate(ProductBase):
@@ -71,6 +73,8 @@ class ProductUpdate(BaseModel):
     category_id: Optional[int] = None
     images: Optional[List[str]] = None
     is_active: Optional[bool] = None
+    plot_id: Optional[int] = None
+    co2_kg_per_unit: Optional[float] = Field(None, gt=0)
 
 
 class ProductOut(ProductBase):
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, TIMESTAMP, func, Boolean
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, TIMESTAMP, Date, func, Boolean, Index, UniqueConstraint, CheckConstraint
 from sqlalchemy.orm import relationship, declarative_base, Mapped, mapped_column
 from geoalchemy2 import Geometry
 from pydantic import BaseModel
@@ -158,9 +158,175 @@ class WeatherData(Base):
     precipitation = Column(Float)
     solar_radiation = Column(Float)
     humidity = Column(Integer)
+    # Fattore meteo normalizzato (radiazione × temperatura × umidità), calcolato all'acquisizione
+    meteo_factor = Column(Float)
     total_co2_absorption = Column(Float)
     total_o2_production = Column(Float)
 
+    __table_args__ = (
+        # Un'ora per terreno: consente l'INSERT ... ON CONFLICT dell'acquisizione meteo
+        UniqueConstraint("plot_id", "date_time", name="uq_weather_data_plot_time"),
+    )
+
+# --- PLOT-SPECIES HOURLY (risultati CO2/O2 orari per specie) ---
+class PlotSpeciesHourly(Base):
+    """
+    Contributo orario di CO2/O2 di ogni specie di un terreno.
+
+    Riempita dalla pipeline e dal backfill insieme a `weather_data.total_co2_absorption`;
+    la chiave primaria (plot_id, date_time, species_id) serve anche le letture per intervallo.
+    """
+    __tablename__ = "plot_species_hourly"
+    plot_id = Column(Integer, ForeignKey("plots.id", ondelete="CASCADE"), primary_key=True)
+    date_time = Column(TIMESTAMP, primary_key=True)
+    species_id = Column(Integer, ForeignKey("species.id", ondelete="CASCADE"), primary_key=True)
+    co2_kg = Column(Float)
+    o2_kg = Column(Float)
+
+# --- PLOT DAILY STATS (rollup giornaliero di weather_data) ---
+class PlotDailyStats(Base):
+    """
+    Riassunto giornaliero di `weather_data` per terreno, aggiornato dalla pipeline e dal backfill.
+    """
+    __tablename__ = "plot_daily_stats"
+    plot_id = Column(Integer, ForeignKey("plots.id", ondelete="CASCADE"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    co2_sum = Column(Float, nullable=False, default=0)
+    o2_sum = Column(Float, nullable=False, default=0)
+    precipitation_sum = Column(Float, nullable=False, default=0)
+    precipitation_count = Column(Integer, nullable=False, default=0)
+    temperature_max = Column(Float)
+    temperature_min = Column(Float)
+    hours_count = Column(Integer, nullable=False, default=0)
+    # Versione della composizione specie del terreno con cui il giorno è stato calcolato
+    # (-1 se riassunto dall'acquisizione meteo o dal backfill ma non ancora calcolato)
+    composition_version = Column(Integer, nullable=False, default=0)
+
+# --- PLOT COMPOSITION VERSIONS (versione della composizione specie di un terreno) ---
+class PlotCompositionVersion(Base):
+    """
+    Versione corrente della composizione specie (`plot_species`) di un terreno.
+
+    Viene incrementata a ogni modifica delle specie del terreno; i giorni in
+    `plot_daily_stats` calcolati con una versione precedente sono da ricalcolare.
+    """
+    __tablename__ = "plot_composition_versions"
+    plot_id = Column(Integer, ForeignKey("plots.id", ondelete="CASCADE"), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(TIMESTAMP, server_default=func.now(), onupdate=func.now())
+
+# --- LEADERBOARD (classifica precalcolata di terreni e utenti) ---
+class LeaderboardEntry(Base):
+    """
+    Posizione in classifica di un terreno (`scope="plot"`) o di un utente (`scope="user"`).
+
+    Aggiornata dalla pipeline a partire da `plot_daily_stats`; le posizioni sono
+    salvate per ogni criterio così top-K e "la mia posizione" sono letture su indice.
+    """
+    __tablename__ = "leaderboard"
+    scope = Column(String(10), primary_key=True)
+    entity_id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    co2_total = Column(Float, nullable=False, default=0)
+    co2_30d = Column(Float, nullable=False, default=0)
+    area_ha = Column(Float, nullable=False, default=0)
+    co2_per_ha = Column(Float, nullable=False, default=0)
+    rank_total = Column(Integer)
+    rank_30d = Column(Integer)
+    rank_per_ha = Column(Integer)
+    updated_at = Column(TIMESTAMP, server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        Index("ix_leaderboard_rank_total", "scope", "rank_total"),
+        Index("ix_leaderboard_rank_30d", "scope", "rank_30d"),
+        Index("ix_leaderboard_rank_per_ha", "scope", "rank_per_ha"),
+        Index("ix_leaderboard_user", "user_id"),
+    )
+
+# --- REGIONS (confini di province e comuni caricati da file locale) ---
+class Region(Base):
+    """
+    Provincia o comune con il suo confine, usato per assegnare i terreni a una zona.
+    """
+    __tablename__ = "regions"
+    id = Column(Integer, primary_key=True)
+    level = Column(String(20), nullable=False)  # "provincia" o "comune"
+    code = Column(String(20), nullable=False)
+    name = Column(String(150), nullable=False)
+    parent_code = Column(String(20))  # codice della provincia, per i comuni
+    geom = Column(Geometry(geometry_type="MULTIPOLYGON", srid=4326))
+
+    __table_args__ = (
+        UniqueConstraint("level", "code", name="uq_regions_level_code"),
+    )
+
+# --- PLOT REGIONS (provincia e comune del centroide di ogni terreno) ---
+class PlotRegion(Base):
+    """
+    Assegnazione di un terreno alla provincia e al comune che contengono il suo centroide.
+
+    Calcolata una sola volta per terreno; viene rimossa se cambiano le coordinate
+    del terreno o i confini caricati, così da essere ricalcolata.
+    """
+    __tablename__ = "plot_regions"
+    plot_id = Column(Integer, ForeignKey("plots.id", ondelete="CASCADE"), primary_key=True)
+    provincia_id = Column(Integer, ForeignKey("regions.id", ondelete="SET NULL"), index=True)
+    comune_id = Column(Integer, ForeignKey("regions.id", ondelete="SET NULL"), index=True)
+    assigned_at = Column(TIMESTAMP, server_default=func.now())
+
+# --- REGION DAILY STATS (rollup giornaliero per provincia e comune) ---
+class RegionDailyStats(Base):
+    """
+    Somma giornaliera di `plot_daily_stats` dei terreni di una provincia o di un comune.
+    """
+    __tablename__ = "region_daily_stats"
+    region_id = Column(Integer, ForeignKey("regions.id", ondelete="CASCADE"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    co2_sum = Column(Float, nullable=False, default=0)
+    o2_sum = Column(Float, nullable=False, default=0)
+    plots_count = Column(Integer, nullable=False, default=0)
+
+# --- CREDIT LEDGER (movimenti dei crediti di carbonio, solo in aggiunta) ---
+class CreditLedgerEntry(Base):
+    """
+    Movimento dei crediti di carbonio (kg di CO2) di un terreno.
+
+    Le righe non vengono mai modificate né cancellate: ogni variazione è un nuovo
+    movimento, anche con `amount_kg` negativo (ricalcolo al ribasso, prenotazione annullata).
+    Un terreno con movimenti non può essere eliminato (`ON DELETE RESTRICT`).
+    """
+    __tablename__ = "credit_ledger"
+    id = Column(Integer, primary_key=True)
+    plot_id = Column(Integer, ForeignKey("plots.id", ondelete="RESTRICT"), nullable=False)
+    entry_type = Column(String(20), nullable=False)  # generated, reserved, sold, retired
+    amount_kg = Column(Float, nullable=False)
+    order_id = Column(Integer, index=True)  # ordine del marketplace, se il movimento nasce da un acquisto
+    created_at = Column(TIMESTAMP, server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_credit_ledger_plot", "plot_id", "id"),
+    )
+
+# --- PLOT CREDIT BALANCES (saldi correnti del registro crediti) ---
+class PlotCreditBalance(Base):
+    """
+    Saldo corrente dei crediti di un terreno, aggiornato insieme a ogni movimento di
+    `credit_ledger`; `available` = generated - reserved - sold - retired, mai sotto zero
+    (un terreno ricalcolato al ribasso sotto i crediti già impegnati ha `available` = 0).
+    """
+    __tablename__ = "plot_credit_balances"
+    plot_id = Column(Integer, ForeignKey("plots.id", ondelete="CASCADE"), primary_key=True)
+    generated = Column(Float, nullable=False, default=0)
+    reserved = Column(Float, nullable=False, default=0)
+    sold = Column(Float, nullable=False, default=0)
+    retired = Column(Float, nullable=False, default=0)
+    available = Column(Float, nullable=False, default=0)
+    updated_at = Column(TIMESTAMP, server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        CheckConstraint("available >= 0", name="ck_plot_credit_balances_available"),
+    )
+
 class PlotInfo(BaseModel):
     id: int
     name: str
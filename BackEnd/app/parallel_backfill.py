@@ -0,0 +1,118 @@
+"""
+Backfill CO2/O2 parallelo su più processi, con i terreni suddivisi tra i worker.
+
+Ogni processo del `ProcessPoolExecutor` esegue i blocchi di terreni che gli vengono
+assegnati con `aggiorna_weatherdata_range`, che legge e scrive in blocco. Per ogni blocco
+il worker apre un engine con una sola connessione e lo chiude alla fine: un worker tiene
+al massimo una connessione e solo mentre lavora, quindi il backfill usa al più `workers`
+connessioni oltre a quella del processo principale.
+I blocchi sono piccoli, così i worker restano bilanciati e il processo principale può
+riportare l'avanzamento ogni volta che un blocco termina.
+
+Classifica, aggregati regionali e crediti non vengono aggiornati dai worker (dipendono da
+più terreni e più worker si contenderebbero le stesse righe): vanno aggiornati una
+volta alla fine dal processo principale.
+"""
+
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date
+from typing import List, Optional, Tuple, Callable
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from BackEnd.app.co2_o2_calculator import aggiorna_weatherdata_range, BACKFILL_CHUNK_DAYS
+
+# Terreni per blocco di lavoro assegnato a un worker
+PLOTS_PER_TASK = 25
+
+
+def default_workers() -> int:
+    """Numero di worker di default: uno per core disponibile."""
+    return os.cpu_count() or 1
+
+
+async def _backfill_plots(database_url: str, plot_ids: List[int], start: date, end: date, chunk_days: int) -> int:
+    engine = create_async_engine(database_url, pool_size=1, max_overflow=0)
+    try:
+        async with async_sessionmaker(engine, expire_on_commit=False)() as session:
+            return await aggiorna_weatherdata_range(
+                session, start, end, plot_ids=plot_ids, chunk_days=chunk_days,
+                commit=True, update_aggregates=False
+            )
+    finally:
+        # Chiude la connessione del blocco prima di restituire il risultato
+        await engine.dispose()
+
+
+def _backfill_task(database_url: str, plot_ids: List[int], start: date, end: date, chunk_days: int) -> Tuple[int, int]:
+    """Eseguito nel worker: ricalcola un blocco di terreni e restituisce (terreni, ore)."""
+    hours = asyncio.run(_backfill_plots(database_url, plot_ids, start, end, chunk_days))
+    return len(plot_ids), hours
+
+
+def partition_plots(plot_ids: List[int], plots_per_task: int = PLOTS_PER_TASK) -> List[List[int]]:
+    """Divide i terreni in blocchi consecutivi di al massimo `plots_per_task` elementi."""
+    plot_ids = sorted(plot_ids)
+    return [plot_ids[i:i + plots_per_task] for i in range(0, len(plot_ids), plots_per_task)]
+
+
+def run_parallel_backfill(
+    database_url: str,
+    plot_ids: List[int],
+    start: date,
+    end: date,
+    workers: Optional[int] = None,
+    chunk_days: int = BACKFILL_CHUNK_DAYS,
+    plots_per_task: int = PLOTS_PER_TASK,
+    progress: Optional[Callable[[int, int, int, float], None]] = None
+) -> int:
+    """
+    Ricalcola CO2/O2 di molti terreni distribuendoli su più processi.
+
+    Args:
+        database_url (str): URL del database usato dagli engine dei worker.
+        plot_ids (List[int]): Terreni da ricalcolare.
+        start (date): Primo giorno da ricalcolare (incluso).
+        end (date): Ultimo giorno da ricalcolare (incluso).
+        workers (Optional[int]): Numero di processi; None per uno per core.
+        chunk_days (int): Giorni caricati per blocco da ogni worker.
+        plots_per_task (int): Terreni per blocco di lavoro.
+        progress (Optional[Callable]): Chiamata a ogni blocco completato con
+            (terreni completati, terreni totali, ore aggiornate, secondi trascorsi).
+
+    Returns:
+        int: Numero di ore aggiornate.
+
+    Raises:
+        ValueError: Se l'intervallo non è valido o `workers` è minore di 1.
+    """
+    if start > end:
+        raise ValueError(f"Intervallo non valido: {start} è successivo a {end}")
+    workers = workers or default_workers()
+    if workers < 1:
+        raise ValueError("workers deve essere almeno 1")
+
+    tasks = partition_plots(plot_ids, plots_per_task)
+    done_plots, hours = 0, 0
+    started = time.monotonic()
+
+    # "spawn" evita di ereditare connessioni ed event loop del processo principale
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=min(workers, len(tasks)) or 1, mp_context=context) as pool:
+        futures = [pool.submit(_backfill_task, database_url, task, start, end, chunk_days) for task in tasks]
+        try:
+            for future in as_completed(futures):
+                task_plots, task_hours = future.result()
+                done_plots += task_plots
+                hours += task_hours
+                if progress:
+                    progress(done_plots, len(plot_ids), hours, time.monotonic() - started)
+        except BaseException:
+            # I blocchi già completati restano salvati: annulla solo quelli non ancora avviati
+            for pending in futures:
+                pending.cancel()
+            raise
+
+    return hours
@@ -0,0 +1,333 @@
+"""
+Aggregazione CO2/O2 per provincia e comune, per la mappa nazionale.
+
+- I confini vengono caricati una volta da un GeoJSON locale (ad esempio i confini
+  ISTAT convertiti in EPSG:4326) e i nomi confrontati con `province_comuni.json`.
+- Ogni terreno viene assegnato una sola volta alla provincia e al comune che contengono
+  il suo centroide (`plot_regions`), con un `ST_Contains` su indice spaziale.
+- `region_daily_stats` somma `plot_daily_stats` per zona e giorno ed è aggiornata in
+  modo incrementale solo per le zone e i giorni appena ricalcolati.
+- La mappa di un periodo è una sola query su `region_daily_stats`.
+"""
+
+import json
+import os
+from datetime import date
+from typing import List, Optional, Dict, Any
+from geoalchemy2.shape import from_shape
+from shapely.geometry import shape, MultiPolygon, Polygon
+from sqlalchemy import select, delete, func, or_, union_all
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from BackEnd.app.models import Plot, PlotDailyStats, Region, PlotRegion, RegionDailyStats
+from BackEnd.app.logger_config import setup_logger
+
+# Logger per questo modulo
+logger = setup_logger(__name__)
+
+# Elenco province -> comuni usato dal frontend, condiviso per validare i confini caricati
+PROVINCE_COMUNI_PATH = os.path.join(
+    os.path.dirname(__file__), "..", "..", "FrontEnd", "static", "province_comuni.json"
+)
+
+LEVELS = ("provincia", "comune")
+
+# Proprietà dei GeoJSON ISTAT (Limiti amministrativi) usate di default per livello
+DEFAULT_FIELDS = {
+    "provincia": {"name": "DEN_UTS", "code": "COD_UTS", "parent": None},
+    "comune": {"name": "COMUNE", "code": "PRO_COM_T", "parent": "COD_UTS"},
+}
+
+# Regioni inserite per statement nel caricamento dei confini
+REGION_INSERT_BATCH = 500
+
+
+def load_province_comuni(path: str = PROVINCE_COMUNI_PATH) -> Dict[str, List[str]]:
+    """Legge l'elenco province -> comuni."""
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+async def load_regions_geojson(
+    db: AsyncSession,
+    path: str,
+    level: str,
+    name_field: Optional[str] = None,
+    code_field: Optional[str] = None,
+    parent_field: Optional[str] = None
+) -> int:
+    """
+    Carica (o aggiorna) i confini di province o comuni da un GeoJSON locale in EPSG:4326.
+
+    I nomi che non compaiono in `province_comuni.json` vengono segnalati nel log ma
+    caricati comunque. Dopo il caricamento le assegnazioni dei terreni vengono azzerate,
+    così vengono ricalcolate sui nuovi confini.
+
+    Args:
+        db (AsyncSession): La sessione asincrona del database.
+        path (str): Percorso del file GeoJSON (FeatureCollection).
+        level (str): "provincia" o "comune".
+        name_field (Optional[str]): Proprietà con il nome della zona.
+        code_field (Optional[str]): Proprietà con il codice univoco della zona.
+        parent_field (Optional[str]): Proprietà con il codice della provincia (solo comuni).
+
+    Returns:
+        int: Numero di zone caricate.
+
+    Raises:
+        ValueError: Se il livello non è supportato o una feature non ha nome o codice.
+    """
+    if level not in LEVELS:
+        raise ValueError(f"Livello non supportato: {level}")
+    fields = DEFAULT_FIELDS[level]
+    name_field = name_field or fields["name"]
+    code_field = code_field or fields["code"]
+    parent_field = parent_field or fields["parent"]
+
+    province_comuni = load_province_comuni()
+    known_names = set(province_comuni) if level == "provincia" else {
+        comune for comuni in province_comuni.values() for comune in comuni
+    }
+
+    with open(path, encoding="utf-8") as f:
+        features = json.load(f)["features"]
+
+    rows, unknown = [], []
+    for feature in features:
+        properties = feature.get("properties") or {}
+        name, code = properties.get(name_field), properties.get(code_field)
+        if name is None or code is None:
+            raise ValueError(f"Feature senza {name_field}/{code_field}: {properties}")
+        if name not in known_names:
+            unknown.append(name)
+
+        geometry = shape(feature["geometry"])
+        if isinstance(geometry, Polygon):
+            geometry = MultiPolygon([geometry])
+        rows.append({
+            "level": level,
+            "code": str(code),
+            "name": name,
+            "parent_code": str(properties[parent_field]) if parent_field and properties.get(parent_field) is not None else None,
+            "geom": from_shape(geometry, srid=4326),
+        })
+
+    if unknown:
+        logger.warning(f"{len(unknown)} zone ({level}) non presenti in province_comuni.json, es. {unknown[:5]}")
+
+    for start in range(0, len(rows), REGION_INSERT_BATCH):
+        stmt = pg_insert(Region).values(rows[start:start + REGION_INSERT_BATCH])
+        stmt = stmt.on_conflict_do_update(
+            constraint="uq_regions_level_code",
+            set_={name: stmt.excluded[name] for name in ("name", "parent_code", "geom")}
+        )
+        await db.execute(stmt)
+
+    await db.execute(delete(PlotRegion).execution_options(synchronize_session=False))
+    logger.info(f"Caricati {len(rows)} confini di livello {level} da {path}")
+    return len(rows)
+
+
+async def assign_plot_regions(db: AsyncSession, plot_ids: Optional[List[int]] = None):
+    """
+    Assegna provincia e comune ai terreni che non ne hanno ancora uno.
+
+    I terreni fuori da ogni confine caricato ricevono comunque una riga (con zone
+    NULL), così non vengono ricontrollati a ogni esecuzione.
+
+    Args:
+        db (AsyncSession): La sessione asincrona del database.
+        plot_ids (Optional[List[int]]): Terreni da considerare; None per tutti.
+    """
+    provincia = Region.__table__.alias("provincia")
+    comune = Region.__table__.alias("comune")
+    source = (
+        select(Plot.id, provincia.c.id, comune.c.id)
+        .distinct(Plot.id)
+        .outerjoin(provincia, (provincia.c.level == "provincia") & func.ST_Contains(provincia.c.geom, Plot.centroid))
+        .outerjoin(comune, (comune.c.level == "comune") & func.ST_Contains(comune.c.geom, Plot.centroid))
+        .where(Plot.id.not_in(select(PlotRegion.plot_id)))
+        .order_by(Plot.id, provincia.c.id, comune.c.id)
+    )
+    if plot_ids is not None:
+        source = source.where(Plot.id.in_(plot_ids))
+
+    stmt = pg_insert(PlotRegion).from_select(["plot_id", "provincia_id", "comune_id"], source)
+    await db.execute(stmt.on_conflict_do_nothing(index_elements=[PlotRegion.plot_id]))
+
+
+async def clear_plot_region(db: AsyncSession, plot_id: int):
+    """
+    Rimuove l'assegnazione di un terreno e toglie il suo contributo dagli aggregati delle
+    zone in cui si trovava. Va chiamata prima di eliminare il terreno o quando cambiano
+    le sue coordinate (vedi `reassign_plot_region`).
+
+    Args:
+        db (AsyncSession): La sessione asincrona del database.
+        plot_id (int): L'ID del terreno.
+    """
+    result = await db.execute(
+        delete(PlotRegion)
+        .where(PlotRegion.plot_id == plot_id)
+        .returning(PlotRegion.provincia_id, PlotRegion.comune_id)
+        .execution_options(synchronize_session=False)
+    )
+    row = result.one_or_none()
+    region_ids = [region_id for region_id in (row or ()) if region_id is not None]
+    if not region_ids:
+        return
+
+    first_day, last_day = await _plot_days(db, plot_id)
+    if first_day is not None:
+        await refresh_region_daily_stats(db, first_day, last_day, region_ids=region_ids)
+
+
+async def reassign_plot_region(db: AsyncSession, plot_id: int):
+    """
+    Sposta un terreno con coordinate nuove: toglie il suo storico dalle zone precedenti,
+    lo assegna alle zone del nuovo centroide e lo aggiunge ai loro aggregati.
+
+    Args:
+        db (AsyncSession): La sessione asincrona del database.
+        plot_id (int): L'ID del terreno, con il nuovo centroide già impostato.
+    """
+    await clear_plot_region(db, plot_id)
+    await assign_plot_regions(db, [plot_id])
+    first_day, last_day = await _plot_days(db, plot_id)
+    if first_day is not None:
+        await refresh_region_daily_stats(db, first_day, last_day, [plot_id])
+
+
+async def _plot_days(db: AsyncSession, plot_id: int):
+    """Primo e ultimo giorno di `plot_daily_stats` del terreno (None se non ha giorni)."""
+    result = await db.execute(
+        select(func.min(PlotDailyStats.day), func.max(PlotDailyStats.day)).where(PlotDailyStats.plot_id == plot_id)
+    )
+    return result.one()
+
+
+async def refresh_region_daily_stats(
+    db: AsyncSession,
+    start: date,
+    end: date,
+    plot_ids: Optional[List[int]] = None,
+    region_ids: Optional[List[int]] = None
+):
+    """
+    Ricalcola `region_daily_stats` per i giorni indicati e le zone dei terreni indicati.
+
+    Le righe delle zone coinvolte nell'intervallo vengono eliminate e risommate su tutti
+    i terreni attualmente assegnati, così anche le zone che hanno perso un terreno (o
+    tutti i terreni di un giorno) tornano corrette.
+
+    Args:
+        db (AsyncSession): La sessione asincrona del database.
+        start (date): Primo giorno da aggiornare.
+        end (date): Ultimo giorno da aggiornare (incluso).
+        plot_ids (Optional[List[int]]): Terreni appena ricalcolati, di cui aggiornare le zone attuali.
+        region_ids (Optional[List[int]]): Altre zone da aggiornare (ad esempio quelle lasciate
+            da un terreno). Se entrambi sono None vengono aggiornate tutte le zone.
+    """
+    by_region = union_all(*[
+        select(
+            region_column.label("region_id"),
+            PlotDailyStats.day,
+            PlotDailyStats.plot_id,
+            PlotDailyStats.co2_sum,
+            PlotDailyStats.o2_sum,
+        )
+        .join(PlotRegion, PlotRegion.plot_id == PlotDailyStats.plot_id)
+        .where(region_column.is_not(None), PlotDailyStats.day >= start, PlotDailyStats.day <= end)
+        for region_column in (PlotRegion.provincia_id, PlotRegion.comune_id)
+    ]).subquery()
+
+    source = (
+        select(
+            by_region.c.region_id,
+            by_region.c.day,
+            func.sum(by_region.c.co2_sum),
+            func.sum(by_region.c.o2_sum),
+            func.count(by_region.c.plot_id),
+        )
+        .group_by(by_region.c.region_id, by_region.c.day)
+    )
+    stale = delete(RegionDailyStats).where(RegionDailyStats.day >= start, RegionDailyStats.day <= end)
+    if plot_ids is not None or region_ids is not None:
+        touched = union_all(
+            select(PlotRegion.provincia_id).where(PlotRegion.plot_id.in_(plot_ids or [])),
+            select(PlotRegion.comune_id).where(PlotRegion.plot_id.in_(plot_ids or [])),
+        )
+
+        def is_touched(region_column):
+            return or_(region_column.in_(region_ids or []), region_column.in_(touched))
+
+        source = source.where(is_touched(by_region.c.region_id))
+        stale = stale.where(is_touched(RegionDailyStats.region_id))
+    await db.execute(stale.execution_options(synchronize_session=False))
+
+    columns = ["region_id", "day", "co2_sum", "o2_sum", "plots_count"]
+    stmt = pg_insert(RegionDailyStats).from_select(columns, source)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[RegionDailyStats.region_id, RegionDailyStats.day],
+        set_={name: stmt.excluded[name] for name in columns[2:]}
+    )
+    await db.execute(stmt)
+
+
+async def rebuild_region_daily_stats(db: AsyncSession):
+    """Assegna tutti i terreni e ricostruisce `region_daily_stats` su tutto lo storico."""
+    await assign_plot_regions(db)
+    await db.execute(delete(RegionDailyStats).execution_options(synchronize_session=False))
+    first_day, last_day = (await db.execute(
+        select(func.min(PlotDailyStats.day), func.max(PlotDailyStats.day))
+    )).one()
+    if first_day is not None:
+        await refresh_region_daily_stats(db, first_day, last_day)
+
+
+async def get_region_map(db: AsyncSession, level: str, start: date, end: date) -> List[Dict[str, Any]]:
+    """
+    Restituisce CO2/O2 di ogni provincia o comune nel periodo, per colorare la mappa.
+
+    Args:
+        db (AsyncSession): La sessione asincrona del database.
+        level (str): "provincia" o "comune".
+        start (date): Primo giorno (incluso).
+        end (date): Ultimo giorno (incluso).
+
+    Returns:
+        List[Dict[str, Any]]: Una voce per zona con dati, con "codice", "nome",
+        "provincia" (codice, solo comuni), "co2_kg", "o2_kg" e "terreni".
+
+    Raises:
+        ValueError: Se il livello non è supportato.
+    """
+    if level not in LEVELS:
+        raise ValueError(f"Livello non supportato: {level}")
+
+    stmt = (
+        select(
+            Region.code,
+            Region.name,
+            Region.parent_code,
+            func.sum(RegionDailyStats.co2_sum),
+            func.sum(RegionDailyStats.o2_sum),
+            func.max(RegionDailyStats.plots_count),
+        )
+        .join(RegionDailyStats, RegionDailyStats.region_id == Region.id)
+        .where(Region.level == level, RegionDailyStats.day >= start, RegionDailyStats.day <= end)
+        .group_by(Region.id, Region.code, Region.name, Region.parent_code)
+        .order_by(Region.code)
+    )
+    result = await db.execute(stmt)
+    return [
+        {
+            "codice": code,
+            "nome": name,
+            "provincia": parent_code,
+            "co2_kg": co2,
+            "o2_kg": o2,
+            "terreni": plots,
+        }
+        for code, name, parent_code, co2, o2, plots in result.all()
+    ]
@@ -0,0 +1,134 @@
+"""
+Cache di processo delle risposte CO2/O2 giornaliere, con supporto ETag.
+
+Il risultato di un giorno passato cambia solo se cambiano le specie del terreno, i
+coefficienti, le ore meteo salvate o il ricalcolo del giorno. La chiave di cache
+contiene quindi terreno, giorno, versione corrente della composizione specie, versione
+con cui il giorno è stato calcolato, numero di righe meteo del giorno e versione dei
+coefficienti: basta una query indicizzata per costruirla, e con la
+chiave si risponde `304 Not Modified` o si restituisce la risposta in cache senza
+rileggere il meteo né rifare il calcolo.
+"""
+
+import hashlib
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Hashable, Optional, Tuple
+from fastapi import Request, Response
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from BackEnd.app.models import WeatherData
+from BackEnd.app.daily_stats import current_composition_version, computed_composition_version
+
+# Numero massimo di risposte tenute in cache (le meno usate vengono scartate)
+RESPONSE_CACHE_MAX_ENTRIES = 1024
+
+# Secondi di validità di una risposta in cache
+RESPONSE_CACHE_TTL_SECONDS = 3600
+
+
+class ResponseCache:
+    """
+    Cache LRU con scadenza (TTL) delle risposte già calcolate.
+
+    Args:
+        max_entries (int): Numero massimo di risposte conservate.
+        ttl (float): Secondi dopo i quali una risposta viene ricalcolata.
+    """
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES, ttl: float = RESPONSE_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Restituisce la risposta in cache per `key`, o None se assente o scaduta."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        stored_at, value = entry
+        if time.monotonic() - stored_at > self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        """Salva una risposta, scartando la meno usata se la cache è piena."""
+        self._entries[key] = (time.monotonic(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """Svuota la cache."""
+        self._entries.clear()
+
+
+co2_response_cache = ResponseCache()
+
+
+def make_etag(key: Hashable) -> str:
+    """Calcola l'ETag di una risposta a partire dalla sua chiave di cache."""
+    return '"' + hashlib.sha1(repr(key).encode("utf-8")).hexdigest() + '"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Indica se l'header `If-None-Match` della richiesta contiene `etag`."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = [value.strip() for value in header.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+def set_cache_headers(response: Response, etag: str):
+    """
+    Imposta ETag e `Cache-Control` della risposta: il browser conserva la risposta ma
+    la rivalida sempre con `If-None-Match`, ricevendo 304 finché la chiave non cambia.
+    """
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "private, no-cache"
+
+
+def not_modified_response(etag: str) -> Response:
+    """Risposta `304 Not Modified` per un ETag ancora valido."""
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "private, no-cache"})
+
+
+async def get_plot_day_fingerprint(db: AsyncSession, plot_id: int, giorno: str) -> Tuple[int, int, Optional[int]]:
+    """
+    Recupera con una sola query le parti della chiave di cache che dipendono dal database.
+
+    Le risposte costruite dai risultati salvati dipendono dalla composizione con cui il
+    giorno è stato calcolato, non solo da quella corrente: dopo una modifica alle specie
+    la chiave cambia di nuovo quando il ricalcolo riscrive il giorno.
+
+    Args:
+        db (AsyncSession): La sessione asincrona del database.
+        plot_id (int): L'ID del terreno.
+        giorno (str): Giorno nel formato "YYYY-MM-DD".
+
+    Returns:
+        Tuple[int, int, Optional[int]]: (numero di righe meteo del giorno, versione corrente
+        della composizione specie, versione con cui è stato calcolato il giorno in
+        `plot_daily_stats` o None se non calcolato).
+    """
+    start = datetime.strptime(giorno, "%Y-%m-%d")
+    weather_count = (
+        select(func.count(WeatherData.id))
+        .where(
+            WeatherData.plot_id == plot_id,
+            WeatherData.date_time >= start,
+            WeatherData.date_time < start + timedelta(days=1)
+        )
+        .scalar_subquery()
+    )
+    result = await db.execute(select(
+        weather_count,
+        current_composition_version(plot_id),
+        computed_composition_version(plot_id, start.date())
+    ))
+    count, version, computed_version = result.one()
+    return count, version, computed_version
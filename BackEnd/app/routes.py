@@ -1,4 +1,4 @@
-from fastapi import APIRouter, HTTPException, Depends, Security, Request, Form, status
+from fastapi import APIRouter, HTTPException, Depends, Security, Request, Form, Query, status
 from fastapi.responses import HTMLResponse, RedirectResponse
 from datetime import datetime
 from sqlalchemy import select
@@ -16,11 +16,20 @@ from BackEnd.app.models import User, Farmer, Society, PlotInfo, Plot, Agronomist
 from BackEnd.app.security import hash_password, verify_password
 from BackEnd.app.database import SessionLocal
 from BackEnd.app.get_meteo import fetch_and_save_weather_day, fetch_weather_week
+from BackEnd.app.co2_o2_calculator import invalidate_coefficients_cache
+from BackEnd.app.daily_stats import get_plot_summary_stats
+from BackEnd.app.composition import bump_composition_version
+from BackEnd.app.regions import clear_plot_region, reassign_plot_region
+from BackEnd.app.timeseries import get_plot_timeseries, BUCKETS
+from BackEnd.app.co2_sql_engine import apply_sql_totals, ENGINES
+from BackEnd.app.downsampling import downsample_records
+from BackEnd.app.credits import get_plot_credits, plot_has_credits
+from BackEnd.app.leaderboard import remove_plot_from_leaderboard
 from fastapi.templating import Jinja2Templates
 from fastapi.responses import HTMLResponse, JSONResponse
 from BackEnd.app.utils import aggiorna_nome_plot, elimina_plot
 from BackEnd.app.database import SessionLocal
-from typing import List
+from typing import List, Optional
 from pydantic import BaseModel
 from shapely.wkb import loads
 from shapely.geometry import Polygon
@@ -47,7 +56,7 @@ async def get_db():
 @router.get("/api/plots/{plot_id}/summary")
 async def get_plot_summary(plot_id: int, user: dict = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
     """Restituisce metriche sintetiche per popolare le schede della dashboard.
-    Metriche calcolate sull'insieme dei dati meteo disponibili per il plot:
+    Metriche calcolate sul rollup giornaliero (plot_daily_stats) dei dati meteo del plot:
       - name: nome del terreno
       - co2_totale: somma total_co2_absorption
       - o2_totale: somma total_o2_production
@@ -60,22 +69,10 @@ async def get_plot_summary(plot_id: int, user: dict = Depends(get_current_user),
         if not plot:
             raise HTTPException(status_code=404, detail="Terreno non trovato o non autorizzato")
 
-        from .models import WeatherData
-        weather_q = await db.execute(
-            select(
-                func.coalesce(func.sum(WeatherData.total_co2_absorption), 0),
-                func.coalesce(func.sum(WeatherData.total_o2_production), 0),
-                func.coalesce(func.avg(WeatherData.precipitation), 0),
-                func.coalesce(func.max(WeatherData.temperature), 0),
-                func.coalesce(func.min(WeatherData.temperature), 0)
-            ).where(WeatherData.plot_id == plot_id)
-        )
-        weather_data = weather_q.first()
-        if not weather_data:
-            # Nessun dato meteo disponibile, restituisci valori di default
-            co2_tot, o2_tot, pioggia_media, t_max, t_min = 0, 0, 0, None, None
-        else:
-            co2_tot, o2_tot, pioggia_media, t_max, t_min = weather_data
+        # Aggregato sulle righe giornaliere di plot_daily_stats, non su tutto lo storico orario
+        stats = await get_plot_summary_stats(db, plot_id)
+        co2_tot, o2_tot, pioggia_media = stats["co2_totale"], stats["o2_totale"], stats["pioggia_media"]
+        t_max, t_min = stats["temp_max"], stats["temp_min"]
 
         return {
             "plot_id": plot_id,
@@ -90,6 +87,66 @@ async def get_plot_summary(plot_id: int, user: dict = Depends(get_current_user),
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Errore interno del server: {str(e)}")
             
+@router.get("/api/plots/{plot_id}/timeseries")
+async def get_plot_timeseries_route(
+    plot_id: int,
+    start: str,
+    end: str,
+    bucket: str = "day",
+    max_points: Optional[int] = Query(None, ge=3),
+    motore: str = "python",
+    user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Restituisce CO2, O2 e meteo del plot tra `start` e `end` (YYYY-MM-DD),
+    aggregati in Postgres per ora, giorno, settimana o mese (`bucket`).
+    Con `max_points` la serie viene ridotta con LTTB per i grafici su periodi lunghi.
+    Con `motore=sql` CO2 e O2 sono ricalcolati in Postgres dalle specie attuali invece
+    di essere letti dai valori salvati.
+    """
+    if bucket not in BUCKETS:
+        raise HTTPException(status_code=400, detail=f"bucket non valido, valori ammessi: {', '.join(BUCKETS)}")
+    if motore not in ENGINES:
+        raise HTTPException(status_code=400, detail=f"motore non valido, valori ammessi: {', '.join(ENGINES)}")
+    try:
+        start_day = datetime.strptime(start, "%Y-%m-%d").date()
+        end_day = datetime.strptime(end, "%Y-%m-%d").date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Date non valide, usare il formato YYYY-MM-DD")
+    if start_day > end_day:
+        raise HTTPException(status_code=400, detail="La data di inizio è successiva alla data di fine")
+
+    try:
+        plot_result = await db.execute(select(Plot).where(Plot.id == plot_id, Plot.user_id == user.get("id")))
+        if not plot_result.scalar_one_or_none():
+            raise HTTPException(status_code=404, detail="Terreno non trovato o non autorizzato")
+
+        points = await get_plot_timeseries(db, plot_id, start_day, end_day, bucket)
+        if motore == "sql":
+            points = await apply_sql_totals(db, points, plot_id, start_day, end_day, bucket)
+        points = downsample_records(points, max_points, "co2_kg")
+        return {"plot_id": plot_id, "bucket": bucket, "points": points}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Errore interno del server: {str(e)}")
+
+@router.get("/api/plots/{plot_id}/crediti")
+async def get_plot_credits_route(plot_id: int, user: dict = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    """Restituisce il saldo dei crediti di carbonio del plot (kg di CO2 generati,
+    prenotati, venduti, ritirati e disponibili), letto da plot_credit_balances.
+    """
+    try:
+        plot_result = await db.execute(select(Plot.id).where(Plot.id == plot_id, Plot.user_id == user.get("id")))
+        if plot_result.scalar_one_or_none() is None:
+            raise HTTPException(status_code=404, detail="Terreno non trovato o non autorizzato")
+
+        return await get_plot_credits(db, plot_id)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Errore interno del server: {str(e)}")
+
 @router.get("/logreg", response_class=HTMLResponse)
 async def root(request: Request):
     """
@@ -599,6 +656,9 @@ async def update_terrain(request: TerrainUpdateRequest, db: AsyncSession = Depen
                         surface_area=species_data.quantity
                     )
                     db.add(plot_species)
+
+            # Le specie sono cambiate: i calcoli CO2/O2 salvati vanno rifatti
+            await bump_composition_version(db, request.terrain_id)
         
         await db.commit()
         
@@ -644,6 +704,10 @@ async def delete_terrain(request: TerrainDeleteRequest, db: AsyncSession = Depen
         
         if not plot:
             raise HTTPException(status_code=404, detail="Terreno non trovato")
+
+        # Il registro dei crediti è permanente: un terreno con crediti non si elimina
+        if await plot_has_credits(db, plot.id):
+            raise HTTPException(status_code=409, detail="Il terreno ha crediti di carbonio registrati e non può essere eliminato")
         
         # Rimuovi prima le associazioni con le specie
         species_associations_query = select(PlotSpecies).where(PlotSpecies.plot_id == request.terrain_id)
@@ -653,6 +717,10 @@ async def delete_terrain(request: TerrainDeleteRequest, db: AsyncSession = Depen
         for ps in species_associations:
             await db.delete(ps)
         
+        # Togli il terreno dalla classifica e dagli aggregati di provincia e comune
+        await remove_plot_from_leaderboard(db, plot.id)
+        await clear_plot_region(db, plot.id)
+
         # Rimuovi il terreno
         await db.delete(plot)
         
@@ -662,6 +730,9 @@ async def delete_terrain(request: TerrainDeleteRequest, db: AsyncSession = Depen
             message="Terreno eliminato con successo"
         )
         
+    except HTTPException:
+        await db.rollback()
+        raise
     except Exception as e:
         await db.rollback()
         import traceback
@@ -710,8 +781,11 @@ async def update_species(request: SpeciesUpdateRequest, db: AsyncSession = Depen
         # Aggiorna la quantità se fornita
         if request.quantity is not None:
             plot_species.surface_area = request.quantity
+
+        await bump_composition_version(db, request.terrain_id)
         
         await db.commit()
+        invalidate_coefficients_cache()
         
         # Restituisci i dati aggiornati
         updated_terrain = {
@@ -764,6 +838,9 @@ async def update_terrain_coordinates(request: TerrainCoordinatesUpdateRequest, d
         
         plot.geom = from_shape(polygon, srid=4326)
         plot.centroid = from_shape(point, srid=4326)
+        # Il centroide è cambiato: lo storico passa dalle zone precedenti a quelle nuove
+        await db.flush()
+        await reassign_plot_region(db, plot.id)
         
         await db.commit()
         
@@ -816,6 +893,7 @@ async def delete_species(request: SpeciesDeleteRequest, db: AsyncSession = Depen
         
         # Elimina l'associazione
         await db.delete(plot_species)
+        await bump_composition_version(db, request.terrain_id)
         
         await db.commit()
         
@@ -872,6 +950,7 @@ async def save_plot(
                 db.add(plot_species)
         
         await db.commit()
+        invalidate_coefficients_cache()
         
         return {"success": True, "plot_id": new_plot.id, "message": "Plot salvato con successo"}
         
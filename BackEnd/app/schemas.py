@@ -1,6 +1,6 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
 from typing import Optional
-from datetime import datetime
+from datetime import datetime, date
 from sqlalchemy import Column, Integer, String, Float, ForeignKey, TIMESTAMP, func
 from typing import List, Literal
 
@@ -232,19 +232,18 @@ class SaveCoordinatesResponse(BaseModel):
     terrain_id: Optional[int] = None
 
 class ClassificaRequest(BaseModel):
-    criterio: str
+    criterio: Literal["totale", "30giorni", "per_ettaro"] = "totale"
+    ambito: Literal["terreni", "utenti"] = "terreni"
+    limite: int = Field(10, ge=1, le=100)
 
 class ClassificaResponse(BaseModel):
     Classifica: List[dict]
 
 class EsportaRequest(BaseModel):
-    # campi di esempio, da adattare alle tue necessità
-    formato: str
-    dati: Optional[List[dict]] = None
-
-class EsportaResponse(BaseModel):
-    esito: str
-    url_file: Optional[str] = None
+    formato: Literal["csv", "ndjson", "parquet"] = "csv"
+    start: date
+    end: date
+    plot_ids: Optional[List[int]] = None  # None = tutti i terreni dell'utente
 
 
 class Token(BaseModel):
@@ -286,5 +285,15 @@ class TerrainUpdateResponse(BaseModel):
 class TerrainDeleteResponse(BaseModel):
     message: str
 
+# ===== SCENARI WHAT-IF =====
+
+class ScenarioMix(BaseModel):
+    label: Optional[str] = None
+    species: List[SpeciesSave]
+
+class ScenarioRequest(BaseModel):
+    giorno: Optional[str] = None
+    mixes: List[ScenarioMix]
+
 #pip install fastapi uvicorn sqlalchemy geoalchemy2 shapely psycopg2-binary
 
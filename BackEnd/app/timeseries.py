@@ -0,0 +1,126 @@
+"""
+Serie temporali di un terreno a risoluzione variabile (ora, giorno, settimana, mese).
+
+L'aggregazione avviene in Postgres con `date_trunc`: la risoluzione oraria legge
+`weather_data`, quelle giornaliere o più ampie leggono il rollup `plot_daily_stats`,
+così un anno a settimane sono ~52 righe aggregate da ~365 righe giornaliere. I giorni
+dell'intervallo non ancora riassunti vengono aggregati da `weather_data`, così la serie
+coincide sempre con quella oraria.
+"""
+
+from datetime import date, datetime
+from typing import List, Dict, Any
+from sqlalchemy import select, func, cast, union_all, exists, and_, Date, TIMESTAMP
+from sqlalchemy.ext.asyncio import AsyncSession
+from BackEnd.app.models import WeatherData, PlotDailyStats
+
+# Risoluzioni supportate (unità di date_trunc)
+BUCKETS = ("hour", "day", "week", "month")
+
+
+def _daily_rows(plot_id: int, start: date, end: date):
+    """
+    Righe giornaliere del terreno nell'intervallo: quelle di `plot_daily_stats` più, per i
+    giorni senza riga di rollup, lo stesso aggregato calcolato da `weather_data`.
+    """
+    rollup = select(
+        PlotDailyStats.day.label("day"),
+        PlotDailyStats.co2_sum.label("co2"),
+        PlotDailyStats.o2_sum.label("o2"),
+        PlotDailyStats.precipitation_sum.label("precipitation"),
+        PlotDailyStats.temperature_max.label("temperature_max"),
+        PlotDailyStats.temperature_min.label("temperature_min"),
+        PlotDailyStats.hours_count.label("hours"),
+    ).where(
+        PlotDailyStats.plot_id == plot_id,
+        PlotDailyStats.day >= start,
+        PlotDailyStats.day <= end
+    )
+
+    day = cast(WeatherData.date_time, Date)
+    missing = (
+        select(
+            day,
+            func.coalesce(func.sum(WeatherData.total_co2_absorption), 0),
+            func.coalesce(func.sum(WeatherData.total_o2_production), 0),
+            func.coalesce(func.sum(WeatherData.precipitation), 0),
+            func.max(WeatherData.temperature),
+            func.min(WeatherData.temperature),
+            func.count(WeatherData.id),
+        )
+        .where(
+            WeatherData.plot_id == plot_id,
+            WeatherData.date_time >= datetime.combine(start, datetime.min.time()),
+            WeatherData.date_time <= datetime.combine(end, datetime.max.time()),
+            ~exists().where(and_(PlotDailyStats.plot_id == WeatherData.plot_id, PlotDailyStats.day == day))
+        )
+        .group_by(day)
+    )
+    return union_all(rollup, missing).subquery()
+
+
+async def get_plot_timeseries(db: AsyncSession, plot_id: int, start: date, end: date, bucket: str = "day") -> List[Dict[str, Any]]:
+    """
+    Restituisce CO2, O2 e meteo di un terreno aggregati per intervalli di tempo.
+
+    Args:
+        db (AsyncSession): La sessione asincrona del database.
+        plot_id (int): L'ID del terreno.
+        start (date): Primo giorno (incluso).
+        end (date): Ultimo giorno (incluso).
+        bucket (str): Risoluzione: "hour", "day", "week" o "month".
+
+    Returns:
+        List[Dict[str, Any]]: Un punto per intervallo, ordinato nel tempo, con "bucket",
+        "co2_kg", "o2_kg", "precipitazioni_mm", "temperatura_max", "temperatura_min" e "ore".
+
+    Raises:
+        ValueError: Se la risoluzione non è supportata.
+    """
+    if bucket not in BUCKETS:
+        raise ValueError(f"Risoluzione non supportata: {bucket}")
+
+    if bucket == "hour":
+        period = func.date_trunc("hour", WeatherData.date_time).label("bucket")
+        stmt = (
+            select(
+                period,
+                func.coalesce(func.sum(WeatherData.total_co2_absorption), 0),
+                func.coalesce(func.sum(WeatherData.total_o2_production), 0),
+                func.coalesce(func.sum(WeatherData.precipitation), 0),
+                func.max(WeatherData.temperature),
+                func.min(WeatherData.temperature),
+                func.count(WeatherData.id),
+            )
+            .where(
+                WeatherData.plot_id == plot_id,
+                WeatherData.date_time >= datetime.combine(start, datetime.min.time()),
+                WeatherData.date_time <= datetime.combine(end, datetime.max.time())
+            )
+        )
+    else:
+        days = _daily_rows(plot_id, start, end)
+        period = func.date_trunc(bucket, cast(days.c.day, TIMESTAMP)).label("bucket")
+        stmt = select(
+            period,
+            func.sum(days.c.co2),
+            func.sum(days.c.o2),
+            func.sum(days.c.precipitation),
+            func.max(days.c.temperature_max),
+            func.min(days.c.temperature_min),
+            func.sum(days.c.hours),
+        )
+
+    result = await db.execute(stmt.group_by(period).order_by(period))
+    return [
+        {
+            "bucket": period_start.isoformat(),
+            "co2_kg": co2,
+            "o2_kg": o2,
+            "precipitazioni_mm": precipitation,
+            "temperatura_max": t_max,
+            "temperatura_min": t_min,
+            "ore": hours,
+        }
+        for period_start, co2, o2, precipitation, t_max, t_min, hours in result.all()
+    ]
@@ -1,5 +1,8 @@
 from BackEnd.app.models import Plot, Species, PlotSpecies
-from BackEnd.app.schemas import SaveCoordinatesRequest, SaveCoordinatesResponse
+from BackEnd.app.schemas import SaveCoordinatesRequest, SaveCoordinatesResponse, ClassificaRequest, ClassificaResponse
+from BackEnd.app.leaderboard import get_leaderboard_top, remove_plot_from_leaderboard
+from BackEnd.app.regions import clear_plot_region
+from BackEnd.app.credits import plot_has_credits
 from BackEnd.app.database import SessionLocal
 from geoalchemy2.shape import from_shape
 from shapely.geometry import Polygon, Point
@@ -155,7 +158,7 @@ async def elimina_plot(user_id: int, plot_name: str) -> dict:
 
     Raises:
         ValueError: Se non viene trovato alcun terreno corrispondente al nome
-        e all'ID utente forniti.
+        e all'ID utente forniti, o se il terreno ha crediti di carbonio registrati.
     """
     async with SessionLocal() as db:
         result = await db.execute(
@@ -167,11 +170,19 @@ async def elimina_plot(user_id: int, plot_name: str) -> dict:
         if not plot:
             raise ValueError(f"Plot '{plot_name}' non trovato per l'utente ID {user_id}")
 
+        # Il registro dei crediti è permanente: un terreno con crediti non si elimina
+        if await plot_has_credits(db, plot.id):
+            raise ValueError(f"Plot '{plot_name}' ha crediti di carbonio registrati e non può essere eliminato")
+
         # Elimino prima i record figli se serve (PlotSpecies, WeatherData, ecc.)
         await db.execute(
             delete(PlotSpecies).where(PlotSpecies.plot_id == plot.id)
         )
 
+        # Lo tolgo dalla classifica e dagli aggregati di provincia e comune
+        await remove_plot_from_leaderboard(db, plot.id)
+        await clear_plot_region(db, plot.id)
+
         # Poi il plot
         await db.delete(plot)
         await db.commit()
@@ -179,15 +190,27 @@ async def elimina_plot(user_id: int, plot_name: str) -> dict:
         return {"message": f"Terreno '{plot_name}' eliminato correttamente"}
     
 
-def mostra_classifica():
+async def mostra_classifica(payload: ClassificaRequest, db: AsyncSession) -> ClassificaResponse:
     """
-    (Placeholder) Mostra una classifica basata su criteri da definire.
+    Restituisce le prime posizioni della classifica per CO2 assorbita.
 
-    Questa funzione è un segnaposto per una futura implementazione che genererà
-    e restituirà una classifica, ad esempio degli utenti con il maggior assorbimento
-    di CO2 o dei terreni più produttivi.
+    La classifica è precalcolata nella tabella `leaderboard` (vedi `BackEnd.app.leaderboard`),
+    quindi la richiesta legge solo le righe richieste senza aggregare `weather_data`.
+
+    Args:
+        payload (ClassificaRequest): Criterio ("totale", "30giorni", "per_ettaro"),
+            ambito ("terreni" o "utenti") e numero di posizioni.
+        db (AsyncSession): La sessione asincrona del database.
+
+    Returns:
+        ClassificaResponse: Le posizioni ordinate della classifica.
+
+    Raises:
+        HTTPException: Se criterio o ambito non sono supportati.
     """
-    pass
+    try:
+        classifica = await get_leaderboard_top(db, payload.criterio, payload.ambito, payload.limite)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return ClassificaResponse(Classifica=classifica)
 
-class Esporta:
-    pass
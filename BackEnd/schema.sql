@@ -120,9 +120,152 @@ CREATE TABLE weather_data (
     precipitation FLOAT,
     solar_radiation FLOAT,
     humidity INTEGER,
+    meteo_factor FLOAT, -- fattore meteo normalizzato, calcolato all'acquisizione
     total_co2_absorption FLOAT,
-    total_o2_production FLOAT
+    total_o2_production FLOAT,
+    CONSTRAINT uq_weather_data_plot_time UNIQUE (plot_id, date_time) -- un'ora per terreno
 );
+-- Per un database esistente (le righe già salvate senza fattore lo ricalcolano in query):
+-- ALTER TABLE weather_data ADD COLUMN IF NOT EXISTS meteo_factor FLOAT;
+-- UPDATE weather_data SET meteo_factor =
+--     LEAST(COALESCE(solar_radiation, 0) / 800.0::float, 1.0)
+--     * LEAST(COALESCE(temperature, 0) / 25.0::float, 1.0)
+--     * LEAST(COALESCE(humidity, 0)::float / 60.0::float, 1.0)
+-- WHERE meteo_factor IS NULL;
+-- Vincolo unico su un database esistente (elimina prima le ore duplicate, tenendo la prima):
+-- DELETE FROM weather_data a USING weather_data b
+--     WHERE a.plot_id = b.plot_id AND a.date_time = b.date_time AND a.id > b.id;
+-- ALTER TABLE weather_data ADD CONSTRAINT uq_weather_data_plot_time UNIQUE (plot_id, date_time);
+
+-- Risultati CO2/O2 orari per specie (riempita da pipeline e backfill)
+DROP TABLE IF EXISTS plot_species_hourly CASCADE;
+CREATE TABLE plot_species_hourly (
+    plot_id INTEGER NOT NULL REFERENCES plots(id) ON DELETE CASCADE,
+    date_time TIMESTAMP NOT NULL,
+    species_id INTEGER NOT NULL REFERENCES species(id) ON DELETE CASCADE,
+    co2_kg FLOAT,
+    o2_kg FLOAT,
+    PRIMARY KEY (plot_id, date_time, species_id)
+);
+
+-- Rollup giornaliero di weather_data per terreno (aggiornato da pipeline e backfill).
+-- Per riempirla sullo storico esistente: python task_runner.py backfill-daily-stats
+DROP TABLE IF EXISTS plot_daily_stats CASCADE;
+CREATE TABLE plot_daily_stats (
+    plot_id INTEGER NOT NULL REFERENCES plots(id) ON DELETE CASCADE,
+    day DATE NOT NULL,
+    co2_sum FLOAT NOT NULL DEFAULT 0,
+    o2_sum FLOAT NOT NULL DEFAULT 0,
+    precipitation_sum FLOAT NOT NULL DEFAULT 0,
+    precipitation_count INTEGER NOT NULL DEFAULT 0,
+    temperature_max FLOAT,
+    temperature_min FLOAT,
+    hours_count INTEGER NOT NULL DEFAULT 0,
+    composition_version INTEGER NOT NULL DEFAULT 0, -- versione delle specie usata per il calcolo (-1: non ancora calcolato)
+    PRIMARY KEY (plot_id, day)
+);
+
+-- Versione della composizione specie di ogni terreno: incrementata quando cambia plot_species.
+-- I giorni di plot_daily_stats con composition_version inferiore (o -1) vanno ricalcolati
+-- (python task_runner.py recompute-dirty).
+DROP TABLE IF EXISTS plot_composition_versions CASCADE;
+CREATE TABLE plot_composition_versions (
+    plot_id INTEGER PRIMARY KEY REFERENCES plots(id) ON DELETE CASCADE,
+    version INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT NOW()
+);
+
+
+-- Classifica precalcolata di terreni (scope 'plot') e utenti (scope 'user') per CO2 assorbita,
+-- aggiornata dalla pipeline a partire da plot_daily_stats.
+DROP TABLE IF EXISTS leaderboard CASCADE;
+CREATE TABLE leaderboard (
+    scope VARCHAR(10) NOT NULL,
+    entity_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    co2_total FLOAT NOT NULL DEFAULT 0,
+    co2_30d FLOAT NOT NULL DEFAULT 0,
+    area_ha FLOAT NOT NULL DEFAULT 0,
+    co2_per_ha FLOAT NOT NULL DEFAULT 0,
+    rank_total INTEGER,
+    rank_30d INTEGER,
+    rank_per_ha INTEGER,
+    updated_at TIMESTAMP DEFAULT NOW(),
+    PRIMARY KEY (scope, entity_id)
+);
+CREATE INDEX ix_leaderboard_rank_total ON leaderboard (scope, rank_total);
+CREATE INDEX ix_leaderboard_rank_30d ON leaderboard (scope, rank_30d);
+CREATE INDEX ix_leaderboard_rank_per_ha ON leaderboard (scope, rank_per_ha);
+CREATE INDEX ix_leaderboard_user ON leaderboard (user_id);
+
+
+-- Confini di province e comuni, caricati da un GeoJSON locale (EPSG:4326):
+-- python task_runner.py load-regions --file province.geojson --level provincia
+DROP TABLE IF EXISTS regions CASCADE;
+CREATE TABLE regions (
+    id SERIAL PRIMARY KEY,
+    level VARCHAR(20) NOT NULL, -- 'provincia' o 'comune'
+    code VARCHAR(20) NOT NULL,
+    name VARCHAR(150) NOT NULL,
+    parent_code VARCHAR(20), -- codice della provincia, per i comuni
+    geom GEOMETRY(MULTIPOLYGON, 4326),
+    CONSTRAINT uq_regions_level_code UNIQUE (level, code)
+);
+CREATE INDEX idx_regions_geom ON regions USING GIST (geom);
+
+-- Provincia e comune del centroide di ogni terreno (assegnati una sola volta).
+DROP TABLE IF EXISTS plot_regions CASCADE;
+CREATE TABLE plot_regions (
+    plot_id INTEGER PRIMARY KEY REFERENCES plots(id) ON DELETE CASCADE,
+    provincia_id INTEGER REFERENCES regions(id) ON DELETE SET NULL,
+    comune_id INTEGER REFERENCES regions(id) ON DELETE SET NULL,
+    assigned_at TIMESTAMP DEFAULT NOW()
+);
+CREATE INDEX ix_plot_regions_provincia_id ON plot_regions (provincia_id);
+CREATE INDEX ix_plot_regions_comune_id ON plot_regions (comune_id);
+
+-- Rollup giornaliero di plot_daily_stats per provincia e comune (mappa nazionale).
+DROP TABLE IF EXISTS region_daily_stats CASCADE;
+CREATE TABLE region_daily_stats (
+    region_id INTEGER NOT NULL REFERENCES regions(id) ON DELETE CASCADE,
+    day DATE NOT NULL,
+    co2_sum FLOAT NOT NULL DEFAULT 0,
+    o2_sum FLOAT NOT NULL DEFAULT 0,
+    plots_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (region_id, day)
+);
+
+
+-- Registro dei crediti di carbonio (kg di CO2) per terreno: solo inserimenti, mai UPDATE/DELETE.
+DROP TABLE IF EXISTS credit_ledger CASCADE;
+CREATE TABLE credit_ledger (
+    id SERIAL PRIMARY KEY,
+    plot_id INTEGER NOT NULL REFERENCES plots(id) ON DELETE RESTRICT, -- i movimenti non si cancellano mai
+    entry_type VARCHAR(20) NOT NULL, -- 'generated', 'reserved', 'sold', 'retired'
+    amount_kg FLOAT NOT NULL,
+    order_id INTEGER, -- ordine del marketplace che ha originato il movimento
+    created_at TIMESTAMP DEFAULT NOW()
+);
+CREATE INDEX ix_credit_ledger_plot ON credit_ledger (plot_id, id);
+CREATE INDEX ix_credit_ledger_order_id ON credit_ledger (order_id);
+
+-- Saldo corrente dei crediti di ogni terreno, aggiornato con ogni movimento del registro.
+DROP TABLE IF EXISTS plot_credit_balances CASCADE;
+CREATE TABLE plot_credit_balances (
+    plot_id INTEGER PRIMARY KEY REFERENCES plots(id) ON DELETE CASCADE,
+    generated FLOAT NOT NULL DEFAULT 0,
+    reserved FLOAT NOT NULL DEFAULT 0,
+    sold FLOAT NOT NULL DEFAULT 0,
+    retired FLOAT NOT NULL DEFAULT 0,
+    available FLOAT NOT NULL DEFAULT 0, -- generated - reserved - sold - retired, mai sotto zero
+    updated_at TIMESTAMP DEFAULT NOW(),
+    CONSTRAINT ck_plot_credit_balances_available CHECK (available >= 0)
+);
+-- Per un database esistente (i saldi negativi vengono portati a zero):
+-- ALTER TABLE credit_ledger DROP CONSTRAINT credit_ledger_plot_id_fkey,
+--     ADD CONSTRAINT credit_ledger_plot_id_fkey FOREIGN KEY (plot_id) REFERENCES plots(id) ON DELETE RESTRICT;
+-- UPDATE plot_credit_balances SET available = 0 WHERE available < 0;
+-- ALTER TABLE plot_credit_balances ADD CONSTRAINT ck_plot_credit_balances_available CHECK (available >= 0);
 
 
 -- database co2app già creato
@@ -0,0 +1,84 @@
+"""
+Il motore vettoriale deve dare esattamente gli stessi valori del vecchio ciclo
+scalare (specie × ore con `round(x, 5)`), compresi i casi di parità.
+"""
+
+import random
+from datetime import datetime, timedelta
+import numpy as np
+import pytest
+from BackEnd.app.co2_o2_calculator import (
+    calculate_co2_o2_hourly, _round_like_python,
+    DEFAULT_TEMPERATURE, DEFAULT_HUMIDITY,
+    RADIATION_NORMALIZER, TEMPERATURE_NORMALIZER, HUMIDITY_NORMALIZER
+)
+
+
+def scalar_co2_o2_hourly(plants, hourly_weather, coefficients):
+    """Il calcolo per riga precedente al motore NumPy, usato come riferimento."""
+    results = []
+    for plant in plants:
+        species = plant.get("species", "").lower()
+        area = plant.get("area_m2", 0)
+        if species not in coefficients:
+            continue
+        co2_factor = coefficients[species].get("co2", 0)
+        o2_factor = coefficients[species].get("o2", 0)
+        for hour in hourly_weather:
+            radiation = hour.get("radiation", 0)
+            temperature = hour.get("temperature", DEFAULT_TEMPERATURE)
+            humidity = hour.get("humidity", DEFAULT_HUMIDITY)
+            rad_factor = min(radiation / RADIATION_NORMALIZER, 1.0) if radiation is not None else 0
+            temp_factor = min(temperature / TEMPERATURE_NORMALIZER, 1.0) if temperature is not None else 0
+            hum_factor = min(humidity / HUMIDITY_NORMALIZER, 1.0) if humidity is not None else 0
+            meteo_factor = rad_factor * temp_factor * hum_factor
+            results.append({
+                "species": species,
+                "datetime": hour.get("datetime"),
+                "co2_kg_hour": round(area * co2_factor * meteo_factor, 5),
+                "o2_kg_hour": round(area * o2_factor * meteo_factor, 5)
+            })
+    return results
+
+
+def random_inputs(rng: random.Random, quantized: bool):
+    """Piante, meteo e coefficienti casuali; `quantized` usa pochi decimali per cadere spesso a metà."""
+    def value(low, high, digits):
+        return round(rng.uniform(low, high), digits) if quantized else rng.uniform(low, high)
+
+    names = [f"specie_{i}" for i in range(rng.randint(1, 6))]
+    coefficients = {name: {"co2": value(0, 0.05, 3), "o2": value(0, 0.04, 3)} for name in names}
+    plants = [{"species": rng.choice(names + ["sconosciuta"]).upper(), "area_m2": value(0, 5000, 1)} for _ in range(rng.randint(1, 8))]
+
+    start = datetime(2024, 6, 1)
+    weather = []
+    for h in range(rng.randint(1, 48)):
+        hour = {"datetime": start + timedelta(hours=h)}
+        for key, high in (("radiation", 1200), ("temperature", 40), ("humidity", 100)):
+            roll = rng.random()
+            if roll < 0.05:
+                hour[key] = None
+            elif roll > 0.1:
+                hour[key] = value(0, high, 0)
+        weather.append(hour)
+    return plants, weather, coefficients
+
+
+@pytest.mark.parametrize("quantized", [False, True])
+def test_matrix_matches_scalar_loop_exactly(quantized):
+    rng = random.Random(42)
+    for _ in range(300):
+        plants, weather, coefficients = random_inputs(rng, quantized)
+        assert calculate_co2_o2_hourly(plants, weather, coefficients) == scalar_co2_o2_hourly(plants, weather, coefficients)
+
+
+def test_round_like_python_on_ties():
+    # Metà decimali (non rappresentabili esattamente) e metà esatte in binario
+    ties = [k / 100000 + 0.000005 for k in range(-2000, 2000)]
+    ties += [0.000125, 1.234565, 2.675, 0.5, 1.5, 2.5, -0.5, 1e-5 / 2, 3 * 2 ** -20]
+    rng = random.Random(7)
+    randoms = [rng.uniform(-1e4, 1e4) for _ in range(20000)] + [rng.uniform(-1, 1) for _ in range(20000)]
+    values = np.array(ties + randoms + [0.0, -0.0, 1e12, -1e12])
+
+    rounded = _round_like_python(values)
+    assert rounded.tolist() == [round(v, 5) for v in values.tolist()]
@@ -0,0 +1,155 @@
+"""
+Il motore SQL deve restituire gli stessi totali del motore Python sulle stesse righe.
+
+Serve un Postgres raggiungibile con `TEST_DATABASE_URL` (URL asyncpg, ad esempio
+postgresql+asyncpg://postgres@localhost/test); senza, i test vengono saltati. Le
+tabelle sono temporanee, create e scartate nella connessione del test: il database
+non viene modificato e PostGIS non serve.
+"""
+
+import asyncio
+import os
+import random
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+import pytest
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from BackEnd.app.co2_o2_calculator import get_weather_species_rows_from_db, get_weather_data_from_db, calculate_co2_o2_batch, compute_meteo_factor, DATETIME_FORMAT
+from BackEnd.app.co2_sql_engine import calculate_co2_o2_sql, check_sql_engine_parity, sql_rows_to_result, PARITY_TOLERANCE_KG
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+pytestmark = pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL non impostato")
+
+START = date(2024, 6, 1)
+END = date(2024, 6, 3)
+
+# Stesse colonne di schema.sql, senza vincoli verso plots (e quindi senza PostGIS)
+FIXTURE_DDL = [
+    """CREATE TEMP TABLE species (
+        id INTEGER PRIMARY KEY, name VARCHAR(100) NOT NULL,
+        co2_absorption_rate FLOAT, o2_production_rate FLOAT)""",
+    """CREATE TEMP TABLE plot_species (
+        id SERIAL PRIMARY KEY, plot_id INTEGER, species_id INTEGER, surface_area FLOAT)""",
+    """CREATE TEMP TABLE weather_data (
+        id SERIAL PRIMARY KEY, plot_id INTEGER, date_time TIMESTAMP NOT NULL,
+        temperature FLOAT, precipitation FLOAT, solar_radiation FLOAT, humidity INTEGER,
+        meteo_factor FLOAT, total_co2_absorption FLOAT, total_o2_production FLOAT)""",
+]
+
+
+def fixture_rows(rng: random.Random):
+    """Specie, composizioni e meteo orario di 4 terreni (uno senza specie, uno con area nulla)."""
+    species = [
+        {"id": i, "name": f"Specie {i}", "co2": round(rng.uniform(0.001, 0.05), 4), "o2": round(rng.uniform(0.001, 0.04), 4)}
+        for i in range(1, 6)
+    ]
+    species.append({"id": 6, "name": "Senza coefficienti", "co2": None, "o2": None})
+
+    plot_species = [
+        {"plot_id": 1, "species_id": 1, "area": 1200.0},
+        {"plot_id": 1, "species_id": 2, "area": 350.5},
+        {"plot_id": 1, "species_id": 6, "area": 80.0},
+        {"plot_id": 2, "species_id": 3, "area": 5000.0},
+        {"plot_id": 2, "species_id": 4, "area": 0.0},
+        {"plot_id": 3, "species_id": 5, "area": 42.25},
+        {"plot_id": 3, "species_id": 5, "area": 17.75},
+    ]
+
+    weather = []
+    for plot_id in (1, 2, 3, 4):
+        hour = datetime.combine(START, datetime.min.time())
+        while hour.date() <= END:
+            radiation = rng.choice([None, 0.0, round(rng.uniform(0, 1100), 1)])
+            temperature = rng.choice([None, round(rng.uniform(-5, 38), 1)])
+            humidity = rng.choice([None, rng.randint(10, 100)])
+            # Metà delle ore con il fattore salvato, l'altra metà calcolata in query
+            factor = compute_meteo_factor(radiation, temperature, humidity) if rng.random() < 0.5 else None
+            weather.append({
+                "plot_id": plot_id, "date_time": hour, "temperature": temperature,
+                "radiation": radiation, "humidity": humidity, "factor": factor,
+            })
+            hour += timedelta(hours=1)
+    return species, plot_species, weather
+
+
+async def with_fixture(check):
+    """Crea le tabelle temporanee con i dati di prova ed esegue `check(session)`."""
+    engine = create_async_engine(TEST_DATABASE_URL)
+    try:
+        async with engine.connect() as conn:
+            for ddl in FIXTURE_DDL:
+                await conn.execute(text(ddl))
+            species, plot_species, weather = fixture_rows(random.Random(2024))
+            await conn.execute(
+                text("INSERT INTO species VALUES (:id, :name, :co2, :o2)"), species
+            )
+            await conn.execute(
+                text("INSERT INTO plot_species (plot_id, species_id, surface_area) VALUES (:plot_id, :species_id, :area)"),
+                plot_species
+            )
+            await conn.execute(
+                text(
+                    "INSERT INTO weather_data (plot_id, date_time, temperature, solar_radiation, humidity, meteo_factor) "
+                    "VALUES (:plot_id, :date_time, :temperature, :radiation, :humidity, :factor)"
+                ),
+                weather
+            )
+            async with AsyncSession(bind=conn) as session:
+                await check(session)
+    finally:
+        await engine.dispose()
+
+
+def test_sql_engine_matches_python_engine_per_hour():
+    async def check(session):
+        python_rows = calculate_co2_o2_batch(await get_weather_species_rows_from_db(session, START, END)).per_plot_hour()
+        sql_rows = await calculate_co2_o2_sql(session, START, END, bucket="hour")
+
+        python_totals = {(plot_id, hour): (co2, o2) for plot_id, hour, co2, o2 in python_rows}
+        sql_totals = {(plot_id, hour): (co2, o2) for plot_id, hour, co2, o2 in sql_rows}
+        assert python_totals.keys() == sql_totals.keys()
+        assert {plot_id for plot_id, _ in sql_totals} == {1, 2, 3, 4}
+        for key, (co2, o2) in python_totals.items():
+            assert sql_totals[key][0] == pytest.approx(co2, abs=PARITY_TOLERANCE_KG)
+            assert sql_totals[key][1] == pytest.approx(o2, abs=PARITY_TOLERANCE_KG)
+
+        report = await check_sql_engine_parity(session, START, END)
+        assert report["ok"], report
+
+    asyncio.run(with_fixture(check))
+
+
+def test_sql_engine_day_buckets_sum_python_hours():
+    async def check(session):
+        python_rows = calculate_co2_o2_batch(await get_weather_species_rows_from_db(session, START, END, [1, 3])).per_plot_hour()
+        daily = defaultdict(lambda: [0.0, 0.0])
+        for plot_id, hour, co2, o2 in python_rows:
+            daily[(plot_id, hour.date())][0] += co2
+            daily[(plot_id, hour.date())][1] += o2
+
+        sql_rows = await calculate_co2_o2_sql(session, START, END, [1, 3], bucket="day")
+        assert {(plot_id, day.date()) for plot_id, day, _, _ in sql_rows} == set(daily)
+        for plot_id, day, co2, o2 in sql_rows:
+            expected_co2, expected_o2 = daily[(plot_id, day.date())]
+            assert co2 == pytest.approx(expected_co2, abs=24 * PARITY_TOLERANCE_KG)
+            assert o2 == pytest.approx(expected_o2, abs=24 * PARITY_TOLERANCE_KG)
+
+    asyncio.run(with_fixture(check))
+
+
+def test_sql_result_has_calcola_co2_format():
+    async def check(session):
+        python_rows = calculate_co2_o2_batch(await get_weather_species_rows_from_db(session, START, START, [1])).per_plot_hour()
+        weather = await get_weather_data_from_db(session, 1, START.isoformat())
+        records = sql_rows_to_result(await calculate_co2_o2_sql(session, START, START, [1]), weather).hourly_records()
+
+        assert len(records) == len(python_rows) == 24
+        for record, (_, hour, co2, o2), meteo in zip(records, python_rows, weather):
+            assert record["datetime"] == hour.strftime(DATETIME_FORMAT)
+            assert record["co2_kg_hour"] == pytest.approx(co2, abs=PARITY_TOLERANCE_KG)
+            assert record["o2_kg_hour"] == pytest.approx(o2, abs=PARITY_TOLERANCE_KG)
+            assert record["temperatura_c"] == meteo["temperature"]
+
+    asyncio.run(with_fixture(check))
@@ -0,0 +1,125 @@
+"""
+Solo il calcolo CO2/O2 deve registrare la versione della composizione specie nel rollup:
+acquisizione meteo e backfill non possono far passare per attuali totali superati.
+
+Serve un Postgres raggiungibile con `TEST_DATABASE_URL`; senza, i test vengono saltati.
+Le tabelle sono temporanee e PostGIS non serve.
+"""
+
+import asyncio
+import os
+from datetime import date, datetime, timedelta
+import pytest
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from BackEnd.app.daily_stats import refresh_daily_stats, backfill_daily_stats, NOT_COMPUTED_VERSION
+from BackEnd.app.composition import get_dirty_plots
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+pytestmark = pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL non impostato")
+
+DAY = date(2024, 6, 1)
+
+# Stesse colonne di schema.sql, senza vincoli verso plots (e quindi senza PostGIS)
+FIXTURE_DDL = [
+    """CREATE TEMP TABLE weather_data (
+        id SERIAL PRIMARY KEY, plot_id INTEGER, date_time TIMESTAMP NOT NULL,
+        temperature FLOAT, precipitation FLOAT, solar_radiation FLOAT, humidity INTEGER,
+        meteo_factor FLOAT, total_co2_absorption FLOAT, total_o2_production FLOAT)""",
+    """CREATE TEMP TABLE plot_daily_stats (
+        plot_id INTEGER NOT NULL, day DATE NOT NULL,
+        co2_sum FLOAT NOT NULL DEFAULT 0, o2_sum FLOAT NOT NULL DEFAULT 0,
+        precipitation_sum FLOAT NOT NULL DEFAULT 0, precipitation_count INTEGER NOT NULL DEFAULT 0,
+        temperature_max FLOAT, temperature_min FLOAT, hours_count INTEGER NOT NULL DEFAULT 0,
+        composition_version INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (plot_id, day))""",
+    """CREATE TEMP TABLE plot_composition_versions (
+        plot_id INTEGER PRIMARY KEY, version INTEGER NOT NULL DEFAULT 0, updated_at TIMESTAMP DEFAULT NOW())""",
+]
+
+
+async def add_hours(session, plot_id: int, day: date, hours: range):
+    await session.execute(
+        text("INSERT INTO weather_data (plot_id, date_time, temperature, total_co2_absorption) VALUES (:plot_id, :date_time, 20, 1)"),
+        [{"plot_id": plot_id, "date_time": datetime.combine(day, datetime.min.time()) + timedelta(hours=h)} for h in hours]
+    )
+
+
+async def set_version(session, plot_id: int, version: int):
+    await session.execute(
+        text("INSERT INTO plot_composition_versions (plot_id, version) VALUES (:plot_id, :version) "
+             "ON CONFLICT (plot_id) DO UPDATE SET version = EXCLUDED.version"),
+        {"plot_id": plot_id, "version": version}
+    )
+
+
+async def stored_version(session, plot_id: int, day: date):
+    return (await session.execute(
+        text("SELECT composition_version FROM plot_daily_stats WHERE plot_id = :plot_id AND day = :day"),
+        {"plot_id": plot_id, "day": day}
+    )).scalar()
+
+
+async def with_fixture(check):
+    """Crea le tabelle temporanee ed esegue `check(session)`."""
+    engine = create_async_engine(TEST_DATABASE_URL)
+    try:
+        async with engine.connect() as conn:
+            for ddl in FIXTURE_DDL:
+                await conn.execute(text(ddl))
+            async with AsyncSession(bind=conn) as session:
+                await check(session)
+    finally:
+        await engine.dispose()
+
+
+def test_ingest_does_not_mark_stale_day_as_computed():
+    async def check(session):
+        await set_version(session, 1, 2)
+        await add_hours(session, 1, DAY, range(24))
+
+        # Nuovo giorno acquisito: riassunto ma non calcolato, quindi sporco
+        await refresh_daily_stats(session, DAY, DAY, [1])
+        assert await stored_version(session, 1, DAY) == NOT_COMPUTED_VERSION
+        assert 1 in await get_dirty_plots(session)
+
+        # Calcolo: registra la versione corrente
+        await refresh_daily_stats(session, DAY, DAY, [1], computed=True)
+        assert await stored_version(session, 1, DAY) == 2
+        assert await get_dirty_plots(session) == {}
+
+        # Specie modificate, poi il giorno viene riacquisito: resta sporco
+        await set_version(session, 1, 3)
+        await refresh_daily_stats(session, DAY, DAY, [1])
+        assert await stored_version(session, 1, DAY) == 2
+        assert await get_dirty_plots(session) == {1: (DAY, DAY)}
+
+    asyncio.run(with_fixture(check))
+
+
+def test_new_hours_reset_computed_day():
+    async def check(session):
+        await add_hours(session, 1, DAY, range(12))
+        await refresh_daily_stats(session, DAY, DAY, [1], computed=True)
+        assert await stored_version(session, 1, DAY) == 0
+
+        await add_hours(session, 1, DAY, range(12, 24))
+        await refresh_daily_stats(session, DAY, DAY, [1])
+        assert await stored_version(session, 1, DAY) == NOT_COMPUTED_VERSION
+
+    asyncio.run(with_fixture(check))
+
+
+def test_backfill_adds_days_as_not_computed():
+    async def check(session):
+        await set_version(session, 2, 1)
+        await add_hours(session, 1, DAY, range(24))
+        await add_hours(session, 2, DAY + timedelta(days=1), range(24))
+
+        assert await backfill_daily_stats(session) == 2
+        assert await stored_version(session, 1, DAY) == NOT_COMPUTED_VERSION
+        assert await stored_version(session, 2, DAY + timedelta(days=1)) == NOT_COMPUTED_VERSION
+        assert set(await get_dirty_plots(session)) == {1, 2}
+        assert await backfill_daily_stats(session) == 0
+
+    asyncio.run(with_fixture(check))
@@ -0,0 +1,107 @@
+"""
+Ritentativi di `get_json` contro un transport finto (`httpx.MockTransport`): nessuna
+richiesta esce dal processo e `asyncio.sleep` viene sostituito per registrare le attese.
+"""
+
+import asyncio
+import httpx
+import pytest
+from BackEnd.app import http_client
+from BackEnd.app.http_client import get_json, create_http_client, HTTP_RETRY_MAX_DELAY_SECONDS
+
+URL = "https://open-meteo.test/v1/forecast"
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Attese richieste da `get_json`, senza aspettare davvero."""
+    delays = []
+
+    async def fake_sleep(delay):
+        delays.append(delay)
+
+    monkeypatch.setattr(http_client.asyncio, "sleep", fake_sleep)
+    return delays
+
+
+def run_get_json(responses, **kwargs):
+    """Esegue `get_json` rispondendo in ordine con `responses` (risposte o eccezioni)."""
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        item = responses[len(requests) - 1]
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    async def call():
+        async with create_http_client(transport=httpx.MockTransport(handler)) as client:
+            return await get_json(URL, params={"latitude": 45.0}, client=client, **kwargs)
+
+    try:
+        return asyncio.run(call()), requests
+    except Exception as e:
+        e.requests = requests
+        raise
+
+
+def test_retries_temporary_statuses_then_returns_json(sleeps):
+    body, requests = run_get_json([
+        httpx.Response(429),
+        httpx.Response(503),
+        httpx.Response(200, json={"hourly": {"time": []}}),
+    ], backoff=1.0)
+
+    assert body == {"hourly": {"time": []}}
+    assert len(requests) == 3
+    assert requests[0].url.params["latitude"] == "45.0"
+    assert sleeps == [1.0, 2.0]
+
+
+def test_honours_retry_after_with_cap(sleeps):
+    run_get_json([
+        httpx.Response(429, headers={"Retry-After": "7"}),
+        httpx.Response(503, headers={"Retry-After": "3600"}),
+        httpx.Response(200, json={}),
+    ])
+
+    assert sleeps == [7.0, HTTP_RETRY_MAX_DELAY_SECONDS]
+
+
+def test_backoff_is_capped(sleeps):
+    run_get_json([httpx.Response(500)] * 4 + [httpx.Response(200, json={})], attempts=5, backoff=10.0)
+
+    assert sleeps == [10.0, 20.0, HTTP_RETRY_MAX_DELAY_SECONDS, HTTP_RETRY_MAX_DELAY_SECONDS]
+
+
+def test_raises_status_error_after_last_attempt(sleeps):
+    with pytest.raises(httpx.HTTPStatusError) as exc_info:
+        run_get_json([httpx.Response(502)] * 3, attempts=3, backoff=0)
+
+    assert exc_info.value.response.status_code == 502
+    assert len(exc_info.value.requests) == 3
+    assert len(sleeps) == 2
+
+
+def test_does_not_retry_client_errors(sleeps):
+    with pytest.raises(httpx.HTTPStatusError) as exc_info:
+        run_get_json([httpx.Response(404), httpx.Response(200, json={})])
+
+    assert exc_info.value.response.status_code == 404
+    assert len(exc_info.value.requests) == 1
+    assert sleeps == []
+
+
+def test_retries_transport_errors_then_reraises(sleeps):
+    with pytest.raises(httpx.ConnectError):
+        run_get_json([httpx.ConnectError("connessione rifiutata")] * 2, attempts=2, backoff=0.5)
+
+    assert sleeps == [0.5]
+
+
+def test_recovers_after_transport_error(sleeps):
+    body, requests = run_get_json([httpx.ReadTimeout("timeout"), httpx.Response(200, json={"ok": True})], backoff=0)
+
+    assert body == {"ok": True}
+    assert len(requests) == 2
@@ -1,12 +1,30 @@
 # task_runner.py
+#
+# Uso:
+#   python task_runner.py                      -> pipeline giornaliera (meteo + CO2/O2 di oggi)
+#   python task_runner.py backfill --start 2025-04-01 --end 2025-09-30 [--plots 1 2] [--chunk-days 7] [--workers 8]
+#   python task_runner.py recompute-dirty     -> ricalcola solo i plot con specie modificate
+#   python task_runner.py backfill-daily-stats -> crea il rollup giornaliero dello storico non ancora riassunto
+#   python task_runner.py load-regions --file comuni.geojson --level comune  -> confini per la mappa CO2
+#   python task_runner.py check-sql-engine --start 2025-06-01 --end 2025-06-07  -> esce con 1 se il motore SQL non è allineato
 import os
-from datetime import datetime
+import sys
+import argparse
+from datetime import datetime, date
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy import select, func
 from BackEnd.app.get_all_plots import get_all_plots_coords
 from BackEnd.app.get_meteo import fetch_and_save_weather_day
-from BackEnd.app.co2_o2_calculator import aggiorna_weatherdata_con_assorbimenti
-from BackEnd.app.models import WeatherData
+from BackEnd.app.http_client import start_http_client, close_http_client
+from BackEnd.app.co2_o2_calculator import aggiorna_weatherdata_batch, aggiorna_weatherdata_range, BACKFILL_CHUNK_DAYS
+from BackEnd.app.models import WeatherData, Plot
+from BackEnd.app.composition import recompute_dirty_plots
+from BackEnd.app.daily_stats import backfill_daily_stats
+from BackEnd.app.leaderboard import refresh_leaderboard
+from BackEnd.app.regions import load_regions_geojson, rebuild_region_daily_stats, assign_plot_regions, refresh_region_daily_stats
+from BackEnd.app.parallel_backfill import run_parallel_backfill
+from BackEnd.app.credits import record_generated_credits, rebuild_credit_balances
+from BackEnd.app.co2_sql_engine import check_sql_engine_parity
 from dotenv import load_dotenv
 
 load_dotenv(".env")
@@ -45,6 +63,7 @@ async def has_today_data(session, plot_id: int, date_str: str) -> bool:
 async def run_meteo_pipeline():
     async with Session() as session:
         plots = await get_all_plots_coords(session)
+        updated_plots = []
         for plot in plots:
             plot_id = plot["plot_id"]
             lat = plot["lat"]
@@ -59,25 +78,170 @@ async def run_meteo_pipeline():
             try:
                 ok = await fetch_and_save_weather_day(session, plot_id, lat, lon)
                 if ok:
-                    await aggiorna_weatherdata_con_assorbimenti(session, plot_id, today)
                     await session.commit()
-                    print(f"✅ CO2/O2 aggiornati per plot {plot_id}")
+                    updated_plots.append(plot_id)
                 else:
                     print(f"⚠️ Meteo non aggiornato per plot {plot_id}")
             except Exception as e:
+                await session.rollback()
                 print(f"❌ Errore per plot {plot_id}: {e}")
 
+        if not updated_plots:
+            print("ℹ️ Nessun plot con nuovi dati meteo, calcolo CO2/O2 non necessario")
+            return
+
+        # CO2/O2 di tutti i plot aggiornati: una query di lettura e un UPDATE set-based
+        try:
+            hours = await aggiorna_weatherdata_batch(session, date.fromisoformat(today), plot_ids=updated_plots)
+            await session.commit()
+            print(f"✅ CO2/O2 aggiornati per {len(updated_plots)} plot ({hours} ore)")
+        except Exception as e:
+            await session.rollback()
+            print(f"❌ Errore nel calcolo CO2/O2: {e}")
+
+async def run_backfill(start: date, end: date, plot_ids=None, chunk_days: int = BACKFILL_CHUNK_DAYS):
+    """Ricalcola CO2/O2 per un intervallo di giorni, con commit dopo ogni blocco."""
+    async with Session() as session:
+        print(f"🔁 Backfill CO2/O2 dal {start} al {end} | plot: {plot_ids or 'tutti'} | blocchi da {chunk_days} giorni")
+        updated = await aggiorna_weatherdata_range(
+            session, start, end, plot_ids=plot_ids, chunk_days=chunk_days, commit=True
+        )
+        print(f"✅ Backfill completato: {updated} ore aggiornate")
+
+async def run_parallel(start: date, end: date, plot_ids=None, chunk_days: int = BACKFILL_CHUNK_DAYS, workers: int = 2):
+    """Backfill con i plot suddivisi tra `workers` processi; la classifica è aggiornata alla fine."""
+    async with Session() as session:
+        if plot_ids is None:
+            plot_ids = list((await session.execute(select(Plot.id))).scalars().all())
+        print(f"🔁 Backfill parallelo CO2/O2 dal {start} al {end} | {len(plot_ids)} plot | {workers} worker")
+
+        def report(done, total, hours, elapsed):
+            eta = elapsed / done * (total - done) if done else 0
+            print(f"   {done}/{total} plot | {hours} ore | {elapsed:.0f}s trascorsi, ~{eta:.0f}s rimanenti")
+
+        updated = await asyncio.to_thread(
+            run_parallel_backfill, DATABASE_URL, plot_ids, start, end,
+            workers=workers, chunk_days=chunk_days, progress=report
+        )
+        await refresh_leaderboard(session, plot_ids)
+        await assign_plot_regions(session, plot_ids)
+        await refresh_region_daily_stats(session, start, end, plot_ids)
+        await record_generated_credits(session, plot_ids)
+        await session.commit()
+        print(f"✅ Backfill completato: {updated} ore aggiornate")
+
+async def run_recompute_dirty(chunk_days: int = BACKFILL_CHUNK_DAYS):
+    """Ricalcola CO2/O2 dei plot la cui composizione specie è cambiata dopo l'ultimo calcolo."""
+    async with Session() as session:
+        stats = await recompute_dirty_plots(session, chunk_days=chunk_days, commit=True)
+        if stats["plots"]:
+            print(f"✅ Ricalcolati {stats['plots']} plot con specie modificate ({stats['hours']} ore)")
+        else:
+            print("ℹ️ Nessun plot con specie modificate da ricalcolare")
+
+async def run_backfill_daily_stats():
+    """Crea le righe di plot_daily_stats mancanti per lo storico meteo mai riassunto."""
+    async with Session() as session:
+        days = await backfill_daily_stats(session, commit=True)
+        print(f"✅ Rollup giornaliero completato: {days} giorni aggiunti")
+
+async def run_load_regions(path: str, level: str, name_field=None, code_field=None, parent_field=None):
+    """Carica i confini di province o comuni e ricostruisce gli aggregati per la mappa."""
+    async with Session() as session:
+        loaded = await load_regions_geojson(session, path, level, name_field, code_field, parent_field)
+        await rebuild_region_daily_stats(session)
+        await session.commit()
+        print(f"✅ Caricati {loaded} confini ({level}) e ricostruiti gli aggregati regionali")
+
+async def run_rebuild_credits():
+    """Ricostruisce i saldi dei crediti di carbonio rileggendo il registro dei movimenti."""
+    async with Session() as session:
+        await rebuild_credit_balances(session)
+        await session.commit()
+        print("✅ Saldi dei crediti ricostruiti dal registro")
+
+async def run_check_sql_engine(start: date, end: date, plot_ids=None):
+    """Confronta i totali orari del motore SQL con quelli del motore Python."""
+    async with Session() as session:
+        report = await check_sql_engine_parity(session, start, end, plot_ids)
+        print(f"{'✅' if report['ok'] else '❌'} {report['ore']} ore confrontate | differenza max {report['differenza_max']:.2e} kg | {report['ore_mancanti']} ore mancanti")
+        for plot_id, hour, python_co2, sql_co2 in report["fuori_tolleranza"]:
+            print(f"   plot {plot_id} {hour}: Python {python_co2} / SQL {sql_co2}")
+        return report["ok"]
+
 # Aggiungi cleanup esplicito
 async def cleanup():
     """Chiude tutte le connessioni e risorse"""
+    await close_http_client()
     if 'engine' in globals():
         await engine.dispose()
     print("🧹 Cleanup completato")
 
-if __name__ == "__main__":
+def parse_args():
+    parser = argparse.ArgumentParser(description="Task schedulati di Airvana")
+    subparsers = parser.add_subparsers(dest="command")
+
+    subparsers.add_parser("pipeline", help="Scarica il meteo di oggi e calcola CO2/O2 (default)")
+
+    backfill = subparsers.add_parser("backfill", help="Ricalcola CO2/O2 su un intervallo di giorni")
+    backfill.add_argument("--start", type=date.fromisoformat, required=True, help="Primo giorno (YYYY-MM-DD)")
+    backfill.add_argument("--end", type=date.fromisoformat, required=True, help="Ultimo giorno (YYYY-MM-DD)")
+    backfill.add_argument("--plots", type=int, nargs="+", default=None, help="ID dei terreni (default: tutti)")
+    backfill.add_argument("--chunk-days", type=int, default=BACKFILL_CHUNK_DAYS, help="Giorni caricati per blocco")
+    backfill.add_argument("--workers", type=int, default=1, help="Processi paralleli, plot suddivisi tra i worker (default: 1)")
+
+    recompute = subparsers.add_parser("recompute-dirty", help="Ricalcola solo i plot con specie modificate")
+    recompute.add_argument("--chunk-days", type=int, default=BACKFILL_CHUNK_DAYS, help="Giorni caricati per blocco")
+
+    subparsers.add_parser("backfill-daily-stats", help="Crea il rollup giornaliero dello storico non ancora riassunto")
+
+    regions = subparsers.add_parser("load-regions", help="Carica i confini di province o comuni da un GeoJSON (EPSG:4326)")
+    regions.add_argument("--file", required=True, help="Percorso del file GeoJSON")
+    regions.add_argument("--level", choices=["provincia", "comune"], required=True, help="Livello dei confini")
+    regions.add_argument("--name-field", default=None, help="Proprietà con il nome (default ISTAT: DEN_UTS / COMUNE)")
+    regions.add_argument("--code-field", default=None, help="Proprietà con il codice (default ISTAT: COD_UTS / PRO_COM_T)")
+    regions.add_argument("--parent-field", default=None, help="Proprietà con il codice della provincia (solo comuni, default COD_UTS)")
+
+    subparsers.add_parser("rebuild-credits", help="Ricostruisce i saldi dei crediti dal registro dei movimenti")
+
+    parity = subparsers.add_parser("check-sql-engine", help="Confronta il motore di calcolo SQL con quello Python")
+    parity.add_argument("--start", type=date.fromisoformat, required=True, help="Primo giorno (YYYY-MM-DD)")
+    parity.add_argument("--end", type=date.fromisoformat, required=True, help="Ultimo giorno (YYYY-MM-DD)")
+    parity.add_argument("--plots", type=int, nargs="+", default=None, help="ID dei terreni (default: tutti)")
+
+    return parser.parse_args()
+
+async def main(args) -> int:
+    """Esegue il comando richiesto e restituisce il codice di uscita (1 se il controllo fallisce)."""
+    await start_http_client()
     try:
-        asyncio.run(run_meteo_pipeline())
+        if args.command == "backfill" and args.workers > 1:
+            await run_parallel(args.start, args.end, args.plots, args.chunk_days, args.workers)
+        elif args.command == "backfill":
+            await run_backfill(args.start, args.end, args.plots, args.chunk_days)
+        elif args.command == "load-regions":
+            await run_load_regions(args.file, args.level, args.name_field, args.code_field, args.parent_field)
+        elif args.command == "recompute-dirty":
+            await run_recompute_dirty(args.chunk_days)
+        elif args.command == "backfill-daily-stats":
+            await run_backfill_daily_stats()
+        elif args.command == "rebuild-credits":
+            await run_rebuild_credits()
+        elif args.command == "check-sql-engine":
+            if not await run_check_sql_engine(args.start, args.end, args.plots):
+                return 1
+        else:
+            await run_meteo_pipeline()
+            await run_recompute_dirty()
     finally:
         # Assicurati che il cleanup venga eseguito anche se ci sono errori
-        asyncio.run(cleanup())
+        await cleanup()
+    return 0
+
+if __name__ == "__main__":
+    exit_code = asyncio.run(main(parse_args()))
+    if exit_code == 0:
         print("🏁 Pipeline completata con successo!")
+    else:
+        print("❌ Pipeline terminata con errori")
+    sys.exit(exit_code)